@@ -1,11 +1,36 @@
+import os
+from asyncio import iscoroutinefunction
+from contextlib import nullcontext
+from contextvars import ContextVar
+from datetime import date, datetime, time
+from functools import wraps
+from hashlib import md5
 from importlib import import_module
-from fastapi import FastAPI, Request, File, UploadFile
+from inspect import signature
+from mimetypes import guess_type
+from typing import Any, AsyncContextManager, AsyncIterator, Callable, Dict, \
+    List, Optional, Tuple, Union
+import anyio
+from fastapi import FastAPI, HTTPException, Request, File, Query, \
+    UploadFile
 from fastapi import responses, status
 from fastapi.background import BackgroundTasks
-from utils.config import debug
+from fastapi.datastructures import DefaultPlaceholder
+from fastapi.encoders import jsonable_encoder
+from fastapi.routing import APIRoute
+from pydantic import parse_obj_as
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from utils.cache import Cache
+from utils import imaging
+from utils.compression import CompressionMiddleware
+from utils.config import debug, compression
 from utils.database.session import Session
 from utils.schedule import ConcurrencyScheduler
-from utils.general import markdown_html
+from utils.storage import LocalBackend, storage_backend
+from utils.general import markdown_html, quality_values
+from utils.pydantic import include_fields, orm_response_encoder, \
+    unknown_fields
 from constants import ROOT_DIR, __version__, README, TODO
 
 response_class_choices = {
@@ -22,6 +47,414 @@ for module, _class in response_class_choices.items():
         response_class = _class
         break
 
+try:
+    import msgpack
+except ModuleNotFoundError:
+    msgpack = None
+
+MSGPACK_MEDIA_TYPES = ('application/msgpack', 'application/x-msgpack')
+# whether response to current request is MessagePack, see "MsgPackMiddleware"
+_msgpack_response: ContextVar[bool] = ContextVar('msgpack_response',
+                                                 default=False)
+
+
+def _msgpack_default(obj: Any) -> Any:
+    # same text as JSON encoders give
+    if isinstance(obj, (datetime, date, time)):
+        return obj.isoformat()
+    raise TypeError(f'Type is not MessagePack serializable: {type(obj)}')
+
+
+class NegotiatedResponse(response_class):
+    """ Response of "response_class", or MessagePack of the same layout if
+    request prefers it.
+    """
+    def render(self, content: Any) -> bytes:
+        if _msgpack_response.get() is True:
+            self.media_type = MSGPACK_MEDIA_TYPES[0]
+            return msgpack.packb(content, default=_msgpack_default)
+        return super().render(content)
+
+
+def negotiated_media_type() -> str:
+    if _msgpack_response.get() is True:
+        return MSGPACK_MEDIA_TYPES[0]
+    return response_class.media_type
+
+
+def accepts_msgpack(accept: str) -> bool:
+    qualities = quality_values(accept)
+    msgpack_quality = max(qualities.get(t, 0.0) for t in MSGPACK_MEDIA_TYPES)
+    return msgpack_quality > 0 and msgpack_quality >= _json_quality(qualities)
+
+
+def _json_quality(qualities: Dict[str, float]) -> float:
+    return qualities.get(
+        'application/json',
+        qualities.get('application/*', qualities.get('*/*', 0.0)))
+
+
+def _vary_accept(headers: MutableHeaders):
+    # responses negotiated by "MsgPackMiddleware" or by endpoints asking
+    # "accepts_ndjson" vary by "Accept"
+    negotiated = headers.get('content-type', '').startswith(
+        (response_class.media_type, *MSGPACK_MEDIA_TYPES))
+    vary = headers.get('vary', '').lower().replace(' ', '').split(',')
+    if (msgpack is not None or _ndjson_negotiated.get()) and negotiated and \
+            'accept' not in vary:
+        headers.add_vary_header('Accept')
+
+
+class MsgPackMiddleware(object):
+    """ ASGI middleware making "NegotiatedResponse" MessagePack for
+    requests preferring it to JSON.
+    """
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        token = _msgpack_response.set(
+            accepts_msgpack(Headers(scope=scope).get('accept', '')))
+
+        async def send_vary(message: Message):
+            if message['type'] == 'http.response.start':
+                _vary_accept(MutableHeaders(scope=message))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_vary)
+        finally:
+            _msgpack_response.reset(token)
+
+
+def render(
+    response_model: Any,
+    content: Any,
+    negotiate: bool = True,
+    include: Optional[dict] = None,
+) -> bytes:
+    """ Serialize *content* the way a route with *response_model* does,
+    for responses cached as bytes. JSON whatever the request prefers if
+    not *negotiate*.
+    """
+    _class = NegotiatedResponse if negotiate else response_class
+    return _class(
+        jsonable_encoder(parse_obj_as(response_model, content),
+                         include=include)).body
+
+
+def sparse_fields(fields: Optional[str] = Query(
+    None,
+    description='Comma separated fields to return, dotted names select '
+    'fields of nested objects, e.g. "id,title,user.id,preview".',
+)) -> Optional[List[str]]:
+    """ Dependency of "fields" parameter, see "FieldsRoute". """
+    if fields is None:
+        return None
+    return [field for field in map(str.strip, fields.split(',')) if field
+            ] or None
+
+
+NDJSON_MEDIA_TYPE = 'application/x-ndjson'
+# whether endpoint of current request asked "accepts_ndjson"
+_ndjson_negotiated: ContextVar[bool] = ContextVar('ndjson_negotiated',
+                                                  default=False)
+
+
+def accepts_ndjson(request: Request) -> bool:
+    """ Whether *request* prefers NDJSON to JSON, JSON responses of the
+    endpoint vary by "Accept" then, see "CacheableRoute".
+    """
+    _ndjson_negotiated.set(True)
+    qualities = quality_values(request.headers.get('accept', ''))
+    ndjson_quality = qualities.get(NDJSON_MEDIA_TYPE, 0.0)
+    return ndjson_quality > 0 and ndjson_quality >= _json_quality(qualities)
+
+
+def ndjson_response(
+    response_model: Any,
+    rows: AsyncIterator,
+    context: AsyncContextManager = None,
+    include: Optional[dict] = None,
+) -> responses.StreamingResponse:
+    """ Stream *rows* one JSON line each as they come, within *context*
+    if given.
+    """
+    async def lines():
+        async with context or nullcontext():
+            async for row in rows:
+                yield render(response_model,
+                             row,
+                             negotiate=False,
+                             include=include) + b'\n'
+
+    return responses.StreamingResponse(lines(),
+                                       media_type=NDJSON_MEDIA_TYPE,
+                                       headers={'Vary': 'Accept'})
+
+
+# values of boolean query parameters read as true, as pydantic does
+_TRUE_VALUES = ('1', 'on', 't', 'true', 'y', 'yes')
+
+
+def cache_control(*directives: str,
+                  max_age: int = None,
+                  public_if: str = None):
+    """ Set "Cache-Control" of GET responses of the decorated endpoint,
+    see "CacheableRoute". If *public_if* names a boolean query parameter,
+    "public" is replaced by "private" unless the parameter is true.
+    """
+    if max_age is not None:
+        directives += (f'max-age={max_age}', )
+
+    def decorator(func):
+        func.__cache_control__ = ', '.join(directives)
+        func.__cache_control_public_if__ = public_if
+        return func
+
+    return decorator
+
+
+def _cache_control(endpoint: Callable, request: Request) -> Optional[str]:
+    # "Cache-Control" of response to *request*, see "cache_control"
+    directives = getattr(endpoint, '__cache_control__', None)
+    public_if = getattr(endpoint, '__cache_control_public_if__', None)
+    if directives and public_if is not None and request.query_params.get(
+            public_if, '').lower() not in _TRUE_VALUES:
+        directives = directives.replace('public', 'private')
+    return directives
+
+
+def _matched_etag(if_none_match: Optional[str], etag: str) -> Optional[str]:
+    # tag of "If-None-Match" matching *etag* as the client holds it, weakened
+    # by "CompressionMiddleware" if the body was compressed
+    if not if_none_match:
+        return None
+    if if_none_match.strip() == '*':
+        return etag
+    for tag in if_none_match.split(','):
+        if tag.strip().removeprefix('W/') == etag:
+            return tag.strip()
+    return None
+
+
+def _byte_range(range_: str, size: int) -> Optional[Tuple[int, int]]:
+    # first and last byte of single range of "Range", None for whole file,
+    # ValueError if not satisfiable
+    unit, _, spec = range_.partition('=')
+    if unit.strip() != 'bytes' or ',' in spec:
+        return None
+    first, _, last = spec.strip().partition('-')
+    if not all(part.isdigit() for part in (first, last) if part) or \
+            not (first or last) or (first and last and int(last) < int(first)):
+        return None
+    if not first:
+        # suffix of the file
+        if int(last) == 0:
+            raise ValueError(range_)
+        return max(size - int(last), 0), size - 1
+    if int(first) >= size:
+        raise ValueError(range_)
+    return int(first), min(int(last), size - 1) if last else size - 1
+
+
+class FileRangeResponse(responses.FileResponse):
+    """ File response of *count* bytes from *offset* on, sent by extension
+    "http.response.zerocopysend" if the server supports it.
+    """
+    def __init__(self,
+                 *args,
+                 offset: int = 0,
+                 count: int = None,
+                 **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.offset = offset
+        self.count = count
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        count = self.stat_result.st_size - self.offset \
+            if self.count is None else self.count
+        await send({
+            'type': 'http.response.start',
+            'status': self.status_code,
+            'headers': self.raw_headers,
+        })
+        if self.send_header_only or count == 0:
+            await send({'type': 'http.response.body', 'body': b''})
+        elif 'http.response.zerocopysend' in scope.get('extensions', {}):
+            with open(self.path, 'rb') as file:
+                await send({
+                    'type': 'http.response.zerocopysend',
+                    'file': file.fileno(),
+                    'offset': self.offset,
+                    'count': count,
+                })
+        else:
+            async with await anyio.open_file(self.path, mode='rb') as file:
+                await file.seek(self.offset)
+                while count > 0:
+                    chunk = await file.read(min(self.chunk_size, count))
+                    count = count - len(chunk) if chunk else 0
+                    await send({
+                        'type': 'http.response.body',
+                        'body': chunk,
+                        'more_body': count > 0,
+                    })
+        if self.background is not None:
+            await self.background()
+
+
+def file_response(request: Request,
+                  path: Union[str, os.PathLike],
+                  media_type: str = None,
+                  headers: dict = None) -> responses.Response:
+    """ Response of file at *path* with "ETag", answering "If-None-Match"
+    with 304 and a single range of "Range" with 206.
+    """
+    try:
+        stat_result = os.stat(path)
+    except FileNotFoundError:
+        return responses.Response(status_code=status.HTTP_404_NOT_FOUND)
+    size = stat_result.st_size
+    etag = '"' + md5(
+        f'{stat_result.st_mtime_ns}-{size}'.encode()).hexdigest() + '"'
+    headers = {**(headers or {}), 'ETag': etag, 'Accept-Ranges': 'bytes'}
+    if matched := _matched_etag(request.headers.get('if-none-match'), etag):
+        return responses.Response(status_code=status.HTTP_304_NOT_MODIFIED,
+                                  headers={
+                                      **headers, 'ETag': matched
+                                  })
+    status_code, offset, count = status.HTTP_200_OK, 0, size
+    # "If-Range" with other validator asks for whole file
+    if (range_ := request.headers.get('range')) and \
+            request.headers.get('if-range', etag) == etag:
+        try:
+            byte_range = _byte_range(range_, size)
+        except ValueError:
+            return responses.Response(
+                status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                headers={**headers, 'Content-Range': f'bytes */{size}'})
+        if byte_range is not None:
+            first, last = byte_range
+            status_code = status.HTTP_206_PARTIAL_CONTENT
+            offset, count = first, last + 1 - first
+            headers['Content-Range'] = f'bytes {first}-{last}/{size}'
+    headers['Content-Length'] = str(count)
+    return FileRangeResponse(path,
+                             status_code=status_code,
+                             headers=headers,
+                             media_type=media_type,
+                             stat_result=stat_result,
+                             method=request.method,
+                             offset=offset,
+                             count=count)
+
+
+def _response_class(route: APIRoute) -> type:
+    if isinstance(route.response_class, DefaultPlaceholder):
+        return route.response_class.value
+    return route.response_class
+
+
+class FieldsRoute(APIRoute):
+    """ Route trimming response to the fields requested, for endpoints
+    taking "fields" from "sparse_fields". Names that are not fields of
+    response model are answered with 400.
+    """
+    def get_route_handler(self) -> Callable:
+        call = self.dependant.call
+        if 'fields' in signature(self.endpoint).parameters and \
+                iscoroutinefunction(call) and \
+                include_fields(self.response_model, ()) is not None and \
+                getattr(call, '__fields_response__', False) is False:
+            response_model = self.response_model
+            _class = _response_class(self)
+
+            @wraps(call)
+            async def endpoint(*args, **kwargs):
+                if (fields := kwargs.get('fields')) and \
+                        (unknown := unknown_fields(response_model, fields)):
+                    raise HTTPException(
+                        status.HTTP_400_BAD_REQUEST,
+                        f'Unknown fields: {", ".join(unknown)}.')
+                content = await call(*args, **kwargs)
+                if fields and not isinstance(content, responses.Response):
+                    return _class(
+                        jsonable_encoder(parse_obj_as(response_model,
+                                                      content),
+                                         include=include_fields(
+                                             response_model, fields)))
+                return content
+
+            endpoint.__fields_response__ = True
+            self.dependant.call = endpoint
+        return super().get_route_handler()
+
+
+class CacheableRoute(FieldsRoute):
+    """ Route adding "ETag" (digest of body) and "Cache-Control" to GET
+    responses, answering "If-None-Match" with 304.
+    """
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+        if 'GET' not in self.methods:
+            return handler
+        endpoint = self.endpoint
+
+        @wraps(handler)
+        async def conditional_handler(request: Request) -> responses.Response:
+            response = await handler(request)
+            if response.status_code != status.HTTP_200_OK or \
+                    not hasattr(response, 'body'):
+                return response
+            etag = f'"{md5(response.body).hexdigest()}"'
+            headers = {'ETag': etag}
+            if directives := _cache_control(endpoint, request):
+                headers['Cache-Control'] = directives
+            _vary_accept(response.headers)
+            if 'vary' in response.headers:
+                headers['Vary'] = response.headers['vary']
+            if matched := _matched_etag(request.headers.get('if-none-match'),
+                                        etag):
+                return responses.Response(
+                    status_code=status.HTTP_304_NOT_MODIFIED,
+                    headers={
+                        **headers, 'ETag': matched
+                    })
+            response.headers.update(headers)
+            return response
+
+        return conditional_handler
+
+
+class ORMResponseRoute(CacheableRoute):
+    """ Route serializing sa instances returned by endpoint straight into
+    response, skipping validation of response model. Response model is
+    still used by schema and for any other content.
+    """
+    def get_route_handler(self) -> Callable:
+        call = self.dependant.call
+        encode = orm_response_encoder(self.response_model)
+        if encode is not None and iscoroutinefunction(call) and \
+                getattr(call, '__orm_response__', False) is False:
+            _class = _response_class(self)
+
+            @wraps(call)
+            async def endpoint(*args, **kwargs):
+                content = await call(*args, **kwargs)
+                # sparse fieldsets are trimmed by "FieldsRoute"
+                if kwargs.get('fields') is None and \
+                        (data := encode(content)) is not NotImplemented:
+                    return _class(data)
+                return content
+
+            endpoint.__orm_response__ = True
+            self.dependant.call = endpoint
+        return super().get_route_handler()
+
 
 def add_reload():
     if hasattr(APP, '_config') and \
@@ -35,10 +468,24 @@ APP = FastAPI(
     version=__version__,
     docs_url='/docs' if debug else None,
     redoc_url='/redoc' if debug else '/docs',
-    on_startup=[Session.init, ConcurrencyScheduler.start_all, add_reload],
-    on_shutdown=[Session.shutdown, ConcurrencyScheduler.shutdown_all],
+    on_startup=[
+        Session.init, storage_backend.init, ConcurrencyScheduler.start_all,
+        add_reload
+    ],
+    on_shutdown=[
+        Session.shutdown, storage_backend.shutdown,
+        ConcurrencyScheduler.shutdown_all, imaging.shutdown
+    ],
     debug=debug,
-    default_response_class=response_class)
+    default_response_class=NegotiatedResponse)
+if msgpack is not None:
+    APP.add_middleware(MsgPackMiddleware)
+if compression.enable:
+    APP.add_middleware(CompressionMiddleware,
+                       minimum_size=compression.minimum_size,
+                       offload_size=compression.offload_size,
+                       cache=Cache('compressed',
+                                   disksize=compression.cache_size))
 
 
 @APP.get('/', response_class=responses.HTMLResponse)
@@ -46,6 +493,21 @@ async def hello():
     return markdown_html(README.read_text(encoding='utf-8'))
 
 
+if isinstance(storage_backend, LocalBackend):
+
+    @APP.get(storage_backend.url_prefix + '/{name}', include_in_schema=False)
+    async def storage_file(name: str, req: Request):
+        # named by digest of content, never changes
+        path = storage_backend.object_path(name)
+        if path is None or not path.is_file():
+            return responses.Response(status_code=status.HTTP_404_NOT_FOUND)
+        return file_response(
+            req,
+            path,
+            media_type=guess_type(name)[0],
+            headers={'Cache-Control': 'public, max-age=31536000, immutable'})
+
+
 @APP.get('/todo', response_class=responses.HTMLResponse)
 async def todo():
     try:
@@ -1,16 +1,63 @@
-from typing import List, Literal, Union, Optional
-from fastapi import status, APIRouter, Query, Request
-from fastapi.responses import HTMLResponse, RedirectResponse
-from .pixiv import Pixiv
+import gzip
+import zlib
+from typing import AsyncIterator, Iterator, List, Literal, Tuple, Union, \
+    Optional
+from fastapi import status, APIRouter, Depends, Query, Request
+from fastapi.responses import HTMLResponse, RedirectResponse, Response, \
+    StreamingResponse
+from app.base import render, negotiated_media_type, cache_control, \
+    accepts_ndjson, ndjson_response, sparse_fields, file_response, \
+    CacheableRoute, ORMResponseRoute
+from utils import imaging
+from utils.cache import Cache
+from utils.pydantic import include_fields
+from .pixiv import Pixiv, ranking_cache
+from .tagindex import TagIndex
 from . import models
 
-pixiv_router = APIRouter(prefix='/pixiv')
+pixiv_router = APIRouter(
+    prefix='/pixiv',
+    on_startup=[TagIndex.build, Pixiv.start_client],
+    on_shutdown=[Pixiv.close_client],
+    route_class=ORMResponseRoute if Pixiv.FAST_RESPONSE else CacheableRoute,
+)
+
+# seconds to cache local ranking of the latest date
+RANKING_TODAY_TTL = 300
+# characters of novel content rendered per streamed chunk
+ARTICLE_CHUNK_SIZE = 1 << 16
+# gzipped novel articles keyed by (novel id, content hash)
+article_cache = Cache('pixiv_article', maxsize=32, disksize=256 << 20)
+# leading bytes of images stored, see "storage_image"
+IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF8', 'image/gif'),
+    (b'RIFF', 'image/webp'),
+)
+
+
+async def _illusts_ndjson(call,
+                          fields: Optional[List[str]] = None,
+                          **kwargs) -> StreamingResponse:
+    # local illusts sent as rows come from database, see "Pixiv.stream"
+    p = Pixiv(stream=True, fields=fields)
+    return ndjson_response(
+        models.Illust,
+        await call(p, **kwargs),
+        p,
+        include=include_fields(models.Illust, fields) if fields else None,
+    )
 
 
 # user
+@pixiv_router.get('/u/{user_id}',
+                  response_model=models.User,
+                  tags=['pixiv.user'])
 @pixiv_router.post('/u/{user_id}',
                    response_model=models.User,
                    tags=['pixiv.user'])
+@cache_control('public', max_age=300, public_if='local')
 async def user_detail(user_id: int, local: bool = False):
     if local is True:
         call = Pixiv.user_detail_local
@@ -21,55 +68,88 @@ async def user_detail(user_id: int, local: bool = False):
     return user
 
 
+@pixiv_router.get('/u/{user_id}/illusts',
+                  response_model=List[models.Illust],
+                  tags=['pixiv.user'])
 @pixiv_router.post('/u/{user_id}/illusts',
                    response_model=List[models.Illust],
                    tags=['pixiv.user'])
-async def user_illusts(user_id: int,
+@cache_control('public', max_age=300, public_if='local')
+async def user_illusts(request: Request,
+                       user_id: int,
                        type: Literal['illust', 'manga'] = 'illust',
                        offset: Optional[int] = None,
-                       local: bool = False):
+                       local: bool = False,
+                       fields: Optional[List[str]] = Depends(sparse_fields)):
     if local is True:
+        if accepts_ndjson(request):
+            return await _illusts_ndjson(Pixiv.user_illusts_local,
+                                         fields,
+                                         user_id=user_id,
+                                         type=type,
+                                         offset=offset)
         call = Pixiv.user_illusts_local
     else:
         call = Pixiv.user_illusts
-    async with Pixiv() as p:
+    async with Pixiv(fields=fields) as p:
         illusts = await call(p, user_id=user_id, type=type, offset=offset)
     return illusts
 
 
+@pixiv_router.get('/u/{user_id}/novels',
+                  response_model=List[models.Novel],
+                  tags=['pixiv.user'])
 @pixiv_router.post('/u/{user_id}/novels',
                    response_model=List[models.Novel],
                    tags=['pixiv.user'])
+@cache_control('public', max_age=300, public_if='local')
 async def user_novels(user_id: int,
                       offset: Optional[int] = None,
-                      local: bool = False):
+                      local: bool = False,
+                      fields: Optional[List[str]] = Depends(sparse_fields)):
     if local is True:
         call = Pixiv.user_novels_local
     else:
         call = Pixiv.user_novels
-    async with Pixiv() as p:
+    async with Pixiv(fields=fields) as p:
         novels = await call(p, user_id=user_id, offset=offset)
     return novels
 
 
+@pixiv_router.get('/u/{user_id}/bookmarks_illust',
+                  response_model=List[models.Illust],
+                  tags=['pixiv.user'])
 @pixiv_router.post('/u/{user_id}/bookmarks_illust',
                    response_model=List[models.Illust],
                    tags=['pixiv.user'])
-async def user_bookmarks_illust(user_id: int,
+@cache_control('public', max_age=300, public_if='local')
+async def user_bookmarks_illust(request: Request,
+                                user_id: int,
                                 offset: Optional[int] = None,
-                                local: bool = False):
+                                local: bool = False,
+                                fields: Optional[List[str]] = Depends(
+                                    sparse_fields)):
     if local is True:
+        if accepts_ndjson(request):
+            return await _illusts_ndjson(Pixiv.user_bookmarks_illust_local,
+                                         fields,
+                                         user_id=user_id,
+                                         offset=offset)
         call = Pixiv.user_bookmarks_illust_local
     else:
         call = Pixiv.user_bookmarks_illust
-    async with Pixiv() as p:
+    async with Pixiv(fields=fields) as p:
         illusts = await call(p, user_id=user_id, offset=offset)
     return illusts
 
 
+@pixiv_router.get('/u/{user_id}/related',
+                  response_model=List[models.User],
+                  tags=['pixiv.user'])
 @pixiv_router.post('/u/{user_id}/related',
                    response_model=List[models.User],
                    tags=['pixiv.user'])
+@cache_control('private', max_age=300)
 async def user_related(user_id: int, offset: Optional[int] = None):
     call = Pixiv.user_related
     async with Pixiv() as p:
@@ -105,9 +185,13 @@ async def user_bookmark_tags_illust(restrict: Literal['public',
     return data
 
 
+@pixiv_router.get('/u/{user_id}/following',
+                  response_model=List[models.User],
+                  tags=['pixiv.user'])
 @pixiv_router.post('/u/{user_id}/following',
                    response_model=List[models.User],
                    tags=['pixiv.user'])
+@cache_control('public', max_age=300, public_if='local')
 async def user_following(user_id: int,
                          offset: Optional[int] = None,
                          local: bool = False):
@@ -131,9 +215,13 @@ async def user_follower(offset: Optional[int] = None, local: bool = False):
     return users
 
 
+@pixiv_router.get('/u/{user_id}/mypixiv',
+                  response_model=List[models.User],
+                  tags=['pixiv.user'])
 @pixiv_router.post('/u/{user_id}/mypixiv',
                    response_model=List[models.User],
                    tags=['pixiv.user'])
+@cache_control('public', max_age=300, public_if='local')
 async def user_mypixiv(user_id: int,
                        offset: Optional[int] = None,
                        local: bool = False):
@@ -161,9 +249,11 @@ async def user_list(offset: Optional[int] = None, local: bool = False):
 @pixiv_router.get('/i/{illust_id}',
                   response_class=HTMLResponse,
                   tags=['pixiv.illust'])
+@cache_control('public', max_age=3600)
 async def illust_image(illust_id: int, preview: bool = True):
     async with Pixiv() as p:
-        illust = await p.illust_detail_local(illust_id=illust_id)
+        illust = await p.illust_detail_local(illust_id=illust_id,
+                                             profile='image')
         if illust is None:
             illust = await p.illust_detail(illust_id=illust_id)
     if illust is not None:
@@ -177,12 +267,14 @@ async def illust_image(illust_id: int, preview: bool = True):
 @pixiv_router.get('/i/{illust_id}/p{page}',
                   response_class=HTMLResponse,
                   tags=['pixiv.illust'])
+@cache_control('public', max_age=3600)
 async def illust_image_page(illust_id: int,
                             page: int,
                             preview: bool = True,
                             req: Request = ...):
     async with Pixiv() as p:
-        illust = await p.illust_detail_local(illust_id=illust_id)
+        illust = await p.illust_detail_local(illust_id=illust_id,
+                                             profile='image')
         if illust is None:
             illust = await p.illust_detail(illust_id=illust_id)
     if illust is not None:
@@ -208,24 +300,74 @@ async def illust_image_page(illust_id: int,
         return f'Cannot find illust {illust_id}!'
 
 
+@pixiv_router.get('/img/{storage_id}',
+                  response_class=Response,
+                  tags=['pixiv.illust'])
+async def storage_image(storage_id: int,
+                        w: Optional[int] = Query(None, ge=1),
+                        fmt: Optional[Literal['webp', 'avif', 'jpeg']] = None,
+                        req: Request = ...):
+    # derivative if either is given, rounded up to "imaging.WIDTHS"
+    if w is not None or fmt is not None:
+        fmt = fmt or 'webp'
+        if fmt not in imaging.FORMATS:
+            return Response(f'Format {fmt} is not supported.',
+                            status_code=status.HTTP_400_BAD_REQUEST)
+        async with Pixiv() as p:
+            file = await p.derivative_image(storage_id,
+                                            imaging.derivative_width(w), fmt)
+        media_type = imaging.FORMATS[fmt][1]
+    else:
+        async with Pixiv() as p:
+            file = await p.storage_image(storage_id)
+        media_type = None
+    if file is None:
+        return Response(status_code=status.HTTP_404_NOT_FOUND)
+    if media_type is None:
+        try:
+            with open(file, 'rb') as f:
+                head = f.read(8)
+        except FileNotFoundError:
+            # removed by other worker meanwhile
+            return Response(status_code=status.HTTP_404_NOT_FOUND)
+        media_type = next((media_type for signature, media_type in
+                           IMAGE_SIGNATURES if head.startswith(signature)),
+                          'application/octet-stream')
+    return file_response(req,
+                         file,
+                         media_type=media_type,
+                         headers={'Cache-Control': 'public, max-age=86400'})
+
+
+@pixiv_router.get('/i/{illust_id}/detail',
+                  response_model=models.Illust,
+                  tags=['pixiv.illust'])
 @pixiv_router.post('/i/{illust_id}',
                    response_model=models.Illust,
                    tags=['pixiv.illust'])
-async def illust_detail(illust_id: int, local: bool = False):
+@cache_control('public', max_age=3600, public_if='local')
+async def illust_detail(illust_id: int,
+                        local: bool = False,
+                        fields: Optional[List[str]] = Depends(sparse_fields)):
     if local is True:
         call = Pixiv.illust_detail_local
     else:
         call = Pixiv.illust_detail
-    async with Pixiv() as p:
+    async with Pixiv(fields=fields) as p:
         illust = await call(p, illust_id=illust_id)
     return illust
 
 
 @pixiv_router.post('/illust_follow', include_in_schema=False)
-async def illust_follow(restrict: Literal['public', 'private'] = 'public',
+async def illust_follow(request: Request,
+                        restrict: Literal['public', 'private'] = 'public',
                         offset: Optional[int] = None,
                         local: bool = False):
     if local is True:
+        if accepts_ndjson(request):
+            return await _illusts_ndjson(Pixiv.illust_follow_local,
+                                         restrict=restrict,
+                                         offset=offset)
         call = Pixiv.illust_follow_local
     else:
         call = Pixiv.illust_follow
@@ -234,9 +376,13 @@ async def illust_follow(restrict: Literal['public', 'private'] = 'public',
     return illusts
 
 
+@pixiv_router.get('/i/{illust_id}/comments',
+                  response_model=List[models.IllustComment],
+                  tags=['pixiv.illust'])
 @pixiv_router.post('/i/{illust_id}/comments',
                    response_model=List[models.IllustComment],
                    tags=['pixiv.illust'])
+@cache_control('public', max_age=300, public_if='local')
 async def illust_comments(illust_id: int,
                           offset: Optional[int] = None,
                           local: bool = False):
@@ -249,9 +395,13 @@ async def illust_comments(illust_id: int,
     return comments
 
 
+@pixiv_router.get('/i/{illust_id}/related',
+                  response_model=List[models.Illust],
+                  tags=['pixiv.illust'])
 @pixiv_router.post('/i/{illust_id}/related',
                    response_model=List[models.Illust],
                    tags=['pixiv.illust'])
+@cache_control('private', max_age=300)
 async def illust_related(illust_id: int, offset: Optional[int] = None):
     call = Pixiv.illust_related
     async with Pixiv() as p:
@@ -259,9 +409,13 @@ async def illust_related(illust_id: int, offset: Optional[int] = None):
     return illusts
 
 
+@pixiv_router.get('/illust_recommended',
+                  response_model=List[models.Illust],
+                  tags=['pixiv.illust'])
 @pixiv_router.post('/illust_recommended',
                    response_model=List[models.Illust],
                    tags=['pixiv.illust'])
+@cache_control('private', max_age=300)
 async def illust_recommended(content_type: Literal['illust',
                                                    'manga'] = 'illust',
                              offset: Optional[int] = None):
@@ -271,29 +425,66 @@ async def illust_recommended(content_type: Literal['illust',
     return illusts
 
 
+@pixiv_router.get('/illust_ranking',
+                  response_model=List[models.Illust],
+                  tags=['pixiv.illust'])
 @pixiv_router.post('/illust_ranking',
                    response_model=List[models.Illust],
                    tags=['pixiv.illust'])
+@cache_control('public', max_age=3600, public_if='local')
 async def illust_ranking(
+        request: Request,
         mode: Literal['day', 'week', 'month', 'day_male', 'day_female',
                       'week_original', 'week_rookie', 'day_manga', 'day_r18',
                       'day_male_r18', 'day_female_r18', 'week_r18',
                       'week_r18g'] = 'day',
         date: Optional[str] = Query(None, regex=r'^\d{4}-\d{2}-\d{2}$'),
         offset: Optional[int] = None,
-        local: bool = False):
+        local: bool = False,
+        fields: Optional[List[str]] = Depends(sparse_fields)):
     if local is True:
-        call = Pixiv.illust_ranking_local
-    else:
-        call = Pixiv.illust_ranking
-    async with Pixiv() as p:
-        illusts = await call(p, mode=mode, date=date, offset=offset)
+        date = Pixiv.ranking_date(date)
+        if accepts_ndjson(request):
+            return await _illusts_ndjson(Pixiv.illust_ranking_local,
+                                         fields,
+                                         mode=mode,
+                                         date=date,
+                                         offset=offset)
+        if fields is not None:
+            # sparse rankings are not cached
+            async with Pixiv(fields=fields) as p:
+                return await p.illust_ranking_local(mode=mode,
+                                                    date=date,
+                                                    offset=offset)
+        media_type = negotiated_media_type()
+        key = (mode, date.isoformat(), media_type.rpartition('/')[2],
+               offset or 0)
+        if (content := ranking_cache.get(key)) is None:
+            async with Pixiv() as p:
+                illusts = await p.illust_ranking_local(mode=mode,
+                                                       date=date,
+                                                       offset=offset)
+            content = render(List[models.Illust], illusts)
+            if illusts:
+                # past rankings never change, until "_rank_into_db" adds
+                # missing pages of them
+                if date < Pixiv.ranking_date():
+                    ranking_cache.set(key, content)
+                else:
+                    ranking_cache.set(key, content, ttl=RANKING_TODAY_TTL)
+        return Response(content, media_type=media_type)
+    async with Pixiv(fields=fields) as p:
+        illusts = await p.illust_ranking(mode=mode, date=date, offset=offset)
     return illusts
 
 
+@pixiv_router.get('/trending_tags_illust',
+                  response_model=List[models.TrendingTagsIllust],
+                  tags=['pixiv.illust'])
 @pixiv_router.post('/trending_tags_illust',
                    response_model=List[models.TrendingTagsIllust],
                    tags=['pixiv.illust'])
+@cache_control('private', max_age=300)
 async def trending_tags_illust():
     call = Pixiv.trending_tags_illust
     async with Pixiv() as p:
@@ -329,9 +520,13 @@ async def illust_bookmark_del(illust_id: int):
         await call(p, illust_id=illust_id)
 
 
+@pixiv_router.get('/i/{illust_id}/ugoira_metadata',
+                  response_model=models.UgoiraMetadata,
+                  tags=['pixiv.illust'])
 @pixiv_router.post('/i/{illust_id}/ugoira_metadata',
                    response_model=models.UgoiraMetadata,
                    tags=['pixiv.illust'])
+@cache_control('private', max_age=86400)
 async def ugoira_metadata(illust_id: int):
     call = Pixiv.ugoira_metadata
     async with Pixiv() as p:
@@ -340,40 +535,91 @@ async def ugoira_metadata(illust_id: int):
 
 
 # novel
+def _article_chunks(content: str) -> Iterator[str]:
+    yield '<article>'
+    parts, size, start = [], 0, 0
+    while True:
+        end = content.find('\n', start)
+        line = content[start:] if end == -1 else content[start:end]
+        parts += ('<p>', line, '</p>')
+        size += len(line)
+        if end == -1:
+            break
+        start = end + 1
+        if size >= ARTICLE_CHUNK_SIZE:
+            yield ''.join(parts)
+            parts, size = [], 0
+    parts.append('</article>')
+    yield ''.join(parts)
+
+
+async def _stream_article(header: str, content: str,
+                          key: Tuple[int, str]) -> AsyncIterator[bytes]:
+    # article is cached only if the whole of it is sent, on the event loop
+    # as caches are not thread safe
+    yield header.encode()
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    compressed = []
+    for chunk in _article_chunks(content):
+        chunk = chunk.encode()
+        compressed.append(compressor.compress(chunk))
+        yield chunk
+    compressed.append(compressor.flush())
+    article_cache.delete(key[:1])
+    article_cache.set(key, b''.join(compressed))
+
+
 @pixiv_router.get('/n/{novel_id}',
                   response_class=HTMLResponse,
                   tags=['pixiv.novel'])
+@cache_control('public', max_age=3600)
 async def novel_article(novel_id: int):
     async with Pixiv() as p:
-        novel = await p.novel_detail_local(novel_id=novel_id)
+        novel = await p.novel_detail_local(novel_id=novel_id, content=False)
         if novel is None:
             novel = await p.novel_detail(novel_id=novel_id)
-    if novel is not None:
-        return (f'<title>{novel.id}</title>'
-                f'<img src="{novel.large}" '
-                'style="max-height: 100%; max-width: 100%">'
-                '<article><p>' + '</p><p>'.join(novel.content.split('\n')) +
-                '</p></article>')
-    else:
+    if novel is None:
         return f'Cannot find novel {novel_id}!'
-
-
+    header = (f'<title>{novel.id}</title>'
+              f'<img src="{novel.large}" '
+              'style="max-height: 100%; max-width: 100%">')
+    if novel.content_hash and (article := article_cache.get(
+            (novel.id, novel.content_hash))):
+        return HTMLResponse(header.encode() + gzip.decompress(article))
+    content, content_hash = await Pixiv.novel_content_local(novel.id)
+    if content is None:
+        return header + '<article><p></p></article>'
+    return StreamingResponse(_stream_article(header, content,
+                                             (novel.id, content_hash)),
+                             media_type=HTMLResponse.media_type)
+
+
+@pixiv_router.get('/n/{novel_id}/detail',
+                  response_model=models.Novel,
+                  tags=['pixiv.novel'])
 @pixiv_router.post('/n/{novel_id}',
                    response_model=models.Novel,
                    tags=['pixiv.novel'])
-async def novel_detail(novel_id: int, local: bool = False):
+@cache_control('public', max_age=3600, public_if='local')
+async def novel_detail(novel_id: int,
+                       local: bool = False,
+                       fields: Optional[List[str]] = Depends(sparse_fields)):
     if local is True:
         call = Pixiv.novel_detail_local
     else:
         call = Pixiv.novel_detail
-    async with Pixiv() as p:
+    async with Pixiv(fields=fields) as p:
         novel = await call(p, novel_id=novel_id)
     return novel
 
 
+@pixiv_router.get('/n/{novel_id}/text',
+                  response_model=models.NovelText,
+                  tags=['pixiv.novel'])
 @pixiv_router.post('/n/{novel_id}/text',
                    response_model=models.NovelText,
                    tags=['pixiv.novel'])
+@cache_control('public', max_age=86400, public_if='local')
 async def novel_text(novel_id: int, local: bool = False):
     if local is True:
         call = Pixiv.novel_text_local
@@ -384,23 +630,33 @@ async def novel_text(novel_id: int, local: bool = False):
     return text
 
 
+@pixiv_router.get('/n/series/{series_id}',
+                  response_model=List[models.Novel],
+                  tags=['pixiv.novel'])
 @pixiv_router.post('/n/series/{series_id}',
                    response_model=List[models.Novel],
                    tags=['pixiv.novel'])
-async def novel_series(series_id: int, local: bool = False):
+@cache_control('public', max_age=3600, public_if='local')
+async def novel_series(series_id: int,
+                       local: bool = False,
+                       fields: Optional[List[str]] = Depends(sparse_fields)):
     if local is True:
         call = Pixiv.novel_series_local
     else:
         call = Pixiv.novel_series
-    async with Pixiv() as p:
+    async with Pixiv(fields=fields) as p:
         novels = await call(p, series_id=series_id)
     return novels
 
 
 # showcase
+@pixiv_router.get('/sc/{showcase_id}',
+                  response_model=models.Showcase,
+                  tags=['pixiv.showcase'])
 @pixiv_router.post('/sc/{showcase_id}',
                    response_model=models.Showcase,
                    tags=['pixiv.showcase'])
+@cache_control('public', max_age=86400, public_if='local')
 async def showcase_article(showcase_id: int, local: bool = False):
     if local is True:
         call = Pixiv.showcase_article_local
@@ -412,9 +668,13 @@ async def showcase_article(showcase_id: int, local: bool = False):
 
 
 # search
+@pixiv_router.get('/s/u',
+                  response_model=List[models.User],
+                  tags=['pixiv.user'])
 @pixiv_router.post('/s/u',
                    response_model=List[models.User],
                    tags=['pixiv.user'])
+@cache_control('public', max_age=60, public_if='local')
 async def search_user(word: List[str] = Query(...),
                       sort: Literal['date_desc', 'date_asc'] = 'date_desc',
                       duration: Optional[Literal['within_last_day',
@@ -437,10 +697,15 @@ async def search_user(word: List[str] = Query(...),
     return users
 
 
+@pixiv_router.get('/s/i',
+                  response_model=List[models.Illust],
+                  tags=['pixiv.illust'])
 @pixiv_router.post('/s/i',
                    response_model=List[models.Illust],
                    tags=['pixiv.illust'])
+@cache_control('public', max_age=60, public_if='local')
 async def search_illust(
+        request: Request,
         word: List[str] = Query(...),
         search_target: Literal['partial_match_for_tags',
                                'exact_match_for_tags',
@@ -453,30 +718,38 @@ async def search_illust(
         end_date: Optional[str] = Query(None, regex=r'^\d{4}-\d{2}-\d{2}$'),
         min_bookmarks: Optional[int] = None,
         max_bookmarks: Optional[int] = None,
-        local: bool = False):
+        local: bool = False,
+        fields: Optional[List[str]] = Depends(sparse_fields)):
+    params = dict(
+        word=' '.join(word),
+        search_target=search_target,
+        sort=sort,
+        duration=duration,
+        offset=offset,
+        start_date=start_date,
+        end_date=end_date,
+        min_bookmarks=min_bookmarks,
+        max_bookmarks=max_bookmarks,
+    )
     if local is True:
+        if accepts_ndjson(request):
+            return await _illusts_ndjson(Pixiv.search_illust_local, fields,
+                                         **params)
         call = Pixiv.search_illust_local
     else:
         call = Pixiv.search_illust
-    async with Pixiv() as p:
-        illusts = await call(
-            p,
-            word=' '.join(word),
-            search_target=search_target,
-            sort=sort,
-            duration=duration,
-            offset=offset,
-            start_date=start_date,
-            end_date=end_date,
-            min_bookmarks=min_bookmarks,
-            max_bookmarks=max_bookmarks,
-        )
+    async with Pixiv(fields=fields) as p:
+        illusts = await call(p, **params)
     return illusts
 
 
+@pixiv_router.get('/s/n',
+                  response_model=List[models.Novel],
+                  tags=['pixiv.novel'])
 @pixiv_router.post('/s/n',
                    response_model=List[models.Novel],
                    tags=['pixiv.novel'])
+@cache_control('public', max_age=60, public_if='local')
 async def search_novel(
         word: List[str] = Query(...),
         search_target: Literal['partial_match_for_tags',
@@ -486,12 +759,13 @@ async def search_novel(
         start_date: Optional[str] = Query(None, regex=r'^\d{4}-\d{2}-\d{2}$'),
         end_date: Optional[str] = Query(None, regex=r'^\d{4}-\d{2}-\d{2}$'),
         offset: Optional[int] = None,
-        local: bool = False):
+        local: bool = False,
+        fields: Optional[List[str]] = Depends(sparse_fields)):
     if local is True:
         call = Pixiv.search_novel_local
     else:
         call = Pixiv.search_novel
-    async with Pixiv() as p:
+    async with Pixiv(fields=fields) as p:
         novels = await call(
             p,
             word=' '.join(word),
@@ -505,6 +779,7 @@ async def search_novel(
 
 
 @pixiv_router.get('/r/i', response_class=HTMLResponse, tags=['pixiv.random'])
+@cache_control('no-store')
 async def random_illust_image(min_view: int = 10000,
                               min_bookmarks: int = 1000,
                               tag: List[str] = Query(['ロリ']),
@@ -1,7 +1,29 @@
 from datetime import datetime
 from typing import Optional, List, Union
 from pydantic import Field
-from utils.pydantic import BaseModel
+from utils.pydantic import BaseModel, orm_attr
+
+
+def _str(name):
+    return lambda obj: str(orm_attr(obj, name))
+
+
+def _id(name):
+    def getter(obj):
+        if value := orm_attr(obj, name):
+            return value.id
+        return value
+
+    return getter
+
+
+def _ids(name):
+    def getter(obj):
+        if li := orm_attr(obj, name):
+            return [sub.id for sub in li]
+        return li
+
+    return getter
 
 
 # models
@@ -16,6 +38,10 @@ class UserMixin(BaseModel):
     def modify_single_instance(cls, obj):
         obj.profile = str(obj.profile)
 
+    @classmethod
+    def orm_getters(cls):
+        return {'profile': _str('profile')}
+
 
 class User(UserMixin):
     webpage: Optional[str] = Field(None, max_length=100)
@@ -54,6 +80,20 @@ class User(UserMixin):
                 setattr(obj, attr, [sub.id for sub in li])
         super().modify_single_instance(obj)
 
+    @classmethod
+    def orm_getters(cls):
+        def background_image(obj):
+            if value := orm_attr(obj, 'background_image'):
+                return str(value)
+            return value
+
+        getters = super().orm_getters()
+        getters['background_image'] = background_image
+        for attr in ('followers', 'following', 'mypixiv', 'list', 'listed_by',
+                     'illusts', 'novels'):
+            getters[attr] = _ids(attr)
+        return getters
+
 
 class Tag(BaseModel):
     name: str = Field(..., max_length=50)
@@ -75,6 +115,13 @@ class IllustComment(BaseModel):
         if obj.parent_comment:
             obj.parent_comment = obj.parent_comment.id
 
+    @classmethod
+    def orm_getters(cls):
+        return {
+            'illust': _id('illust'),
+            'parent_comment': _id('parent_comment'),
+        }
+
 
 class Illust(BaseModel):
     id: int
@@ -106,9 +153,21 @@ class Illust(BaseModel):
         def modify_single_instance(cls, obj):
             obj.pcat = obj.pcat_reverse
 
+        @classmethod
+        def orm_getters(cls):
+            return {'pcat': lambda obj: orm_attr(obj, 'pcat_reverse')}
+
     preview: Union[File, List[File], None] = None
     files: Union[File, List[File], None] = None
 
+    class Config:
+        # table attributes read by fields not mapped by name
+        orm_fields = {
+            'create_date': ('_create_date', ),
+            'preview': ('type', '_large', '_original'),
+            'files': ('type', '_original', 'ugoira'),
+        }
+
     @classmethod
     def modify_single_instance(cls, obj):
         if obj.type == 'ugoira':
@@ -119,6 +178,20 @@ class Illust(BaseModel):
             if li := getattr(obj, attr, None):
                 setattr(obj, attr, [sub.id for sub in li])
 
+    @classmethod
+    def orm_getters(cls):
+        def files(obj):
+            if orm_attr(obj, 'type') == 'ugoira':
+                return orm_attr(obj, 'ugoira')
+            else:
+                return orm_attr(obj, 'original')
+
+        return {
+            'files': files,
+            'bookmarked_by': _ids('bookmarked_by'),
+            'comments': _ids('comments'),
+        }
+
 
 class Novel(BaseModel):
     id: int
@@ -139,6 +212,13 @@ class Novel(BaseModel):
     bookmarked_by: Optional[List[int]] = None
     cover: Optional[str] = Field(None, max_length=500)
 
+    class Config:
+        orm_fields = {
+            'content': (),
+            'create_date': ('_create_date', ),
+            'cover': ('large', ),
+        }
+
     @classmethod
     def modify_single_instance(cls, obj):
         obj.content = None
@@ -146,10 +226,19 @@ class Novel(BaseModel):
             obj.bookmarked_by = [sub.id for sub in obj.bookmarked_by]
         obj.cover = str(obj.large)
 
+    @classmethod
+    def orm_getters(cls):
+        return {
+            'content': lambda obj: None,
+            'bookmarked_by': _ids('bookmarked_by'),
+            'cover': _str('large'),
+        }
+
 
 class NovelText(BaseModel):
     id: int
     text: Optional[str] = None
+    prev: Optional[int] = None
     next: Optional[int] = None
 
 
@@ -173,6 +262,10 @@ class Showcase(BaseModel):
     def modify_single_instance(cls, obj):
         obj.thumbnail = str(obj.thumbnail)
 
+    @classmethod
+    def orm_getters(cls):
+        return {'thumbnail': _str('thumbnail')}
+
 
 class TrendingTagsIllust(BaseModel):
     tag: Optional[Tag] = None
@@ -1,25 +1,38 @@
+import asyncio
 import logging
+from collections import defaultdict
 from functools import wraps
-from os import PathLike, path
-from io import BytesIO
+from hashlib import sha256
+from os import path
 from random import choice, choices
-from datetime import datetime, timedelta, timezone, time
-from typing import List, Dict, Any, Literal, Optional, Union
+from tempfile import TemporaryDirectory
+from datetime import date, datetime, timedelta, timezone, time
+from uuid import uuid4
+from typing import List, Dict, Any, AsyncIterator, Iterable, Literal, \
+    Optional, Set, Tuple, Union
+from aiohttp import ClientTimeout
+import aiofiles
 from pixivpy_async import AppPixivAPI
 from pixivpy_async import error
+from pixivpy_async.client import PixivClient
+from pixivpy_async.net import ClientManager
+from sqlalchemy.sql.expression import bindparam
 from sqlalchemy.sql.functions import func
+from sqlalchemy import inspect
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import defer
 from sqlalchemy.orm.relationships import RelationshipProperty
+from sqlalchemy.sql.selectable import Select
 from utils.config import pixiv, debug
 from utils.database.session import Session
-from utils.database.crud import select
+from utils.database.crud import select, update
 from utils.schedule import ConcurrencyScheduler
-from utils.storage import s3
-from . import tables
-
-try:
-    import imageio
-except ModuleNotFoundError:
-    pass  # NameError if not installed while calling
+from utils.storage import storage_backend
+from utils.cache import Cache, FileCache
+from utils.syncutils import run_sync
+from utils import imaging
+from . import tables, models
+from .tagindex import TagIndex
 
 
 def catch_pixiv_error(func):
@@ -56,6 +69,10 @@ def catch_pixiv_error(func):
 
 
 scheduler = ConcurrencyScheduler('pixiv', limit=5)
+# serialized local ranking responses keyed by (mode, date, format, offset)
+ranking_cache = Cache('pixiv_ranking')
+# files of storages served by the app, shared by workers
+image_cache = FileCache('pixiv_img', disksize=pixiv.image_cache_size)
 
 
 class ResponseError(error.PixivError):
@@ -108,6 +125,7 @@ class Pixiv(object):
     PROXY = pixiv.proxy
     BYPASS = pixiv.bypass
     TRANSFER = pixiv.transfer
+    FAST_RESPONSE = pixiv.fast_response
 
     if PROXY:
         app = AppPixivAPI(proxy=PROXY)
@@ -121,8 +139,40 @@ class Pixiv(object):
     SELF_USER_ID = None
 
     RESULT_LIMIT = 30
+    # rows fetched per round trip when local results are streamed
+    STREAM_BATCH = 100
+    # storages claimed per round of "transfer_storages"
+    TRANSFER_BATCH = 20
+    # storages of a round downloaded and uploaded at once
+    TRANSFER_CONCURRENCY = 5
+    # priority of storages wanted by responses, others have 0
+    TRANSFER_PRIORITY = 1
+    # transfers of a storage failing before it is given up, the n-th retry
+    # waits "TRANSFER_RETRY_DELAY" * 2 ** (n - 1) seconds
+    TRANSFER_ATTEMPTS = 5
+    TRANSFER_RETRY_DELAY = 60
+    # seconds a round keeps its batch claimed from other workers
+    TRANSFER_CLAIM = 600
+    # bytes read per chunk while transferring storages
+    DOWNLOAD_CHUNK_SIZE = 1 << 16
+    # widths of WebP derivatives made while transferring
+    DERIVATIVE_WIDTHS = pixiv.derivative_widths
+    _transfers_wanted: Set[int] = set()
+    # next round of "transfer_storages" for storages waiting to retry
+    _transfers_retry: Optional[asyncio.TimerHandle] = None
+    # client shared from "start_client"
+    _client: Optional[PixivClient] = None
 
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        stream: bool = False,
+        fields: Optional[List[str]] = None,
+    ) -> None:
+        # local illust lists are returned as async iterators if set, the
+        # instance should be exited after they are consumed
+        self.stream = stream
+        # model fields loaded by local lists, see "projection"
+        self.fields = fields
         self.raw_data = None
         self.db_session = None
         self.downloads: List[tables.PixivStorage] = []
@@ -136,6 +186,20 @@ class Pixiv(object):
         self.tags: Dict[str, tables.Tag] = {}
         self.comments: Dict[int, tables.IllustComment] = {}
         self.showcases: Dict[int, tables.Showcase] = {}
+        self.rankings_written: List[Tuple[str, date]] = []
+
+    @staticmethod
+    def ranking_date(date: Union[str, date, None] = None) -> date:
+        # rankings are published at noon in Japan time
+        if date is None:
+            now = datetime.now(tz=timezone(timedelta(hours=9)))
+            if now.time() >= time(12):
+                date = now.date()
+            else:
+                date = (now - timedelta(days=1)).date()
+        elif isinstance(date, str):
+            date = datetime.strptime(date, '%Y-%m-%d').date()
+        return date
 
     @classmethod
     async def login(cls):
@@ -143,83 +207,510 @@ class Pixiv(object):
         cls.SELF_USER_ID = int(cls.app.user_id)
 
     def background_download(self):
-        self.downloads = set(self.downloads)
-        if self.DEBUG is False and self.TRANSFER:
-            for obj in self.downloads:
-                scheduler.add_job(self.transfer_storage, args=(obj.id, ))
+        if self.DEBUG is False and self.TRANSFER and self.downloads:
+            Pixiv._transfers_wanted.update(obj.id for obj in self.downloads)
+            scheduler.add_job(self.transfer_storages)
         self.downloads = []
 
-    async def transfer_storage(self, storage_id: int):
+    async def transfer_storages(self):
+        """ Transfer storages not useable yet to storage until none is left.
+
+        Each round claims a batch by priority in one session, so that
+        other workers skip it until the claim expires, and downloads
+        it concurrently to temporary files, hashing them. Contents already
+        in "PixivObject" are not uploaded again, the others are uploaded
+        once per digest, then the batch is marked in one more session.
+        Storages wanted by responses are raised to "TRANSFER_PRIORITY"
+        first. Failed storages are retried later with exponential backoff,
+        see "TRANSFER_ATTEMPTS".
+        """
+        storage = tables.PixivStorage
+        semaphore = asyncio.Semaphore(self.TRANSFER_CONCURRENCY)
+
+        async def fetch(obj: tables.PixivStorage,
+                        directory: str) -> Optional[Tuple[str, str, int]]:
+            async with semaphore:
+                try:
+                    return await self._fetch_storage(obj, directory)
+                except Exception as e:
+                    logging.getLogger('api_ethpch').warning(
+                        f'Cannot download pixiv storage {obj.id}: {e}')
+                    return None
+
+        async def upload(file: str, key: str) -> Optional[str]:
+            async with semaphore:
+                try:
+                    # temporary file cannot resume
+                    if await storage_backend.put(file,
+                                                 key,
+                                                 public_read=True,
+                                                 resumable=False):
+                        return await storage_backend.url(key) or None
+                except Exception as e:
+                    logging.getLogger('api_ethpch').warning(
+                        f'Cannot upload pixiv object "{key}": {e}')
+                return None
+
+        def claimable(now: datetime) -> list:
+            return [
+                storage.useable.is_(False),
+                storage.source.isnot(None),
+                storage.priority >= 0,
+                (storage.retry_at.is_(None), storage.retry_at <= now),
+                (storage.claimed_until.is_(None),
+                 storage.claimed_until <= now),
+            ]
+
+        while True:
+            wanted = Pixiv._transfers_wanted.copy()
+            Pixiv._transfers_wanted.clear()
+            async with Session() as session:
+                async with session.begin():
+                    if wanted:
+                        await session.execute(
+                            update(storage,
+                                   whereclauses=[
+                                       storage.id.in_(wanted),
+                                       storage.useable.is_(False),
+                                       storage.priority >= 0
+                                   ],
+                                   values={
+                                       'priority': self.TRANSFER_PRIORITY
+                                   }))
+                    now = self._utcnow()
+                    stmt = select(
+                        storage.id,
+                        whereclauses=claimable(now),
+                        order_by=storage.priority.desc(),
+                        limit=self.TRANSFER_BATCH,
+                    ).order_by(storage.id).with_for_update(skip_locked=True)
+                    ids = (await session.execute(stmt)).scalars().all()
+                    token = uuid4().hex
+                    if ids:
+                        # lost to other workers if claimed meanwhile
+                        await session.execute(
+                            update(storage,
+                                   whereclauses=claimable(now) +
+                                   [storage.id.in_(ids)],
+                                   values={
+                                       'claim':
+                                       token,
+                                       'claimed_until':
+                                       now +
+                                       timedelta(seconds=self.TRANSFER_CLAIM)
+                                   }))
+                        stmt = select(storage,
+                                      whereclauses=[storage.claim == token],
+                                      order_by=storage.priority.desc()
+                                      ).order_by(storage.id)
+                        batch = (await session.execute(stmt)).scalars().all()
+                    else:
+                        batch = []
+            if not batch:
+                if Pixiv._transfers_wanted or ids:
+                    continue
+                await self._schedule_transfer_retry()
+                break
+            with TemporaryDirectory() as directory:
+                fetched = await asyncio.gather(
+                    *[fetch(obj, directory) for obj in batch])
+                urls = await self._known_objects(
+                    {item[1]
+                     for item in fetched if item})
+                # one upload per content not stored yet
+                uploads = {}
+                for item in fetched:
+                    if item and item[1] not in urls:
+                        uploads.setdefault(item[1], item)
+                items = list(uploads.values())
+                uploaded = await asyncio.gather(*[
+                    upload(file, self._object_key(file, digest))
+                    for file, digest, _ in items
+                ])
+                objects = []
+                for (file, digest, size), url in zip(items, uploaded):
+                    if url:
+                        urls[digest] = url
+                        objects.append(
+                            dict(digest=digest,
+                                 key=self._object_key(file, digest),
+                                 url=url,
+                                 size=size))
+                if self.DERIVATIVE_WIDTHS:
+                    await asyncio.gather(*[
+                        self._make_derivatives(file, digest, directory)
+                        for (file, digest, _), url in zip(items, uploaded)
+                        if url
+                    ])
+            done = [
+                dict(storage_id=obj.id,
+                     storage_url=urls[item[1]],
+                     storage_digest=item[1])
+                for obj, item in zip(batch, fetched)
+                if item and item[1] in urls
+            ]
+            now = self._utcnow()
+            failed = [
+                dict(storage_id=obj.id,
+                     storage_attempts=obj.attempts + 1,
+                     storage_retry_at=now + timedelta(
+                         seconds=self.TRANSFER_RETRY_DELAY * 2**obj.attempts),
+                     storage_priority=obj.priority
+                     if obj.attempts + 1 < self.TRANSFER_ATTEMPTS else -1)
+                for obj, item in zip(batch, fetched)
+                if not (item and item[1] in urls)
+            ]
+            async with Session() as session:
+                async with session.begin():
+                    if objects:
+                        # skip objects added by other workers meanwhile
+                        known = await self._known_objects(
+                            {item['digest']
+                             for item in objects}, session)
+                        session.add_all([
+                            tables.PixivObject(**item) for item in objects
+                            if item['digest'] not in known
+                        ])
+                        await session.flush()
+                    if done:
+                        await session.execute(
+                            update(storage.__table__,
+                                   whereclauses=[
+                                       storage.__table__.c.id ==
+                                       bindparam('storage_id'),
+                                       storage.__table__.c.claim == token
+                                   ],
+                                   values={
+                                       'url': bindparam('storage_url'),
+                                       'digest': bindparam('storage_digest'),
+                                       'useable': True,
+                                       'claim': None,
+                                       'claimed_until': None
+                                   }), done)
+                    if failed:
+                        await session.execute(
+                            update(storage.__table__,
+                                   whereclauses=[
+                                       storage.__table__.c.id ==
+                                       bindparam('storage_id'),
+                                       storage.__table__.c.claim == token
+                                   ],
+                                   values={
+                                       'claim': None,
+                                       'claimed_until': None,
+                                       'attempts':
+                                       bindparam('storage_attempts'),
+                                       'retry_at':
+                                       bindparam('storage_retry_at'),
+                                       'priority':
+                                       bindparam('storage_priority')
+                                   }), failed)
+
+    @staticmethod
+    def _utcnow() -> datetime:
+        return datetime.now(timezone.utc).replace(tzinfo=None)
+
+    async def _schedule_transfer_retry(self):
+        # next round once the earliest storage waiting to retry is due, or
+        # the earliest claim of other workers expires
+        storage = tables.PixivStorage
+        now = self._utcnow()
+        whereclauses = [
+            storage.useable.is_(False),
+            storage.source.isnot(None),
+            storage.priority >= 0,
+        ]
         async with Session() as session:
-            async with session.begin():
-                stmt = select(
-                    tables.PixivStorage,
-                    whereclauses=[tables.PixivStorage.id == storage_id])
-                result = await session.execute(stmt)
-                if obj := result.scalar():
-                    if obj.source and obj.useable is False:
-                        dst = f'/{s3.API_BUCKET}/pixiv/' + \
-                            path.basename(obj.source)
-                        if obj._illust_u_id:
-                            try:
-                                imageio
-                                dst = dst[:-4] + '.gif'
-                            except NameError:
-                                pass
-                        if await s3.has(dst):
-                            obj.url = await s3.url(dst)
-                            obj.useable = True
-                            await session.commit()
-                        else:
-                            _ = await Pixiv.app.down(
-                                _url=obj.source,
-                                _referer='https://app-api.pixiv.net/',
-                                _request_content_type=False)
-                            content = await _.__anext__()
-                            await _.aclose()
-                            if obj._illust_u_id:
-                                try:
-                                    frames = self._ugoira_frames[
-                                        obj._illust_u_id]
-                                except KeyError:
-                                    frames = (await self.ugoira_metadata(
-                                        obj._illust_u_id))['frames']
-                                content = self._zip_to_gif(
-                                    BytesIO(content), frames)
-                            if await s3.put(content,
-                                            dst,
-                                            replace=False,
-                                            public_read=True):
-                                obj.url = await s3.url(dst)
-                                obj.useable = True
-                                await session.commit()
-                            del content
+            due = [(await session.execute(
+                select(func.min(column),
+                       whereclauses=whereclauses + [column > now]))).scalar()
+                   for column in (storage.retry_at, storage.claimed_until)]
+        due = [item for item in due if item is not None]
+        retry_at = min(due) if due else None
+        if Pixiv._transfers_retry is not None:
+            Pixiv._transfers_retry.cancel()
+            Pixiv._transfers_retry = None
+        if retry_at is not None:
+            Pixiv._transfers_retry = asyncio.get_running_loop().call_later(
+                (retry_at - self._utcnow()).total_seconds() + 1,
+                scheduler.add_job, self.transfer_storages)
 
     @staticmethod
-    def _zip_to_gif(
-        file: Union[str, PathLike[str], BytesIO],
-        frames: List[Dict[str, Any]],
-    ) -> bytes:
-        from zipfile import ZipFile
-        images = []
-        durations = []
-        with ZipFile(file, 'r') as zf:
-            for i in range(len(frames)):
-                durations.append(frames[i].delay / 1000)
-                with zf.open(frames[i].file) as f:
-                    images.append(imageio.imread(f.read()))
-        output = BytesIO()
-        imageio.mimsave(output, images, format='GIF', duration=durations)
-        data = output.getvalue()
-        del output
-        return data
+    async def _known_objects(
+            digests: Set[str],
+            session: Optional[AsyncSession] = None) -> Dict[str, str]:
+        # url of stored objects by digest
+        if not digests:
+            return {}
+        stmt = select(tables.PixivObject.digest,
+                      tables.PixivObject.url,
+                      whereclauses=[tables.PixivObject.digest.in_(digests)])
+        if session is not None:
+            return dict((await session.execute(stmt)).all())
+        async with Session() as session:
+            return dict((await session.execute(stmt)).all())
+
+    @staticmethod
+    def _object_key(file: str, digest: str) -> str:
+        # content addressed, so that a key never changes its content
+        return f'pixiv/{digest}{path.splitext(file)[1]}'
+
+    @staticmethod
+    def _derivative_key(digest: str, name: str) -> str:
+        # digest of the image derived from
+        return f'pixiv/derivatives/{digest}-{name}'
+
+    @staticmethod
+    def _file_digest(file: str) -> str:
+        digest = sha256()
+        with open(file, 'rb') as f:
+            while chunk := f.read(1 << 20):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    async def _make_derivatives(self, file: str, digest: str,
+                                directory: str):
+        # WebP derivatives of "DERIVATIVE_WIDTHS" put into storage
+        for width in {
+                imaging.derivative_width(width)
+                for width in self.DERIVATIVE_WIDTHS
+        }:
+            name = imaging.derivative_name(width, 'webp')
+            output = path.join(directory, f'{digest}-{name}')
+            try:
+                await imaging.derive(file, output, width, 'webp')
+                await storage_backend.put(output,
+                                          self._derivative_key(digest, name),
+                                          public_read=True,
+                                          resumable=False)
+            except Exception as e:
+                logging.getLogger('api_ethpch').warning(
+                    f'Cannot make derivative "{name}" of pixiv object '
+                    f'{digest}: {e}')
+
+    async def _fetch_storage(
+        self,
+        obj: tables.PixivStorage,
+        directory: str,
+    ) -> Optional[Tuple[str, str, int]]:
+        # file of content under *directory*, its sha256 digest and size
+        if not obj.source:
+            return None
+        file = path.join(directory, str(obj.id) + path.splitext(obj.source)[1])
+        digest, size = sha256(), 0
+        async with aiofiles.open(file, 'wb') as f:
+            async for chunk in self._download(obj.source):
+                digest.update(chunk)
+                size += len(chunk)
+                await f.write(chunk)
+        if obj._illust_u_id:
+            try:
+                frames = self._ugoira_frames[obj._illust_u_id]
+            except KeyError:
+                frames = (await self.ugoira_metadata(
+                    obj._illust_u_id))['frames']
+            # stored as gif, hashed again
+            zip_file, file = file, path.join(directory, f'{obj.id}.gif')
+            await imaging.zip_to_gif(
+                zip_file, [(frame.file, frame.delay) for frame in frames],
+                file)
+            digest, size = sha256(), 0
+            async with aiofiles.open(file, 'rb') as f:
+                while chunk := await f.read(self.DOWNLOAD_CHUNK_SIZE):
+                    digest.update(chunk)
+                    size += len(chunk)
+        return file, digest.hexdigest(), size
+
+    async def _stored_file(self, obj: tables.PixivStorage,
+                           directory: str) -> Optional[str]:
+        # file of content transferred to storage under *directory*
+        async with Session() as session:
+            key = (await session.execute(
+                select(tables.PixivObject.key,
+                       whereclauses=[
+                           tables.PixivObject.digest == obj.digest
+                       ]))).scalars().first()
+        if key is None:
+            return None
+        file = path.join(directory, str(obj.id) + path.splitext(key)[1])
+        try:
+            async with aiofiles.open(file, 'wb') as f:
+                async for chunk in storage_backend.stream(key):
+                    await f.write(chunk)
+        except Exception as e:
+            logging.getLogger('api_ethpch').warning(
+                f'Cannot get pixiv object "{key}": {e}')
+            return None
+        return file
+
+    async def storage_image(self, storage_id: int) -> Optional[str]:
+        """ File of storage in "image_cache", read from storage if
+        transferred or downloaded from pixiv on a miss. Concurrent misses of
+        a storage are fetched once.
+        """
+        async def fetch(directory: str) -> Optional[str]:
+            async with Session() as session:
+                obj = (await session.execute(
+                    select(tables.PixivStorage,
+                           whereclauses=[
+                               tables.PixivStorage.id == storage_id
+                           ]))).scalars().first()
+            if obj is None:
+                return None
+            if obj.useable and obj.digest and \
+                    (file := await self._stored_file(obj, directory)):
+                return file
+            try:
+                fetched = await self._fetch_storage(obj, directory)
+            except Exception as e:
+                logging.getLogger('api_ethpch').warning(
+                    f'Cannot download pixiv storage {storage_id}: {e}')
+                return None
+            return fetched[0] if fetched else None
+
+        cached = await image_cache.fill(
+            (f'{storage_id % 256:02x}', storage_id), fetch)
+        return str(cached) if cached is not None else None
+
+    async def derivative_image(self, storage_id: int, width: Optional[int],
+                               fmt: str) -> Optional[str]:
+        """ File of storage scaled down to *width* and encoded as *fmt* in
+        "image_cache", see "imaging". Derivatives are kept in storage by
+        digest of the image if "TRANSFER" is set, made from "storage_image"
+        when missing.
+        """
+        name = imaging.derivative_name(width, fmt)
+
+        async def fetch(directory: str) -> Optional[str]:
+            if (source := await self.storage_image(storage_id)) is None:
+                return None
+            file, key = path.join(directory, name), None
+            if self.TRANSFER:
+                key = self._derivative_key(
+                    await run_sync(self._file_digest)(source), name)
+                try:
+                    async with aiofiles.open(file, 'wb') as f:
+                        async for chunk in storage_backend.stream(key):
+                            await f.write(chunk)
+                    return file
+                except FileNotFoundError:
+                    pass
+                except Exception as e:
+                    logging.getLogger('api_ethpch').warning(
+                        f'Cannot get derivative "{key}": {e}')
+            try:
+                await imaging.derive(source, file, width, fmt)
+            except Exception as e:
+                logging.getLogger('api_ethpch').warning(
+                    f'Cannot make derivative "{name}" of pixiv storage '
+                    f'{storage_id}: {e}')
+                return None
+            if key is not None:
+                try:
+                    await storage_backend.put(file,
+                                              key,
+                                              public_read=True,
+                                              resumable=False)
+                except Exception as e:
+                    logging.getLogger('api_ethpch').warning(
+                        f'Cannot put derivative "{key}": {e}')
+            return file
+
+        cached = await image_cache.fill(
+            (f'{storage_id % 256:02x}', f'{storage_id}-{name}'), fetch)
+        return str(cached) if cached is not None else None
+
+    @classmethod
+    async def start_client(cls):
+        """ Share one client of pixiv between API calls and downloads. """
+        if cls._client is None and cls.app.session is None:
+            cls._client = PixivClient(**cls.app.conn_opt)
+            cls.app.session = cls._client.start()
+
+    @classmethod
+    async def close_client(cls):
+        if cls._client is not None:
+            client, cls._client, cls.app.session = cls._client, None, None
+            await client.close()
+
+    @classmethod
+    async def _download(cls, url: str) -> AsyncIterator[bytes]:
+        # body of pixiv image in chunks on the shared client, see
+        # "AppPixivAPI.down" and "start_client"
+        async with ClientManager(cls.app.session,
+                                 **cls.app.conn_opt) as session:
+            async with session.get(
+                    url,
+                    headers={'Referer': 'https://app-api.pixiv.net/'},
+                    timeout=ClientTimeout(total=None, sock_read=60),
+                    **cls.app.requests_kwargs) as resp:
+                resp.raise_for_status()
+                async for chunk in resp.content.iter_chunked(
+                        cls.DOWNLOAD_CHUNK_SIZE):
+                    yield chunk
 
     async def __aenter__(self):
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
+        TagIndex.update(self.illusts.values())
+        for mode, date in self.rankings_written:
+            ranking_cache.delete((mode, date.isoformat()))
+        self.rankings_written = []
         self.background_download()
 
+    def _illust_downloads(self, illusts: Iterable[tables.Illust]):
+        # storages not loaded for requested fields are left alone
+        for illust in illusts:
+            unloaded = inspect(illust).unloaded
+            if '_original' not in unloaded and illust._original:
+                self.downloads.extend([
+                    stor for stor in illust._original if stor.useable is False
+                ])
+            if 'ugoira' not in unloaded and illust.type == 'ugoira' and \
+                    illust.ugoira and illust.ugoira.useable is False:
+                self.downloads.append(illust.ugoira)
+
+    def _novel_downloads(self, novels: Iterable[tables.Novel]):
+        for novel in novels:
+            if 'large' not in inspect(novel).unloaded and novel.large and \
+                    novel.large.useable is False:
+                self.downloads.append(novel.large)
+
+    async def _illusts_local(
+        self,
+        stmt: Select,
+        downloads: bool = True,
+    ) -> Union[List[tables.Illust], AsyncIterator[tables.Illust]]:
+        if self.stream is True:
+            return self._illusts_stream(stmt, downloads=downloads)
+        async with Session() as session:
+            async with session.begin():
+                result = await session.execute(stmt)
+                illusts = result.scalars().unique().all()
+                if downloads is True:
+                    self._illust_downloads(illusts)
+                return illusts
+
+    async def _illusts_stream(
+        self,
+        stmt: Select,
+        downloads: bool = True,
+    ) -> AsyncIterator[tables.Illust]:
+        # server side cursor, eagerloads are emitted per batch, which is
+        # then detached as "_illusts_local" gives and to bound identity map
+        async with Session() as session:
+            async with session.begin():
+                result = await session.stream(
+                    stmt.execution_options(yield_per=self.STREAM_BATCH))
+                async for illusts in result.scalars().partitions():
+                    for obj in list(session.identity_map.values()):
+                        session.expunge(obj)
+                    if downloads is True:
+                        self._illust_downloads(illusts)
+                    for illust in illusts:
+                        yield illust
+
     @catch_pixiv_error
     async def user_detail(self, user_id: int) -> Optional[tables.User]:
         self.raw_data = await self.app.user_detail(user_id=user_id)
@@ -298,28 +789,18 @@ class Pixiv(object):
         type: Literal['illust', 'manga'] = 'illust',
         offset: Optional[int] = None,
     ) -> List[tables.Illust]:
-        async with Session() as session:
-            async with session.begin():
-                stmt = select(tables.Illust,
-                              whereclauses=[
-                                  tables.Illust.user_id == user_id,
-                                  tables.Illust.type == type
-                              ],
-                              order_by=tables.Illust.create_date.desc(),
-                              limit=Pixiv.RESULT_LIMIT,
-                              offset=offset)
-                result = await session.execute(stmt)
-                illusts = result.scalars().unique().all()
-                self.downloads.extend([
-                    stor for illust in illusts if illust._original
-                    for stor in illust._original if stor.useable is False
-                ])
-                self.downloads.extend([
-                    illust.ugoira for illust in illusts
-                    if illust.type == 'ugoira' and illust.ugoira
-                    and illust.ugoira.useable is False
-                ])
-                return illusts
+        stmt = select(tables.Illust,
+                      profile='card',
+                      projection=models.Illust,
+                      fields=self.fields,
+                      whereclauses=[
+                          tables.Illust.user_id == user_id,
+                          tables.Illust.type == type
+                      ],
+                      order_by=tables.Illust.create_date.desc(),
+                      limit=Pixiv.RESULT_LIMIT,
+                      offset=offset)
+        return await self._illusts_local(stmt)
 
     @catch_pixiv_error
     async def user_bookmarks_illust(
@@ -360,29 +841,19 @@ class Pixiv(object):
         user_id: int,
         offset: Optional[int] = None,
     ) -> List[tables.Illust]:
-        async with Session() as session:
-            async with session.begin():
-                stmt = select(
-                    tables.Illust,
-                    eagerloads=['bookmarked_by'],
-                    joins=[tables.Illust.bookmarked_by],
-                    whereclauses=[tables.User.id == user_id],
-                    order_by=tables.Illust.create_date.desc(),
-                    limit=self.RESULT_LIMIT,
-                    offset=offset,
-                )
-                result = await session.execute(stmt)
-                illusts = result.scalars().unique().all()
-                self.downloads.extend([
-                    stor for illust in illusts if illust._original
-                    for stor in illust._original if stor.useable is False
-                ])
-                self.downloads.extend([
-                    illust.ugoira for illust in illusts
-                    if illust.type == 'ugoira' and illust.ugoira
-                    and illust.ugoira.useable is False
-                ])
-                return illusts
+        stmt = select(
+            tables.Illust,
+            eagerloads=['bookmarked_by'],
+            profile='card',
+            projection=models.Illust,
+            fields=self.fields,
+            joins=[tables.Illust.bookmarked_by],
+            whereclauses=[tables.User.id == user_id],
+            order_by=tables.Illust.create_date.desc(),
+            limit=self.RESULT_LIMIT,
+            offset=offset,
+        )
+        return await self._illusts_local(stmt)
 
     @catch_pixiv_error
     async def user_related(
@@ -470,31 +941,21 @@ class Pixiv(object):
         restrict: Literal['public', 'private'] = 'public',
         offset: Optional[int] = None,
     ) -> List[tables.Illust]:
-        async with Session() as session:
-            async with session.begin():
-                stmt = select(
-                    tables.Illust,
-                    joins=[tables.Illust.user],
-                    whereclauses=[
-                        tables.User.followers.any(
-                            tables.User.id == self.SELF_USER_ID)
-                    ],
-                    order_by=tables.Illust.create_date.desc(),
-                    limit=self.RESULT_LIMIT,
-                    offset=offset,
-                )
-                result = await session.execute(stmt)
-                illusts = result.scalars().unique().all()
-                self.downloads.extend([
-                    stor for illust in illusts if illust._original
-                    for stor in illust._original if stor.useable is False
-                ])
-                self.downloads.extend([
-                    illust.ugoira for illust in illusts
-                    if illust.type == 'ugoira' and illust.ugoira
-                    and illust.ugoira.useable is False
-                ])
-                return illusts
+        stmt = select(
+            tables.Illust,
+            profile='card',
+            projection=models.Illust,
+            fields=self.fields,
+            joins=[tables.Illust.user],
+            whereclauses=[
+                tables.User.followers.any(
+                    tables.User.id == self.SELF_USER_ID)
+            ],
+            order_by=tables.Illust.create_date.desc(),
+            limit=self.RESULT_LIMIT,
+            offset=offset,
+        )
+        return await self._illusts_local(stmt)
 
     @catch_pixiv_error
     async def illust_detail(
@@ -514,10 +975,6 @@ class Pixiv(object):
                 await self._main_user_check(user_id=userdata['id'], **userdata)
                 illust = await self._main_illust_check(
                     illustdata['id'],
-                    'square_medium',
-                    'medium',
-                    'large',
-                    eagerload_strategy='selectinload',
                     **illustdata,
                 )
                 self.illusts[illust.id] = illust
@@ -528,28 +985,27 @@ class Pixiv(object):
     async def illust_detail_local(
         self,
         illust_id: int,
+        profile: str = 'detail',
     ) -> Optional[tables.Illust]:
         async with Session() as session:
             async with session.begin():
+                # whole of detail is loaded unless fields are requested
                 stmt = select(
                     tables.Illust,
-                    eagerloads=['square_medium', 'medium', 'large'],
-                    eagerload_strategy='selectinload',
+                    profile=profile,
+                    projection=models.Illust if self.fields else None,
+                    fields=self.fields,
                     whereclauses=[tables.Illust.id == illust_id],
                     limit=1,
                 )
                 result = await session.execute(stmt)
                 illust = result.scalar()
                 if illust:
-                    if illust._original:
-                        self.downloads.extend([
-                            stor for stor in illust._original
-                            if stor.useable is False
-                        ])
-                    if illust.type == 'ugoira' and illust.ugoira and \
+                    if 'ugoira' not in inspect(illust).unloaded and \
+                            illust.type == 'ugoira' and illust.ugoira and \
                             illust.ugoira.useable is False:
                         await self.ugoira_metadata(illust_id)
-                        self.downloads.append(illust.ugoira)
+                    self._illust_downloads((illust, ))
                 return illust
 
     @catch_pixiv_error
@@ -719,28 +1175,21 @@ class Pixiv(object):
         date: Optional[str] = None,
         offset: Optional[int] = None,
     ) -> List[tables.Illust]:
-        if date is None:
-            now = datetime.now(tz=timezone(timedelta(hours=9)))
-            if now.time() >= time(12):
-                date = now.date()
-            else:
-                date = (now - timedelta(days=1)).date()
-        elif isinstance(date, str):
-            date = datetime.strptime(date, '%Y-%m-%d').date()
-        async with Session() as session:
-            async with session.begin():
-                stmt = select(
-                    tables.Illust,
-                    joins=[tables._AssociationIllustRank, tables.IllustRank],
-                    whereclauses=[
-                        tables.IllustRank.mode == mode,
-                        tables.IllustRank.date == date,
-                    ],
-                    order_by=tables._AssociationIllustRank.c.ranking.asc(),
-                    offset=offset,
-                )
-                result = await session.execute(stmt)
-                return result.scalars().unique().all()
+        date = self.ranking_date(date)
+        stmt = select(
+            tables.Illust,
+            profile='card',
+            projection=models.Illust,
+            fields=self.fields,
+            joins=[tables._AssociationIllustRank, tables.IllustRank],
+            whereclauses=[
+                tables.IllustRank.mode == mode,
+                tables.IllustRank.date == date,
+            ],
+            order_by=tables._AssociationIllustRank.c.ranking.asc(),
+            offset=offset,
+        )
+        return await self._illusts_local(stmt, downloads=False)
 
     @catch_pixiv_error
     async def trending_tags_illust(self) -> List[Dict[str, Any]]:
@@ -833,84 +1282,82 @@ class Pixiv(object):
         min_bookmarks: Optional[int] = None,
         max_bookmarks: Optional[int] = None,
     ) -> List[tables.Illust]:
-        async with Session() as session:
-            async with session.begin():
-                whereclauses = []
-                if duration is not None:
-                    if duration == 'within_last_day':
-                        td = timedelta(days=1)
-                    elif duration == 'within_last_week':
-                        td = timedelta(weeks=1)
-                    elif duration == 'within_last_month':
-                        td = timedelta(days=30)
-                    whereclauses.append(
-                        tables.Illust.create_date >= datetime.utcnow() - td)
-                if start_date is not None:
-                    whereclauses.append(
-                        tables.Illust.create_date >= datetime.strptime(
-                            start_date, '%Y-%m-%d'))
-                if end_date is not None:
-                    whereclauses.append(
-                        tables.Illust.create_date <= datetime.strptime(
-                            end_date, '%Y-%m-%d'))
-                if min_bookmarks is not None:
-                    whereclauses.append(
-                        tables.Illust.total_bookmarks >= min_bookmarks)
-                if max_bookmarks is not None:
-                    whereclauses.append(
-                        tables.Illust.total_bookmarks <= max_bookmarks)
-                for kw in word.strip().split(' '):
-                    _not = False
-                    if kw.startswith('-'):
-                        kw = kw[1:]
-                        _not = True
-                    if search_target == 'partial_match_for_tags':
-                        clause = tables.Illust.id.in_(
-                            select(
-                                tables.Illust.id,
-                                joins=[tables.Illust.tags],
-                                whereclauses=[
-                                    (tables.Tag.name.like('%' +
-                                                          '%'.join(list(kw)) +
-                                                          '%'),
-                                     tables.Tag.translated_name.like(
-                                         '%' + '%'.join(list(kw)) + '%'))
-                                ]))
-                    elif search_target == 'exact_match_for_tags':
-                        clause = tables.Illust.id.in_(
-                            select(tables.Illust.id,
-                                   joins=[tables.Illust.tags],
-                                   whereclauses=[
-                                       (tables.Tag.name == kw,
-                                        tables.Tag.translated_name == kw)
-                                   ]))
-                    elif search_target == 'title_and_caption':
-                        clause = tables.Illust.id.in_(
-                            select(tables.Illust.id,
-                                   whereclauses=[
-                                       (tables.Illust.title.like(f'%{kw}%'),
-                                        tables.Illust.caption.like(f'%{kw}%'))
-                                   ]))
-                    whereclauses.append(~clause if _not else clause)
-                stmt = select(
-                    tables.Illust,
-                    whereclauses=whereclauses,
-                    order_by=getattr(tables.Illust.create_date, sort[5:])(),
-                    limit=self.RESULT_LIMIT,
-                    offset=offset,
-                )
-                result = await session.execute(stmt)
-                illusts = result.scalars().unique().all()
-                self.downloads.extend([
-                    stor for illust in illusts if illust._original
-                    for stor in illust._original if stor.useable is False
-                ])
-                self.downloads.extend([
-                    illust.ugoira for illust in illusts
-                    if illust.type == 'ugoira' and illust.ugoira
-                    and illust.ugoira.useable is False
-                ])
-                return illusts
+        whereclauses = []
+        if duration is not None:
+            if duration == 'within_last_day':
+                td = timedelta(days=1)
+            elif duration == 'within_last_week':
+                td = timedelta(weeks=1)
+            elif duration == 'within_last_month':
+                td = timedelta(days=30)
+            whereclauses.append(
+                tables.Illust.create_date >= datetime.utcnow() - td)
+        if start_date is not None:
+            whereclauses.append(
+                tables.Illust.create_date >= datetime.strptime(
+                    start_date, '%Y-%m-%d'))
+        if end_date is not None:
+            whereclauses.append(
+                tables.Illust.create_date <= datetime.strptime(
+                    end_date, '%Y-%m-%d'))
+        if min_bookmarks is not None:
+            whereclauses.append(
+                tables.Illust.total_bookmarks >= min_bookmarks)
+        if max_bookmarks is not None:
+            whereclauses.append(
+                tables.Illust.total_bookmarks <= max_bookmarks)
+        words = word.strip().split(' ')
+        if search_target != 'title_and_caption' and \
+                (clauses := await TagIndex.whereclauses(
+                    words,
+                    partial=search_target == 'partial_match_for_tags',
+                )) is not None:
+            whereclauses.extend(clauses)
+            words = []
+        for kw in words:
+            _not = False
+            if kw.startswith('-'):
+                kw = kw[1:]
+                _not = True
+            if search_target == 'partial_match_for_tags':
+                clause = tables.Illust.id.in_(
+                    select(
+                        tables.Illust.id,
+                        joins=[tables.Illust.tags],
+                        whereclauses=[
+                            (tables.Tag.name.like('%' +
+                                                  '%'.join(list(kw)) +
+                                                  '%'),
+                             tables.Tag.translated_name.like(
+                                 '%' + '%'.join(list(kw)) + '%'))
+                        ]))
+            elif search_target == 'exact_match_for_tags':
+                clause = tables.Illust.id.in_(
+                    select(tables.Illust.id,
+                           joins=[tables.Illust.tags],
+                           whereclauses=[
+                               (tables.Tag.name == kw,
+                                tables.Tag.translated_name == kw)
+                           ]))
+            elif search_target == 'title_and_caption':
+                clause = tables.Illust.id.in_(
+                    select(tables.Illust.id,
+                           whereclauses=[
+                               (tables.Illust.title.like(f'%{kw}%'),
+                                tables.Illust.caption.like(f'%{kw}%'))
+                           ]))
+            whereclauses.append(~clause if _not else clause)
+        stmt = select(
+            tables.Illust,
+            profile='card',
+            projection=models.Illust,
+            fields=self.fields,
+            whereclauses=whereclauses,
+            order_by=getattr(tables.Illust.create_date, sort[5:])(),
+            limit=self.RESULT_LIMIT,
+            offset=offset,
+        )
+        return await self._illusts_local(stmt)
 
     @catch_pixiv_error
     async def illust_bookmark_detail(
@@ -1407,6 +1854,8 @@ class Pixiv(object):
                     whereclauses.append(~clause if _not else clause)
                 stmt = select(
                     tables.Novel,
+                    projection=models.Novel,
+                    fields=self.fields,
                     whereclauses=whereclauses,
                     order_by=getattr(tables.Novel.create_date, sort[5:])(),
                     limit=self.RESULT_LIMIT,
@@ -1414,10 +1863,7 @@ class Pixiv(object):
                 )
                 result = await session.execute(stmt)
                 novels = result.scalars().unique().all()
-                self.downloads.extend([
-                    novel.large for novel in novels
-                    if novel.large and novel.large.useable is False
-                ])
+                self._novel_downloads(novels)
                 return novels
 
     @catch_pixiv_error
@@ -1461,16 +1907,15 @@ class Pixiv(object):
         async with Session() as session:
             async with session.begin():
                 stmt = select(tables.Novel,
+                              projection=models.Novel,
+                              fields=self.fields,
                               whereclauses=[tables.Novel.user_id == user_id],
                               order_by=tables.Novel.create_date.desc(),
                               limit=Pixiv.RESULT_LIMIT,
                               offset=offset)
                 result = await session.execute(stmt)
                 novels = result.scalars().unique().all()
-                self.downloads.extend([
-                    novel.large for novel in novels
-                    if novel.large and novel.large.useable is False
-                ])
+                self._novel_downloads(novels)
                 return novels
 
     @catch_pixiv_error
@@ -1504,16 +1949,21 @@ class Pixiv(object):
             async with session.begin():
                 stmt = select(
                     tables.Novel,
+                    projection=models.Novel,
+                    fields=self.fields,
                     whereclauses=[tables.Novel.series_id == series_id],
-                    order_by=tables.Novel.create_date.desc(),
+                    order_by=tables.Novel.series_position.desc(),
                     limit=self.RESULT_LIMIT,
                 )
                 result = await session.execute(stmt)
                 novels = result.scalars().unique().all()
-                self.downloads.extend([
-                    novel.large for novel in novels
-                    if novel.large and novel.large.useable is False
-                ])
+                if any(novel.series_position is None for novel in novels):
+                    # stored before series order was maintained
+                    await self._novel_series_order(session, [series_id])
+                    result = await session.execute(
+                        stmt.execution_options(populate_existing=True))
+                    novels = result.scalars().unique().all()
+                self._novel_downloads(novels)
                 return novels
 
     @catch_pixiv_error
@@ -1544,19 +1994,25 @@ class Pixiv(object):
     async def novel_detail_local(
         self,
         novel_id: int,
+        content: bool = True,
     ) -> Optional[tables.Novel]:
         async with Session() as session:
             async with session.begin():
+                # whole of novel is loaded unless fields are requested
                 stmt = select(
                     tables.Novel,
                     eagerloads=['square_medium', 'medium', 'large'],
+                    projection=models.Novel if self.fields else None,
+                    fields=self.fields,
                     whereclauses=[tables.Novel.id == novel_id],
                     limit=1,
                 )
+                if content is False and not self.fields:
+                    stmt = stmt.options(defer(tables.Novel.content))
                 result = await session.execute(stmt)
                 novel = result.scalar()
-                if novel and novel.large and novel.large.useable is False:
-                    self.downloads.append(novel.large)
+                if novel:
+                    self._novel_downloads((novel, ))
                 return novel
 
     @catch_pixiv_error
@@ -1565,7 +2021,35 @@ class Pixiv(object):
         self._novel_text = text = self._text_raw_data.novel_text
         self._novel_next[
             novel_id] = next = self._text_raw_data.series_next.get('id', None)
-        return {'id': novel_id, 'text': text, 'next': next}
+        prev = self._text_raw_data.series_prev.get('id', None)
+        return {'id': novel_id, 'text': text, 'prev': prev, 'next': next}
+
+    @staticmethod
+    async def novel_content_local(
+            novel_id: int) -> Tuple[Optional[str], Optional[str]]:
+        """ Content and content hash of novel, the hash is filled for novels
+        stored before it was maintained.
+        """
+        async with Session() as session:
+            async with session.begin():
+                stmt = select(
+                    tables.Novel.content,
+                    tables.Novel.content_hash,
+                    whereclauses=[tables.Novel.id == novel_id],
+                    limit=1,
+                )
+                result = await session.execute(stmt)
+                row = result.first()
+                if row is None or row.content is None:
+                    return None, None
+                content, content_hash = row.content, row.content_hash
+                if content_hash is None:
+                    content_hash = tables.Novel.hash_content(content)
+                    await session.execute(
+                        update(tables.Novel,
+                               whereclauses=[tables.Novel.id == novel_id],
+                               values={'content_hash': content_hash}))
+                return content, content_hash
 
     async def novel_text_local(self, novel_id: int) -> Dict[str, Any]:
         async with Session() as session:
@@ -1573,26 +2057,27 @@ class Pixiv(object):
                 stmt = select(
                     tables.Novel.content,
                     tables.Novel.series_id,
+                    tables.Novel.series_position,
+                    tables.Novel.series_prev_id,
+                    tables.Novel.series_next_id,
                     whereclauses=[tables.Novel.id == novel_id],
                     limit=1,
                 )
                 result = await session.execute(stmt)
-                content, series_id = result.first()
-                if content:
-                    d = {'id': novel_id, 'text': content, 'next': None}
-                    if series_id:
-                        _stmt = select(
-                            tables.Novel.id,
-                            whereclauses=[tables.Novel.series_id == series_id],
-                            order_by=tables.Novel.create_date.asc(),
-                        )
-                        _result = await session.execute(_stmt)
-                        _series = _result.scalars().all()
-                        try:
-                            d['next'] = _series[_series.index(novel_id) + 1]
-                        except IndexError:
-                            pass
-                    return d
+                row = result.first()
+                if row and row.content:
+                    if row.series_id and row.series_position is None:
+                        # stored before series order was maintained
+                        await self._novel_series_order(session,
+                                                       [row.series_id])
+                        result = await session.execute(stmt)
+                        row = result.first()
+                    return {
+                        'id': novel_id,
+                        'text': row.content,
+                        'prev': row.series_prev_id,
+                        'next': row.series_next_id,
+                    }
                 else:
                     return {'id': novel_id, 'text': None, 'next': None}
 
@@ -1690,6 +2175,7 @@ class Pixiv(object):
         async with Session() as session:
             async with session.begin():
                 stmt = select(tables.Showcase,
+                              profile='detail',
                               whereclauses=[tables.Showcase.id == showcase_id],
                               limit=1)
                 result = await session.execute(stmt)
@@ -1727,18 +2213,23 @@ class Pixiv(object):
                     if not (tag.startswith('-') and tag[1:] in tags) and not (
                         tag.startswith('-') is False and ('-' + tag) in tags)
                 ]
-                for tag in tags:
-                    _not = False
-                    if tag.startswith('-'):
-                        tag = tag[1:]
-                        _not = True
-                    clause_0 = tables.Illust.tags.any(tables.Tag.name == tag)
-                    clause_1 = tables.Illust.tags.any(
-                        tables.Tag.translated_name == tag)
-                    if _not:
-                        whereclauses.extend((~clause_0, ~clause_1))
-                    else:
-                        whereclauses.append((clause_0, clause_1))
+                if (clauses := await TagIndex.whereclauses(
+                        tags, sample=True)) is not None:
+                    whereclauses.extend(clauses)
+                else:
+                    for tag in tags:
+                        _not = False
+                        if tag.startswith('-'):
+                            tag = tag[1:]
+                            _not = True
+                        clause_0 = tables.Illust.tags.any(
+                            tables.Tag.name == tag)
+                        clause_1 = tables.Illust.tags.any(
+                            tables.Tag.translated_name == tag)
+                        if _not:
+                            whereclauses.extend((~clause_0, ~clause_1))
+                        else:
+                            whereclauses.append((clause_0, clause_1))
                 count_stmt = select(
                     func.count(),
                     select_from=tables.Illust,
@@ -1748,6 +2239,7 @@ class Pixiv(object):
                 count = count_result.scalar()
                 stmt = select(
                     tables.Illust,
+                    profile='card',
                     joins=[tables.Illust.tags],
                     whereclauses=whereclauses,
                     order_by=func.random(),
@@ -2103,6 +2595,7 @@ class Pixiv(object):
         illust_id: int,
         *eagerloads,
         eagerload_strategy: str = None,
+        profile: str = 'detail',
         **construct_params,
     ) -> tables.Illust:
         construct_params.pop('id', None)
@@ -2114,6 +2607,7 @@ class Pixiv(object):
             tables.Illust,
             eagerloads=eagerloads,
             eagerload_strategy=eagerload_strategy,
+            profile=profile,
             whereclauses=[tables.Illust.id == illust_id],
             limit=1,
         )
@@ -2138,6 +2632,7 @@ class Pixiv(object):
         all_illusts: Dict[int, Dict[str, Any]],
         *eagerloads,
         eagerload_strategy: str = None,
+        profile: str = 'card',
         **construct_params,
     ):
         illust_ids = list(all_illusts.keys())
@@ -2149,6 +2644,7 @@ class Pixiv(object):
                     RelationshipProperty)
             ],
             eagerload_strategy=eagerload_strategy,
+            profile=profile,
             whereclauses=[tables.Illust.id.in_(illust_ids)],
         )
         i_result = await self.db_session.execute(i_stmt)
@@ -2173,14 +2669,7 @@ class Pixiv(object):
 
     async def _rank_into_db(self, mode, date, offset, illust_ids):
         # SQLAlchemy core query
-        if date is None:
-            now = datetime.now(tz=timezone(timedelta(hours=9)))
-            if now.time() >= time(12):
-                date = now.date()
-            else:
-                date = (now - timedelta(days=1)).date()
-        elif isinstance(date, str):
-            date = datetime.strptime(date, '%Y-%m-%d').date()
+        date = self.ranking_date(date)
         r_asso_stmt = select(
             tables._AssociationIllustRank,
             joins=[tables.IllustRank],
@@ -2211,6 +2700,7 @@ class Pixiv(object):
         if inserts:
             await self.db_session.execute(
                 tables._AssociationIllustRank.insert(), inserts)
+            self.rankings_written.append((mode, date))
 
     def _noveldata_constructor(self, **construct_params) -> Dict[str, Any]:
         _ = dict(
@@ -2305,6 +2795,7 @@ class Pixiv(object):
             await self.novel_text(novel_id)
             construct_params['content'] = self._novel_text
             mnovel = self._novel_create({'id': novel_id, **construct_params})
+        await self._novel_series_into_db([mnovel.series_id])
         return mnovel
 
     async def _novels_into_db(
@@ -2339,6 +2830,49 @@ class Pixiv(object):
                 if self.novels[nid].content is None:
                     noveldata['content'] = (await self.novel_text(nid))['text']
                 self._novel_attr_check(self.novels[nid], noveldata)
+        await self._novel_series_into_db(
+            [self.novels[nid].series_id for nid in novel_ids])
+
+    async def _novel_series_into_db(self, series_ids: Iterable[int]):
+        series_ids = {series_id for series_id in series_ids if series_id}
+        if series_ids:
+            await self.db_session.flush()
+            await self._novel_series_order(self.db_session, series_ids)
+
+    @staticmethod
+    async def _novel_series_order(session, series_ids: Iterable[int]):
+        # SQLAlchemy core query
+        stmt = select(
+            tables.Novel.id,
+            tables.Novel.series_id,
+            tables.Novel.series_position,
+            tables.Novel.series_prev_id,
+            tables.Novel.series_next_id,
+            whereclauses=[tables.Novel.series_id.in_(series_ids)],
+            order_by=tables.Novel._create_date.asc(),
+        ).order_by(tables.Novel.id.asc())
+        result = await session.execute(stmt)
+        series = defaultdict(list)
+        for row in result.all():
+            series[row.series_id].append(row)
+        updates = []
+        for rows in series.values():
+            for i in range(len(rows)):
+                position = dict(
+                    series_position=i + 1,
+                    series_prev_id=rows[i - 1].id if i > 0 else None,
+                    series_next_id=rows[i + 1].id
+                    if i + 1 < len(rows) else None,
+                )
+                if any(getattr(rows[i], k) != v
+                       for k, v in position.items()):
+                    updates.append(dict(novel_id=rows[i].id, **position))
+        if updates:
+            await session.execute(
+                update(tables.Novel.__table__,
+                       whereclauses=[
+                           tables.Novel.__table__.c.id == bindparam('novel_id')
+                       ]), updates)
 
     async def _tags_into_db(self, all_tags: Dict[str, Dict[str, str]]):
         self.tags.clear()
@@ -2446,6 +2980,7 @@ class Pixiv(object):
         construct_params.pop('id', None)
         msc_stmt = select(
             tables.Showcase,
+            profile='detail',
             whereclauses=[tables.Showcase.id == showcase_id],
             limit=1,
         )
@@ -2473,6 +3008,7 @@ class Pixiv(object):
         showcase_ids = all_showcases.keys()
         sc_stmt = select(
             tables.Showcase,
+            profile='detail',
             whereclauses=[tables.Showcase.id.in_(showcase_ids)],
         )
         sc_result = await self.db_session.execute(sc_stmt)
@@ -1,13 +1,21 @@
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
+from hashlib import md5
 from random import randint
 from typing import List, Union
-from sqlalchemy import select, UniqueConstraint
+from sqlalchemy import select, Index, UniqueConstraint
 from sqlalchemy import Table, Column, ForeignKey, Boolean, \
     Integer, String, Text, Date, DateTime
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, validates
 from sqlalchemy.ext.hybrid import hybrid_property
 from utils.database import Base, BaseMixin
 
+
+def _local_timezone() -> timezone:
+    # rounded to minutes, the difference of clocks is off by microseconds
+    offset = (datetime.now() - datetime.utcnow()).total_seconds()
+    return timezone(timedelta(minutes=round(offset / 60)))
+
+
 _AssociationUserFollow = Table(
     'pixiv_association_user_follow', Base.metadata,
     Column('follower_id',
@@ -120,12 +128,40 @@ _AssociationShowcaseIllust = Table(
            primary_key=True))
 
 
+class PixivObject(Base):
+    """ Content transferred to storage, by sha256 digest of it. """
+    __tablename__ = 'storage_pixiv_object'
+    digest = Column(String(64), primary_key=True)
+    key = Column(String(500), nullable=False)
+    url = Column(String(500), nullable=False)
+    size = Column(Integer, nullable=False)
+
+
 class PixivStorage(Base, BaseMixin):
     __tablename__ = 'storage_pixiv'
     source = Column(String(500))
     page = Column(Integer, nullable=False, default=0)
     useable = Column(Boolean, nullable=False, default=False)
     url = Column(String(500))
+    # claimed in descending order by "Pixiv.transfer_storages", negative
+    # once transfer failed "Pixiv.TRANSFER_ATTEMPTS" times, server defaults
+    # fill rows existing before
+    priority = Column(Integer,
+                      nullable=False,
+                      default=0,
+                      server_default='0',
+                      index=True)
+    # failed transfers, the next one is not tried before "retry_at"
+    attempts = Column(Integer, nullable=False, default=0, server_default='0')
+    retry_at = Column(DateTime)
+    # token of the round transferring the storage, others skip it until
+    # "claimed_until"
+    claim = Column(String(32))
+    claimed_until = Column(DateTime)
+    # content stored, shared by storages of equal content
+    digest = Column(String(64),
+                    ForeignKey('storage_pixiv_object.digest'),
+                    index=True)
     _user_p_id = Column('user_p_id', Integer, ForeignKey('pixiv_user.id'))
     _user_bg_id = Column('user_bg_id', Integer, ForeignKey('pixiv_user.id'))
     _illust_sm_id = Column('illust_sm_id', Integer,
@@ -144,6 +180,9 @@ class PixivStorage(Base, BaseMixin):
     _showcase_tn_id = Column('showcase_tn_id', Integer,
                              ForeignKey('pixiv_showcase.id'))
 
+    # read by "__repr__" and "__bool__", see "utils.database.projection"
+    __projection_required__ = ('source', 'page', 'useable', 'url')
+
     def __repr__(self) -> str:
         return self.url if self.useable else self.pcat_reverse or ''
 
@@ -241,11 +280,10 @@ class Illust(Base):
     type = Column(String(6))
     caption = Column(Text)
     user_id = Column(Integer, ForeignKey('pixiv_user.id'))
-    user = relationship('User', backref='illusts', lazy='joined')
+    user = relationship('User', backref='illusts')
     tags = relationship('Tag',
                         secondary=_AssociationIllustTag,
-                        backref='illusts',
-                        lazy='joined')
+                        backref='illusts')
     series_id = Column(Integer)
     series_title = Column(String(50))
     _create_date = Column('create_date', DateTime, default=datetime.min)
@@ -267,22 +305,28 @@ class Illust(Base):
                            order_by=PixivStorage.page.asc())
     _large = relationship('PixivStorage',
                           primaryjoin=PixivStorage._illust_l_id == id,
-                          order_by=PixivStorage.page.asc(),
-                          lazy='joined')
+                          order_by=PixivStorage.page.asc())
     _original = relationship('PixivStorage',
                              primaryjoin=PixivStorage._illust_o_id == id,
-                             order_by=PixivStorage.page.asc(),
-                             lazy='joined')
+                             order_by=PixivStorage.page.asc())
     ugoira = relationship('PixivStorage',
                           primaryjoin=PixivStorage._illust_u_id == id,
-                          uselist=False,
-                          lazy='joined')
+                          uselist=False)
+
+    # loader profiles applied per query, see "utils.database.crud.select"
+    __loader_profiles__ = {
+        'card': ('user', 'tags', '_large', '_original', 'ugoira'),
+        'detail': ('user', 'tags', '_square_medium', '_medium', '_large',
+                   '_original', 'ugoira'),
+        'image': ('_large', '_original', 'ugoira'),
+    }
+    __projection_required__ = ('type', 'page_count')
 
     @hybrid_property
     def create_date(self) -> datetime:
         try:
             return self._create_date.replace(tzinfo=timezone.utc).astimezone(
-                timezone(datetime.now() - datetime.utcnow()))
+                _local_timezone())
         except AttributeError:
             return self._create_date
 
@@ -381,8 +425,12 @@ class IllustRank(Base, BaseMixin):
     date = Column(Date, nullable=False)
     illusts = relationship('Illust',
                            secondary=_AssociationIllustRank,
-                           order_by=_AssociationIllustRank.c.ranking,
-                           lazy='joined')
+                           order_by=_AssociationIllustRank.c.ranking)
+
+    __loader_profiles__ = {
+        'card': ('illusts', *('illusts.' + path
+                              for path in Illust.__loader_profiles__['card'])),
+    }
 
 
 class Tag(Base, BaseMixin):
@@ -392,6 +440,8 @@ class Tag(Base, BaseMixin):
     name = Column(String(50), unique=True)
     translated_name = Column(String(100))
 
+    __projection_required__ = ('name', )
+
     def __repr__(self) -> str:
         return self.name
 
@@ -401,10 +451,16 @@ class Tag(Base, BaseMixin):
 
 class Novel(Base):
     __tablename__ = 'pixiv_novel'
+    __table_args__ = [Index('ix_pixiv_novel_series', 'series_id',
+                            'series_position')]
+    __table_args__.extend(Base.__table_args__)
+    __table_args__ = tuple(__table_args__)
     id = Column(Integer, primary_key=True)
     title = Column(String(100))
     caption = Column(Text)
     content = Column(Text)
+    # md5 of content, maintained whenever content is set
+    content_hash = Column(String(32))
     is_original = Column(Boolean)
     _create_date = Column('create_date', DateTime, default=datetime.min)
     tags = relationship('Tag',
@@ -417,6 +473,10 @@ class Novel(Base):
     user = relationship('User', backref='novels', lazy='joined')
     series_id = Column(Integer)
     series_title = Column(String(50))
+    # ordered by create date within series, maintained on ingest
+    series_position = Column(Integer)
+    series_prev_id = Column(Integer)
+    series_next_id = Column(Integer)
     total_bookmarks = Column(Integer)
     total_view = Column(Integer)
     total_comments = Column(Integer)
@@ -434,11 +494,22 @@ class Novel(Base):
                          uselist=False,
                          lazy='joined')
 
+    __projection_required__ = ('series_position', )
+
+    @staticmethod
+    def hash_content(content: str) -> str:
+        return md5(content.encode()).hexdigest()
+
+    @validates('content')
+    def _validate_content(self, key: str, value: str) -> str:
+        self.content_hash = None if value is None else self.hash_content(value)
+        return value
+
     @hybrid_property
     def create_date(self) -> datetime:
         try:
             return self._create_date.replace(tzinfo=timezone.utc).astimezone(
-                timezone(datetime.now() - datetime.utcnow()))
+                _local_timezone())
         except AttributeError:
             return self._create_date
 
@@ -466,7 +537,7 @@ class IllustComment(Base):
     def date(self) -> datetime:
         try:
             return self._date.replace(tzinfo=timezone.utc).astimezone(
-                timezone(datetime.now() - datetime.utcnow()))
+                _local_timezone())
         except AttributeError:
             return self._date
 
@@ -499,15 +570,18 @@ class Showcase(Base):
     introduction = Column(Text)
     footer = Column(String(100))
     is_onlyoneuser = Column(Boolean)
-    illusts = relationship('Illust',
-                           secondary=_AssociationShowcaseIllust,
-                           lazy='joined')
+    illusts = relationship('Illust', secondary=_AssociationShowcaseIllust)
+
+    __loader_profiles__ = {
+        'detail': ('illusts', *(
+            'illusts.' + path for path in Illust.__loader_profiles__['card'])),
+    }
 
     @hybrid_property
     def publish_date(self):
         try:
             return self._publish_date.replace(tzinfo=timezone.utc).astimezone(
-                timezone(datetime.now() - datetime.utcnow()))
+                _local_timezone())
         except AttributeError:
             return self._publish_date
 
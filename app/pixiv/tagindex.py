@@ -0,0 +1,265 @@
+"""
+Per-worker in-memory index of tag -> illust ids.
+
+Boolean tag expressions such as "A B -R-18 -R-18G" are evaluated with set
+intersection and difference instead of a chain of EXISTS subqueries, only
+the resulting illust ids are sent to the database for hydration.
+
+Matching follows the SQL fallback of callers, "=" for exact matching and
+LIKE for partial matching, which ignores case of ASCII letters on SQLite
+only. On other databases case is decided by collation, so that words with
+cased letters are left to the database.
+
+Illusts ingested by other workers or by the scheduler process are not seen
+by "TagIndex.update", so a signature of the tag tables is compared with the
+database at most every "CHECK_INTERVAL" seconds. A stale index is rebuilt in
+background and callers fall back to the database meanwhile.
+"""
+import re
+import random
+import asyncio
+import time
+from collections import defaultdict
+from logging import getLogger
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.exc import DetachedInstanceError
+from sqlalchemy.sql.functions import func
+from sqlalchemy.sql.elements import ColumnElement
+from utils.database.session import Session
+from utils.database.crud import select
+from . import tables
+
+logger = getLogger('api_ethpch')
+
+# LIKE wildcards of words, see "TagIndex.partial"
+_WILDCARDS = {'%': '.*', '_': '.'}
+
+
+class TagIndex(object):
+    # tag name or translated name -> tag ids
+    _names: Dict[str, Set[int]] = defaultdict(set)
+    # tag id -> illust ids
+    _illusts: Dict[int, Set[int]] = defaultdict(set)
+    # illust id -> tag ids, used to drop stale entries on update
+    _tags: Dict[int, Set[int]] = defaultdict(set)
+    _ready: bool = False
+    # signature of tag tables the index was built from
+    _signature: Optional[tuple] = None
+    _checked: float = 0.0
+    _building: Optional[asyncio.Task] = None
+
+    # maximum number of ids passed to database in a single "IN" clause
+    HYDRATE_LIMIT = 5000
+    # seconds an index is trusted without comparing signature
+    CHECK_INTERVAL = 10
+
+    @classmethod
+    def ready(cls) -> bool:
+        return cls._ready
+
+    @classmethod
+    def clear(cls):
+        cls._names.clear()
+        cls._illusts.clear()
+        cls._tags.clear()
+        cls._ready = False
+        cls._signature = None
+
+    @staticmethod
+    async def _fetch_signature(session: AsyncSession) -> tuple:
+        # changes with tags added or renamed and illust tags written
+        association = tables._AssociationIllustTag.c
+        a_stmt = select(func.count(), func.sum(association.tag_id),
+                        func.sum(association.illust_id))
+        t_stmt = select(func.count(tables.Tag.id), func.max(tables.Tag.id),
+                        func.count(tables.Tag.translated_name))
+        return (*(await session.execute(a_stmt)).one(),
+                *(await session.execute(t_stmt)).one())
+
+    @classmethod
+    async def build(cls):
+        # filled aside, index in use is replaced once complete
+        names, illusts, tags = defaultdict(set), defaultdict(set), \
+            defaultdict(set)
+        async with Session() as session:
+            async with session.begin():
+                signature = await cls._fetch_signature(session)
+                t_stmt = select(tables.Tag.id, tables.Tag.name,
+                                tables.Tag.translated_name)
+                t_result = await session.execute(t_stmt)
+                for tag_id, name, translated_name in t_result.all():
+                    cls._add_tag(tag_id, name, translated_name, names)
+                a_stmt = select(tables._AssociationIllustTag.c.tag_id,
+                                tables._AssociationIllustTag.c.illust_id)
+                a_result = await session.stream(a_stmt)
+                async for tag_id, illust_id in a_result:
+                    illusts[tag_id].add(illust_id)
+                    tags[illust_id].add(tag_id)
+        cls._names, cls._illusts, cls._tags = names, illusts, tags
+        cls._signature = signature
+        cls._checked = time.monotonic()
+        cls._ready = True
+        logger.info(f'Pixiv tag index built with {len(cls._illusts)} tags '
+                    f'and {len(cls._tags)} illusts.')
+
+    @classmethod
+    def _add_tag(cls,
+                 tag_id: int,
+                 name: str,
+                 translated_name: str = None,
+                 names: Dict[str, Set[int]] = None):
+        names = cls._names if names is None else names
+        if name is not None:
+            names[name].add(tag_id)
+        if translated_name is not None:
+            names[translated_name].add(tag_id)
+
+    @classmethod
+    async def fresh(cls) -> bool:
+        """ Whether index is ready and matches database.
+
+        A stale index is rebuilt in background, False is returned until
+        the rebuild is complete.
+        """
+        if cls._signature is None or cls._building is not None and \
+                not cls._building.done():
+            return False
+        if time.monotonic() - cls._checked < cls.CHECK_INTERVAL:
+            return cls._ready
+        async with Session() as session:
+            signature = await cls._fetch_signature(session)
+        cls._checked = time.monotonic()
+        cls._ready = signature == cls._signature
+        if cls._ready is False:
+            logger.info('Pixiv tag index is stale, rebuilding.')
+            cls._building = asyncio.create_task(cls._rebuild())
+        return cls._ready
+
+    @classmethod
+    async def _rebuild(cls):
+        try:
+            await cls.build()
+        except Exception:
+            # checked again after "CHECK_INTERVAL"
+            logger.exception('Pixiv tag index rebuild failed.')
+
+    @classmethod
+    def update(cls, illusts: Iterable[tables.Illust]):
+        if cls._ready is False:
+            return
+        for illust in illusts:
+            try:
+                tags = illust.tags
+            except DetachedInstanceError:
+                continue
+            tag_ids = set()
+            for tag in tags:
+                if tag.id is None:
+                    continue
+                cls._add_tag(tag.id, tag.name, tag.translated_name)
+                tag_ids.add(tag.id)
+            for tag_id in cls._tags[illust.id].difference(tag_ids):
+                cls._illusts[tag_id].discard(illust.id)
+            for tag_id in tag_ids:
+                cls._illusts[tag_id].add(illust.id)
+            cls._tags[illust.id] = tag_ids
+
+    @classmethod
+    def _lookup(cls, tag_ids: Iterable[int]) -> Set[int]:
+        ids = set()
+        for tag_id in tag_ids:
+            ids.update(cls._illusts.get(tag_id, ()))
+        return ids
+
+    @classmethod
+    def exact(cls, word: str) -> Set[int]:
+        return cls._lookup(cls._names.get(word, ()))
+
+    @staticmethod
+    def _dialect() -> str:
+        return Session.get_engine().dialect.name
+
+    @classmethod
+    def _supported(cls, words: Iterable[str], partial: bool) -> bool:
+        # whether index gives what database gives for words
+        dialect = cls._dialect()
+        for word in words:
+            if partial and '\\' in word:
+                # escape character of LIKE on some databases
+                return False
+            if dialect not in ('sqlite', 'postgresql') and \
+                    word.lower() != word.upper():
+                return False
+        return True
+
+    @classmethod
+    def partial(cls, word: str) -> Set[int]:
+        # same semantics as LIKE "%w%o%r%d%", wildcards of word included
+        flags = re.DOTALL
+        if cls._dialect() == 'sqlite':
+            flags |= re.IGNORECASE | re.ASCII
+        pattern = re.compile(
+            '.*'.join(_WILDCARDS.get(char, re.escape(char)) for char in word),
+            flags=flags)
+        return cls._lookup(tag_id for name, tag_ids in cls._names.items()
+                           if pattern.search(name) for tag_id in tag_ids)
+
+    @classmethod
+    def evaluate(
+        cls,
+        words: Iterable[str],
+        partial: bool = False,
+    ) -> Tuple[Optional[Set[int]], Set[int]]:
+        """ Evaluate tag expression, words starting with "-" are excluded.
+
+        Return included and excluded illust ids, included is None if no
+        positive word is given.
+        """
+        match = cls.partial if partial else cls.exact
+        included = None
+        excluded = set()
+        for word in words:
+            if word.startswith('-'):
+                excluded.update(match(word[1:]))
+            elif included is None:
+                included = match(word)
+            else:
+                included.intersection_update(match(word))
+        if included is not None:
+            included.difference_update(excluded)
+        return included, excluded
+
+    @classmethod
+    async def whereclauses(
+        cls,
+        words: Iterable[str],
+        partial: bool = False,
+        sample: bool = False,
+    ) -> Optional[List[ColumnElement]]:
+        """ Whereclauses on illust id equivalent to the tag expression.
+
+        Return None if index is unavailable or stale, does not match words
+        as database does or the id sets are too large, callers should fall
+        back to EXISTS subqueries then. If *sample* is
+        True, too large included ids are randomly sampled instead.
+        """
+        words = list(words)
+        if not cls._supported(words, partial) or not await cls.fresh():
+            return None
+        included, excluded = cls.evaluate(words, partial=partial)
+        if included is not None:
+            if len(included) > cls.HYDRATE_LIMIT:
+                if sample is False:
+                    return None
+                included = random.sample(tuple(included), cls.HYDRATE_LIMIT)
+            return [tables.Illust.id.in_(included)]
+        elif excluded:
+            if len(excluded) > cls.HYDRATE_LIMIT:
+                return None
+            return [tables.Illust.id.notin_(excluded)]
+        else:
+            return []
+
+
+__all__ = ('TagIndex', )
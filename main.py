@@ -87,6 +87,13 @@ def alembic(mode: int, *args):
         alembic.alembic_migrate()
 
 
+def reconcile_inventory(bucket: str = None, **kwargs):
+    import asyncio
+    from utils.storage.s3 import reconcile
+    count = asyncio.run(reconcile(bucket))
+    logger.info(f'Reconcile S3 inventory accomplished, {count} objects.')
+
+
 def main(argv: list = []):
     parser = ArgumentParser(
         prog='api.ethpch',
@@ -107,6 +114,8 @@ def main(argv: list = []):
     is_u.add_argument('-f', '--force', action='store_true', dest='force')
     subparsers.add_parser('makemigrations')
     subparsers.add_parser('migrate')
+    rc_u = subparsers.add_parser('reconcile')
+    rc_u.add_argument('-b', '--bucket', dest='bucket')
     rs_u = subparsers.add_parser('runserver')
     rs_u.add_argument('--debug', action='store_true', dest='debug')
     rs_u.add_argument('--allow_reload',
@@ -123,6 +132,7 @@ def main(argv: list = []):
         'install-systemd': partial(install_systemd_unit, **vars(args)),
         'makemigrations': partial(alembic, 2),
         'migrate': partial(alembic, 3),
+        'reconcile': partial(reconcile_inventory, **vars(args)),
         'runserver': partial(runserver, **vars(args)),
         'uninstall-systemd': uninstall_systemd_unit,
         'update': partial(update, **vars(args))
@@ -0,0 +1,73 @@
+"""
+Benchmark of payload size and encode time of MessagePack responses against
+JSON responses of "response_class", for a page of illusts as the local
+search endpoints give.
+
+Run from the checkout with "python tests/bench_msgpack.py".
+"""
+import gzip
+import timeit
+from datetime import datetime, timedelta, timezone
+import conftest
+from app.base import _msgpack_response, NegotiatedResponse, response_class
+
+NUMBER = 200
+
+
+def _illusts(count: int = 30) -> list:
+    date = datetime(2021, 1, 1, tzinfo=timezone.utc)
+    return [{
+        'id': 90000000 + i,
+        'title': f'タイトル {i}',
+        'type': 'illust',
+        'caption': 'キャプション ' * 10,
+        'user': {
+            'id': 1000 + i,
+            'name': f'user{i}',
+            'account': f'account{i}',
+        },
+        'tags': [{
+            'name': f'タグ{j}',
+            'translated_name': f'tag{j}'
+        } for j in range(8)],
+        'create_date': date + timedelta(hours=i),
+        'page_count': 3,
+        'width': 1200,
+        'height': 1600,
+        'sanity_level': 2,
+        'total_view': 12345 + i,
+        'total_bookmarks': 678 + i,
+        'files': [{
+            'page': page,
+            'source': f'https://i.pximg.net/img/{i}_p{page}.jpg',
+            'pcat': f'https://i.pixiv.cat/img/{i}_p{page}.jpg',
+            'url': None,
+        } for page in range(3)],
+    } for i in range(count)]
+
+
+def _render(content, msgpack: bool) -> bytes:
+    token = _msgpack_response.set(msgpack)
+    try:
+        return NegotiatedResponse(content).body
+    finally:
+        _msgpack_response.reset(token)
+
+
+def main():
+    content = _illusts()
+    for name, msgpack in ((response_class.__name__, False),
+                          ('MessagePack', True)):
+        body = _render(content, msgpack)
+        seconds = timeit.timeit(lambda: _render(content, msgpack),
+                                number=NUMBER)
+        print(f'{name:20} {len(body):8} bytes '
+              f'{len(gzip.compress(body)):8} gzipped '
+              f'{seconds / NUMBER * 1e6:10.1f} us')
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    finally:
+        conftest.pytest_sessionfinish(None, 0)
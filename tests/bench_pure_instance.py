@@ -0,0 +1,135 @@
+"""
+Benchmark of "pure_instance" and "pure_dict" against the former
+implementation, which read every name of "dir" on each instance.
+
+Run from the checkout with "python tests/bench_pure_instance.py".
+"""
+import timeit
+from collections import defaultdict
+import conftest
+from sqlalchemy.orm.exc import DetachedInstanceError
+from app.pixiv import tables
+from utils.database import Base, _Compiled, _sa_meta, pure_dict, \
+    pure_instance
+
+NUMBER = 20
+
+
+def _names(instance):
+    return [
+        name for name in dir(instance) if name not in _sa_meta and (
+            name.startswith('__') is False and name.endswith('__') is False)
+    ]
+
+
+def _collect(instance) -> dict:
+    collection = {id(instance): instance}
+    need_to_search = [instance]
+    while need_to_search:
+        origin = need_to_search.pop(0)
+        for name in _names(origin):
+            try:
+                attr = getattr(origin, name)
+            except DetachedInstanceError:
+                continue
+            for obj in attr if isinstance(attr, list) else (attr, ):
+                if isinstance(obj, Base) and id(obj) not in collection:
+                    collection[id(obj)] = obj
+                    need_to_search.append(obj)
+    return collection
+
+
+def former_pure_instance(instance) -> object:
+    retains = _Compiled.retains
+    collection = _collect(instance)
+    types = {}
+    instances = {}
+    for key, origin in collection.items():
+        cls = type(origin)
+        if cls not in types:
+            types[cls] = type(
+                'TempType_' + cls.__module__ + '.' + cls.__name__,
+                (object, ), {
+                    name: getattr(cls, name)
+                    for name in dir(origin) if name in retains
+                })
+        instances[key] = types[cls]()
+    for key, origin in collection.items():
+        for name in _names(origin):
+            try:
+                attr = getattr(origin, name)
+            except DetachedInstanceError:
+                attr = None
+            if isinstance(attr, list):
+                attr = [
+                    instances[id(item)] if isinstance(item, Base) else item
+                    for item in attr
+                ]
+            elif isinstance(attr, Base):
+                attr = instances[id(attr)]
+            setattr(instances[key], name, attr)
+    main = instances[id(instance)]
+    main.__sa_origin__ = instance
+    main.__associations__ = instances
+    return main
+
+
+def former_pure_dict(instance) -> dict:
+    collection = _collect(instance)
+    dicts = defaultdict(dict)
+    for key, origin in collection.items():
+        for name in _names(origin):
+            try:
+                attr = getattr(origin, name)
+            except DetachedInstanceError:
+                attr = None
+            if isinstance(attr, list):
+                attr = [
+                    dicts[id(item)] if isinstance(item, Base) else item
+                    for item in attr
+                ]
+            elif isinstance(attr, Base):
+                attr = dicts[id(attr)]
+            dicts[key][name] = attr
+    main = dicts[id(instance)]
+    main['__sa_origin__'] = instance
+    main['__associations__'] = dicts
+    return main
+
+
+def _illusts(count: int = 50) -> list:
+    user = tables.User(id=1, name='user')
+    user.profile = tables.PixivStorage(source='https://p/user.jpg')
+    tags = [tables.Tag(id=i, name=f'tag{i}') for i in range(20)]
+    illusts = []
+    for i in range(count):
+        illust = tables.Illust(id=i, title=str(i), type='illust', user=user,
+                               tags=tags[i % 10:i % 10 + 5])
+        illust._large = [
+            tables.PixivStorage(source=f'https://p/{i}_l.jpg')
+        ]
+        illust._original = [
+            tables.PixivStorage(source=f'https://p/{i}_p{page}.jpg')
+            for page in range(3)
+        ]
+        illusts.append(illust)
+    return illusts
+
+
+def main():
+    illusts = _illusts()
+    for name, func in (('pure_instance', pure_instance),
+                       ('former pure_instance', former_pure_instance),
+                       ('pure_dict', pure_dict),
+                       ('former pure_dict', former_pure_dict)):
+        seconds = timeit.timeit(lambda: [func(i) for i in illusts],
+                                number=NUMBER)
+        print(f'{name:24} {seconds / NUMBER / len(illusts) * 1e6:10.1f} '
+              'us per illust')
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    finally:
+        conftest.pytest_sessionfinish(None, 0)
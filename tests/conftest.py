@@ -0,0 +1,40 @@
+"""
+Tests run in a temporary directory holding "config.yaml", which is also the
+home directory, so that neither the checkout nor "~/.api_ethpch" is
+touched.
+"""
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+TEST_DIR = Path(tempfile.mkdtemp(prefix='api_ethpch_test_'))
+CONFIG = f"""
+server:
+  host: 127.0.0.1
+  port: 8000
+s3:
+  endpoint_url:
+database:
+  type: sqlite
+  schema: {TEST_DIR / 'test.db'}
+enable_apps: [pixiv]
+pixiv:
+  refresh_token: x
+  transfer: false
+storage:
+  backend: local
+  local_root: {TEST_DIR / 'storage'}
+"""
+
+os.environ['HOME'] = str(TEST_DIR)
+(TEST_DIR / 'config.yaml').write_text(CONFIG)
+os.chdir(TEST_DIR)
+sys.path.insert(0, str(ROOT))
+
+
+def pytest_sessionfinish(session, exitstatus):
+    os.chdir(ROOT)
+    shutil.rmtree(TEST_DIR, ignore_errors=True)
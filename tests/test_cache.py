@@ -0,0 +1,121 @@
+import asyncio
+import os
+import pytest
+from utils import cache
+from utils.cache import Cache, FileCache
+
+
+@pytest.fixture
+def prunes(monkeypatch):
+    calls = []
+    prune = cache._prune
+
+    def counted(directory, disksize):
+        calls.append(disksize)
+        return prune(directory, disksize)
+
+    monkeypatch.setattr(cache, '_prune', counted)
+    return calls
+
+
+def _write(data: bytes):
+    async def fetch(directory: str) -> str:
+        file = os.path.join(directory, 'data')
+        with open(file, 'wb') as f:
+            f.write(data)
+        return file
+
+    return fetch
+
+
+def test_file_cache_prunes_once_over_disksize(prunes):
+    file_cache = FileCache('test_file_prune', disksize=1000)
+
+    async def main():
+        # first fill scans the directory
+        await file_cache.fill((0, ), _write(b'0' * 100))
+        await asyncio.sleep(0.1)
+        for i in range(1, 9):
+            await file_cache.fill((i, ), _write(b'0' * 100))
+        await asyncio.sleep(0.1)
+        assert len(prunes) == 1
+        for i in range(9, 12):
+            await file_cache.fill((i, ), _write(b'0' * 100))
+            await asyncio.sleep(0.1)
+
+    asyncio.run(main())
+    assert len(prunes) == 2
+    size = sum(path.stat().st_size
+               for path in file_cache.directory.rglob('*'))
+    assert size <= file_cache.disksize
+    # least recently read are removed
+    assert file_cache.get((11, )) is not None
+    assert file_cache.get((0, )) is None
+
+
+def test_file_cache_lock_refreshed(monkeypatch):
+    monkeypatch.setattr(FileCache, 'LOCK_TIMEOUT', 0.3)
+    fetches = []
+
+    async def slow(directory: str) -> str:
+        fetches.append(directory)
+        await asyncio.sleep(1)
+        return await _write(b'slow')(directory)
+
+    async def main():
+        # instances of one name stand for workers sharing the directory
+        first = FileCache('test_file_lock')
+        second = FileCache('test_file_lock')
+        task = asyncio.create_task(first.fill(('key', ), slow))
+        await asyncio.sleep(0.1)
+        return await asyncio.gather(task, second.fill(('key', ), slow))
+
+    paths = asyncio.run(main())
+    assert len(fetches) == 1
+    assert paths[0] == paths[1]
+    assert paths[0].read_bytes() == b'slow'
+
+
+def test_cache_prunes_once_over_disksize(prunes):
+    bytes_cache = Cache('test_prune', disksize=1000)
+
+    async def main():
+        for i in range(9):
+            bytes_cache.set((i, ), b'0' * 100)
+            await asyncio.sleep(0.05)
+        assert len(prunes) == 1
+        for i in range(9, 12):
+            bytes_cache.set((i, ), b'0' * 100)
+            await asyncio.sleep(0.05)
+
+    asyncio.run(main())
+    assert len(prunes) == 2
+    # outside of event loop it is pruned in place
+    bytes_cache.set((12, ), b'0' * 500)
+    assert len(prunes) == 3
+
+
+def test_file_cache_fills_once():
+    file_cache = FileCache('test_file_fill')
+    fetches = []
+
+    def fetch(data):
+        async def counted(directory: str):
+            fetches.append(data)
+            await asyncio.sleep(0.1)
+            return await _write(data)(directory) if data else None
+
+        return counted
+
+    async def main():
+        return await asyncio.gather(
+            *[file_cache.fill(('key', ), fetch(b'data')) for _ in range(3)],
+            file_cache.fill(('none', ), fetch(None)))
+
+    *paths, none = asyncio.run(main())
+    assert fetches == [b'data', None]
+    assert paths[0] == paths[1] == paths[2] == file_cache.get(('key', ))
+    assert paths[0].read_bytes() == b'data'
+    # nothing cached for fetches without a file
+    assert none is None and file_cache.get(('none', )) is None
+    assert list(file_cache.partial.glob('*.lock')) == []
@@ -0,0 +1,53 @@
+import asyncio
+from hashlib import md5
+import httpx
+from fastapi import APIRouter, FastAPI
+from app.base import CacheableRoute, cache_control
+
+CONTENT = {'id': 1, 'title': 'title'}
+
+
+def _app() -> FastAPI:
+    app = FastAPI()
+    router = APIRouter(route_class=CacheableRoute)
+
+    @router.get('/content')
+    @cache_control('public', max_age=300, public_if='local')
+    async def content(local: bool = False):
+        return CONTENT
+
+    app.include_router(router)
+    return app
+
+
+async def _get(path: str, **headers: str) -> httpx.Response:
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=_app()),
+                                 base_url='http://test') as client:
+        return await client.get(path, headers=headers)
+
+
+def test_etag_and_not_modified():
+    response = asyncio.run(_get('/content?local=true'))
+    etag = response.headers['etag']
+    assert etag == f'"{md5(response.content).hexdigest()}"'
+    for if_none_match in (etag, f'"other", W/{etag}', '*'):
+        not_modified = asyncio.run(
+            _get('/content?local=true', **{'if-none-match': if_none_match}))
+        assert not_modified.status_code == 304
+        assert not_modified.content == b''
+        assert not_modified.headers['cache-control'] == \
+            response.headers['cache-control']
+    modified = asyncio.run(
+        _get('/content?local=true', **{'if-none-match': '"other"'}))
+    assert modified.status_code == 200
+    assert modified.content == response.content
+
+
+def test_mirrors_not_shared():
+    local = asyncio.run(_get('/content?local=1'))
+    assert local.headers['cache-control'] == 'public, max-age=300'
+    for query in ('', '?local=false'):
+        response = asyncio.run(_get('/content' + query))
+        # mirrored for the account logged in
+        assert response.headers['cache-control'] == 'private, max-age=300'
+        assert response.headers['etag'] == local.headers['etag']
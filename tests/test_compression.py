@@ -0,0 +1,148 @@
+import asyncio
+import gzip
+import httpx
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from app.base import file_response
+from utils import compression
+from utils.cache import Cache
+from utils.compression import CompressionMiddleware, negotiate
+
+TEXT = bytes(range(32, 127)) * 64
+
+
+def _app(tmp_path, cache: Cache = None) -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware, cache=cache)
+    file = tmp_path / 'file.txt'
+    file.write_bytes(TEXT[:6000])
+
+    @app.get('/file')
+    async def get_file(request: Request):
+        return file_response(request, file, media_type='text/plain')
+
+    return app
+
+
+async def _requests(app: FastAPI, *headers: dict) -> list:
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app),
+                                 base_url='http://test') as client:
+        return [await client.get('/file', headers=h) for h in headers]
+
+
+def test_ranges_are_not_compressed(tmp_path):
+    cache = Cache('test_compression_ranges')
+    cache.clear()
+    gzip_ = {'accept-encoding': 'gzip'}
+    part, whole = asyncio.run(
+        _requests(_app(tmp_path, cache), {
+            **gzip_, 'range': 'bytes=0-2999'
+        }, gzip_))
+    assert part.status_code == 206
+    assert 'content-encoding' not in part.headers
+    assert part.headers['content-range'] == 'bytes 0-2999/6000'
+    assert part.content == TEXT[:3000]
+    # range is not cached as the whole file
+    assert whole.status_code == 200
+    assert whole.headers['content-encoding'] == 'gzip'
+    assert whole.headers['accept-ranges'] == 'none'
+    # decoded by httpx
+    assert whole.content == TEXT[:6000]
+
+
+@pytest.mark.parametrize('accept_encoding, expected', [
+    ('', None),
+    ('identity', None),
+    ('gzip', 'gzip'),
+    ('gzip, br', 'br'),
+    ('gzip, br;q=0.5', 'gzip'),
+    ('br;q=0, *', 'gzip'),
+    ('*', 'br'),
+    ('*;q=0', None),
+    ('GZIP', 'gzip'),
+])
+def test_negotiate(accept_encoding, expected, monkeypatch):
+    # preferred first when accepted equally
+    monkeypatch.setattr(compression, '_compressors', {
+        'br': None,
+        'gzip': None
+    })
+    assert negotiate(accept_encoding) == expected
+
+
+def _responses_app(cache: Cache = None) -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware, minimum_size=100, cache=cache)
+
+    @app.get('/text/{size}')
+    async def text(size: int, private: bool = False):
+        return PlainTextResponse(
+            TEXT[:size],
+            headers={
+                'ETag': f'"{size}"',
+                'Cache-Control': 'private' if private else 'public'
+            })
+
+    @app.get('/png')
+    async def png():
+        return Response(TEXT, media_type='image/png')
+
+    @app.get('/stream')
+    async def stream():
+        async def chunks():
+            yield TEXT[:3000]
+            yield TEXT[3000:]
+
+        return StreamingResponse(chunks(), media_type='text/plain')
+
+    return app
+
+
+async def _get_raw(app: FastAPI, *paths: str) -> list:
+    # responses and their bodies as sent, not decoded
+    results = []
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app),
+                                 base_url='http://test') as client:
+        for path in paths:
+            request = client.build_request(
+                'GET', path, headers={'accept-encoding': 'gzip'})
+            response = await client.send(request, stream=True)
+            body = b''.join([chunk async for chunk in response.aiter_raw()])
+            await response.aclose()
+            results.append((response.headers, body))
+    return results
+
+
+def test_minimum_size_and_types():
+    (small, small_body), (large, large_body), (png, _) = asyncio.run(
+        _get_raw(_responses_app(), '/text/99', '/text/100', '/png'))
+    assert 'content-encoding' not in small
+    assert small_body == TEXT[:99]
+    assert large['content-encoding'] == 'gzip'
+    assert large['vary'] == 'Accept-Encoding'
+    assert gzip.decompress(large_body) == TEXT[:100]
+    assert int(large['content-length']) == len(large_body)
+    # not compressible
+    assert 'content-encoding' not in png
+
+
+def test_streaming_passthrough():
+    (headers, body), = asyncio.run(_get_raw(_responses_app(), '/stream'))
+    assert 'content-encoding' not in headers
+    assert body == TEXT
+
+
+def test_etag_weakened_and_cached():
+    cache = Cache('test_compression_etag')
+    cache.clear()
+    (first, first_body), (second, second_body), (private, _) = asyncio.run(
+        _get_raw(_responses_app(cache), '/text/1000', '/text/1000',
+                 '/text/2000?private=1'))
+    # representation differs from the identity one
+    assert first['etag'] == second['etag'] == 'W/"1000"'
+    assert private['etag'] == 'W/"2000"'
+    assert first_body == second_body
+    assert cache.get(('gzip', '1000')) == first_body
+    # private responses are not kept
+    assert cache.get(('gzip', '2000')) is None
@@ -0,0 +1,22 @@
+from typing import List
+from app.pixiv import models
+from utils.pydantic import include_fields, unknown_fields
+
+
+def test_unknown_fields():
+    assert unknown_fields(models.Illust, ['id', 'user.name', 'preview.url'
+                                          ]) == []
+    assert unknown_fields(List[models.Illust],
+                          ['id', 'bogus', 'user.bogus', 'title.length'
+                           ]) == ['bogus', 'title.length', 'user.bogus']
+    # unsupported response models are not validated
+    assert unknown_fields(dict, ['bogus']) == []
+
+
+def test_include_fields():
+    assert include_fields(List[models.Novel], ['id', 'user.name']) == {
+        'id': ...,
+        'user': {
+            'name': ...
+        },
+    }
@@ -0,0 +1,151 @@
+import asyncio
+import os
+import httpx
+import pytest
+from fastapi import FastAPI, Request
+from app.base import FileRangeResponse, file_response
+from app.pixiv import pixiv_router
+from app.pixiv.pixiv import Pixiv
+
+DATA = bytes(range(100))
+
+
+@pytest.fixture
+def file(tmp_path):
+    file = tmp_path / 'file.bin'
+    file.write_bytes(DATA)
+    return file
+
+
+def _app(file) -> FastAPI:
+    app = FastAPI()
+
+    @app.api_route('/file', methods=['GET', 'HEAD'])
+    async def get_file(request: Request):
+        return file_response(request,
+                             file,
+                             media_type='application/octet-stream')
+
+    @app.get('/missing')
+    async def missing(request: Request):
+        return file_response(request, str(file) + '.missing')
+
+    return app
+
+
+async def _requests(app: FastAPI, *requests) -> list:
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app),
+                                 base_url='http://test') as client:
+        return [
+            await client.request(method, path, headers=headers)
+            for method, path, headers in requests
+        ]
+
+
+@pytest.mark.parametrize('range_, status_code, content_range, body', [
+    ('bytes=0-9', 206, 'bytes 0-9/100', DATA[:10]),
+    ('bytes=90-', 206, 'bytes 90-99/100', DATA[90:]),
+    ('bytes=95-200', 206, 'bytes 95-99/100', DATA[95:]),
+    ('bytes=-10', 206, 'bytes 90-99/100', DATA[90:]),
+    ('bytes=-200', 206, 'bytes 0-99/100', DATA),
+    ('bytes=100-', 416, 'bytes */100', b''),
+    ('bytes=-0', 416, 'bytes */100', b''),
+    # whole file otherwise
+    ('bytes=0-1,5-6', 200, None, DATA),
+    ('bytes=9-0', 200, None, DATA),
+    ('items=0-9', 200, None, DATA),
+])
+def test_range(file, range_, status_code, content_range, body):
+    response, = asyncio.run(
+        _requests(_app(file), ('GET', '/file', {'range': range_})))
+    assert response.status_code == status_code
+    assert response.headers.get('content-range') == content_range
+    assert response.content == body
+    if status_code != 416:
+        assert int(response.headers['content-length']) == len(body)
+
+
+def test_validators(file):
+    first, = asyncio.run(_requests(_app(file), ('GET', '/file', {})))
+    etag = first.headers['etag']
+    assert first.headers['accept-ranges'] == 'bytes'
+    not_modified, matched, other, stale, head, missing = asyncio.run(
+        _requests(
+            _app(file),
+            ('GET', '/file', {'if-none-match': f'"other", W/{etag}'}),
+            ('GET', '/file', {'range': 'bytes=0-9', 'if-range': etag}),
+            ('GET', '/file', {'if-none-match': '"other"'}),
+            ('GET', '/file', {'range': 'bytes=0-9', 'if-range': '"other"'}),
+            ('HEAD', '/file', {}),
+            ('GET', '/missing', {}),
+        ))
+    assert not_modified.status_code == 304
+    assert not_modified.headers['etag'] == f'W/{etag}'
+    assert not_modified.content == b''
+    assert matched.status_code == 206
+    assert other.status_code == 200 and other.content == DATA
+    # changed since the client got its part
+    assert stale.status_code == 200 and stale.content == DATA
+    assert head.status_code == 200 and head.content == b''
+    assert head.headers['content-length'] == '100'
+    assert missing.status_code == 404
+    # changed content changes the tag
+    os.utime(file, ns=(0, 0))
+    changed, = asyncio.run(_requests(_app(file), ('GET', '/file', {})))
+    assert changed.headers['etag'] != etag
+
+
+def test_zerocopysend(file):
+    messages = []
+
+    async def send(message):
+        if message['type'] == 'http.response.zerocopysend':
+            os.lseek(message['file'], message['offset'], os.SEEK_SET)
+            message['body'] = os.read(message['file'], message['count'])
+        messages.append(message)
+
+    response = FileRangeResponse(file,
+                                 status_code=206,
+                                 stat_result=os.stat(file),
+                                 offset=10,
+                                 count=5)
+    asyncio.run(
+        response(
+            {
+                'type': 'http',
+                'extensions': {
+                    'http.response.zerocopysend': {}
+                }
+            }, None, send))
+    assert [message['type'] for message in messages] == [
+        'http.response.start', 'http.response.zerocopysend'
+    ]
+    assert messages[0]['status'] == 206
+    assert (messages[1]['offset'], messages[1]['count']) == (10, 5)
+    assert messages[1]['body'] == DATA[10:15]
+
+
+@pytest.mark.parametrize('head, media_type', [
+    (b'GIF89a', 'image/gif'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'unknown', 'application/octet-stream'),
+])
+def test_storage_image_route(tmp_path, monkeypatch, head, media_type):
+    image = tmp_path / 'image'
+    image.write_bytes(head + DATA)
+
+    async def storage_image(self, storage_id):
+        return str(image) if storage_id == 1 else None
+
+    monkeypatch.setattr(Pixiv, 'storage_image', storage_image)
+    app = FastAPI()
+    app.include_router(pixiv_router)
+    found, part, missing = asyncio.run(
+        _requests(app, ('GET', '/pixiv/img/1', {}),
+                  ('GET', '/pixiv/img/1', {'range': 'bytes=-100'}),
+                  ('GET', '/pixiv/img/2', {})))
+    assert found.headers['content-type'] == media_type
+    assert found.headers['cache-control'] == 'public, max-age=86400'
+    assert found.content == head + DATA
+    assert part.status_code == 206 and part.content == DATA
+    assert missing.status_code == 404
@@ -0,0 +1,192 @@
+import asyncio
+import logging
+import os
+import time
+from io import BytesIO
+from zipfile import ZipFile
+import pytest
+from PIL import Image
+from app.pixiv import pixiv
+from app.pixiv.pixiv import Pixiv
+from utils import imaging
+from utils.imaging import ProcessPool
+
+
+async def _timeout_kills_workers(pool: ProcessPool) -> tuple:
+    pid = await pool.run(os.getpid)
+    processes = list(pool._contexts[pool._executor].processes)
+    try:
+        await pool.run(time.sleep, 30)
+    except asyncio.TimeoutError:
+        timed_out = True
+    else:
+        timed_out = False
+    return pid, processes, timed_out, await pool.run(os.getpid)
+
+
+def test_timeout_kills_workers():
+    pool = ProcessPool('test', 1, timeout=2)
+    try:
+        started = time.perf_counter()
+        pid, processes, timed_out, new_pid = asyncio.run(
+            _timeout_kills_workers(pool))
+    finally:
+        pool.shutdown()
+    assert timed_out
+    assert time.perf_counter() - started < 20
+    for process in processes:
+        process.join(5)
+        assert process.exitcode is not None
+    # jobs after it run in new workers
+    assert new_pid != pid
+    assert pool.metrics()['timeouts'] == 1
+
+
+async def _broken_job_retried(pool: ProcessPool) -> list:
+    await asyncio.gather(pool.run(os.getpid), pool.run(os.getpid))
+
+    async def later():
+        # running when the other job times out
+        await asyncio.sleep(pool.timeout - 1)
+        return await pool.run(time.sleep, 1.5)
+
+    return await asyncio.gather(pool.run(time.sleep, 30),
+                                later(),
+                                return_exceptions=True)
+
+
+def test_broken_job_retried():
+    pool = ProcessPool('test', 2, timeout=3)
+    try:
+        timed_out, retried = asyncio.run(_broken_job_retried(pool))
+    finally:
+        pool.shutdown()
+    assert isinstance(timed_out, asyncio.TimeoutError)
+    assert retried is None
+    metrics = pool.metrics()
+    assert (metrics['jobs'], metrics['timeouts'], metrics['failures']) == \
+        (3, 1, 0)
+
+
+async def _queued(pool: ProcessPool) -> list:
+    return await asyncio.gather(pool.run(time.sleep, 0.5),
+                                pool.run(time.sleep, 0.5),
+                                pool.run(int, 'x'),
+                                return_exceptions=True)
+
+
+def test_jobs_queued_and_metrics(monkeypatch, caplog):
+    monkeypatch.setattr(imaging, 'METRICS_INTERVAL', 0)
+    pool = ProcessPool('test', 1)
+    try:
+        with caplog.at_level(logging.INFO, 'api_ethpch'):
+            results = asyncio.run(_queued(pool))
+    finally:
+        pool.shutdown()
+    assert results[:2] == [None, None]
+    # raised in the worker, the pool is still useable
+    assert isinstance(results[2], ValueError)
+    metrics = pool.metrics()
+    assert (metrics['jobs'], metrics['timeouts'], metrics['failures']) == \
+        (2, 0, 1)
+    # one worker, the second job waits for the first one
+    assert metrics['max_queue_time'] >= 0.4
+    assert metrics['run_time'] >= 1
+    assert 'Test pool metrics: jobs 1' in caplog.text
+
+
+def _ugoira() -> bytes:
+    buffer = BytesIO()
+    with ZipFile(buffer, 'w') as zf:
+        for name, color in (('0.png', 'red'), ('1.png', 'blue')):
+            frame = BytesIO()
+            Image.new('RGB', (8, 8), color).save(frame, 'PNG')
+            zf.writestr(name, frame.getvalue())
+    return buffer.getvalue()
+
+
+def test_zip_to_gif(tmp_path):
+    src = tmp_path / 'ugoira.zip'
+    src.write_bytes(_ugoira())
+    output = tmp_path / 'ugoira.gif'
+    frames = [('1.png', 100), ('0.png', 200), ('1.png', 300)]
+    try:
+        gif = asyncio.run(imaging.zip_to_gif(src.read_bytes(), iter(frames)))
+        assert asyncio.run(imaging.zip_to_gif(str(src), frames,
+                                              str(output))) is None
+    finally:
+        imaging.shutdown()
+    assert output.read_bytes() == gif
+    with Image.open(BytesIO(gif)) as image:
+        assert (image.format, image.n_frames) == ('GIF', 3)
+        durations, colors = [], []
+        for i in range(image.n_frames):
+            image.seek(i)
+            durations.append(image.info['duration'])
+            colors.append(image.convert('RGB').getpixel((0, 0)))
+    # in order of frames, delays in milliseconds
+    assert durations == [100, 200, 300]
+    assert colors == [(0, 0, 255), (255, 0, 0), (0, 0, 255)]
+
+
+@pytest.mark.parametrize('width, expected', [
+    (None, None),
+    (1, 160),
+    (160, 160),
+    (161, 320),
+    (1080, 1080),
+    (5000, imaging.WIDTHS[-1]),
+])
+def test_derivative_width(width, expected):
+    assert imaging.derivative_width(width) == expected
+
+
+def _derive(*args) -> None:
+    try:
+        asyncio.run(imaging.derive(*args))
+    finally:
+        imaging.shutdown()
+
+
+def test_derive(tmp_path):
+    src, dst = tmp_path / 'src.png', tmp_path / 'dst.jpeg'
+    Image.new('RGBA', (400, 200), (255, 0, 0, 128)).save(src)
+    _derive(str(src), str(dst), 320, 'jpeg')
+    with Image.open(dst) as image:
+        # JPEG has no alpha
+        assert (image.format, image.mode) == ('JPEG', 'RGB')
+        assert image.size == (320, 160)
+    # never scaled up
+    dst = tmp_path / 'dst.webp'
+    _derive(str(src), str(dst), 720, 'webp')
+    with Image.open(dst) as image:
+        assert (image.format, image.mode) == ('WEBP', 'RGBA')
+        assert image.size == (400, 200)
+
+
+class _Backend(object):
+    def __init__(self):
+        self.puts = {}
+
+    async def put(self, src, dst, public_read=False, resumable=True):
+        with Image.open(src) as image:
+            self.puts[dst] = image.format, image.width
+
+
+def test_make_derivatives(tmp_path, monkeypatch):
+    backend = _Backend()
+    monkeypatch.setattr(pixiv, 'storage_backend', backend)
+    monkeypatch.setattr(Pixiv, 'DERIVATIVE_WIDTHS', [100, 150, 1000])
+    src = tmp_path / 'src.png'
+    Image.new('RGB', (1200, 600)).save(src)
+    try:
+        asyncio.run(
+            Pixiv.__new__(Pixiv)._make_derivatives(str(src), 'digest',
+                                                   str(tmp_path)))
+    finally:
+        imaging.shutdown()
+    # widths rounded up are made once
+    assert backend.puts == {
+        'pixiv/derivatives/digest-w160.webp': ('WEBP', 160),
+        'pixiv/derivatives/digest-w1080.webp': ('WEBP', 1080),
+    }
@@ -0,0 +1,60 @@
+import asyncio
+import threading
+import pytest
+from botocore.exceptions import ClientError
+from utils.storage import s3
+from utils.storage.inventory import Inventory
+
+
+class _Client(object):
+    def __init__(self, keys):
+        self.keys = set(keys)
+        self.heads = []
+
+    async def head_object(self, Bucket, Key):
+        self.heads.append(Key)
+        if Key not in self.keys:
+            raise ClientError({'Error': {}}, 'HeadObject')
+
+
+@pytest.fixture
+def inventory(tmp_path, monkeypatch):
+    inventory = Inventory(tmp_path / 'inventory.db')
+    threads = []
+    lookup = inventory.lookup
+
+    def recorded(*args):
+        threads.append(threading.get_ident())
+        return lookup(*args)
+
+    monkeypatch.setattr(inventory, 'lookup', recorded)
+    monkeypatch.setattr(s3, '_inventory', inventory)
+    inventory.threads = threads
+    yield inventory
+    inventory.close()
+
+
+def test_has_runs_inventory_off_loop(inventory, monkeypatch):
+    client = _Client({'a', 'b'})
+    monkeypatch.setattr(s3, '_client', client)
+
+    async def main():
+        results = [await s3.has(f'/bucket/{key}') for key in 'aac']
+        return results, threading.get_ident()
+
+    results, loop_thread = asyncio.run(main())
+    assert results == [True, True, False]
+    # second lookup of "a" is answered by inventory
+    assert client.heads == ['a', 'c']
+    assert inventory.threads and loop_thread not in inventory.threads
+
+
+def test_inventory_complete_bucket(inventory):
+    generation = inventory.begin_reconcile('bucket')
+    inventory.add_many('bucket', ['a', 'b'])
+    assert inventory.lookup('bucket', 'c') is None
+    inventory.end_reconcile('bucket', generation)
+    assert inventory.lookup('bucket', 'a') is True
+    assert inventory.lookup('bucket', 'c') is False
+    inventory.discard('bucket', 'a')
+    assert inventory.lookup('bucket', 'a') is False
@@ -0,0 +1,118 @@
+import asyncio
+import json
+from datetime import datetime, timezone
+import httpx
+import pytest
+from fastapi import APIRouter, FastAPI, Response
+from app.base import MSGPACK_MEDIA_TYPES, CacheableRoute, MsgPackMiddleware, \
+    NegotiatedResponse, accepts_msgpack, negotiated_media_type, render
+from utils.compression import CompressionMiddleware
+
+# optional dependency, see "app.base"
+msgpack = pytest.importorskip('msgpack')
+
+CONTENT = {
+    'id': 1,
+    'title': 'タイトル',
+    'date': datetime(2021, 1, 2, 3, 4, 5, tzinfo=timezone.utc),
+    'tags': [None, 1.5, True],
+}
+
+
+@pytest.mark.parametrize('accept, expected', [
+    ('', False),
+    ('*/*', False),
+    ('application/json', False),
+    ('application/msgpack', True),
+    ('application/x-msgpack', True),
+    ('application/msgpack, application/json', True),
+    ('application/json, application/msgpack;q=0.5', False),
+    ('application/json;q=0.5, application/x-msgpack', True),
+    ('application/msgpack;q=0, */*', False),
+])
+def test_accepts_msgpack(accept, expected):
+    assert accepts_msgpack(accept) is expected
+
+
+def _app() -> FastAPI:
+    app = FastAPI(default_response_class=NegotiatedResponse)
+    app.add_middleware(MsgPackMiddleware)
+
+    @app.get('/content')
+    async def content():
+        return CONTENT
+
+    @app.get('/media_type')
+    async def media_type():
+        return negotiated_media_type()
+
+    @app.get('/rendered')
+    async def rendered():
+        # as responses cached as bytes are sent
+        return Response(render(dict, CONTENT),
+                        media_type=negotiated_media_type())
+
+    return app
+
+
+async def _get(path: str, accept: str) -> httpx.Response:
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=_app()),
+                                 base_url='http://test') as client:
+        return await client.get(path, headers={'accept': accept})
+
+
+def test_negotiated_response():
+    as_json = asyncio.run(_get('/content', 'application/json'))
+    as_msgpack = asyncio.run(_get('/content', MSGPACK_MEDIA_TYPES[1]))
+    assert as_json.headers['content-type'].startswith('application/json')
+    assert as_msgpack.headers['content-type'] == MSGPACK_MEDIA_TYPES[0]
+    assert as_json.headers['vary'] == as_msgpack.headers['vary'] == 'Accept'
+    # same layout, datetimes are the same text
+    assert msgpack.unpackb(as_msgpack.content) == json.loads(as_json.content)
+    assert msgpack.unpackb(
+        as_msgpack.content)['date'] == CONTENT['date'].isoformat()
+
+
+def test_negotiated_media_type():
+    response = asyncio.run(_get('/media_type', MSGPACK_MEDIA_TYPES[0]))
+    assert msgpack.unpackb(response.content) == MSGPACK_MEDIA_TYPES[0]
+    response = asyncio.run(_get('/media_type', '*/*'))
+    assert json.loads(response.content) == 'application/json'
+
+
+def test_rendered_bytes_negotiated():
+    for accept in ('application/json', MSGPACK_MEDIA_TYPES[0]):
+        rendered = asyncio.run(_get('/rendered', accept))
+        response = asyncio.run(_get('/content', accept))
+        assert rendered.headers['content-type'] == \
+            response.headers['content-type']
+        assert rendered.content == response.content
+
+
+async def _conditional_get(accept: str) -> tuple:
+    app = _app()
+    app.add_middleware(CompressionMiddleware, minimum_size=10)
+    router = APIRouter(route_class=CacheableRoute)
+
+    @router.get('/cacheable')
+    async def cacheable():
+        return CONTENT
+
+    app.include_router(router)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app),
+                                 base_url='http://test') as client:
+        headers = {'accept': accept, 'accept-encoding': 'gzip'}
+        response = await client.get('/cacheable', headers=headers)
+        headers['if-none-match'] = response.headers['etag']
+        return response, await client.get('/cacheable', headers=headers)
+
+
+def test_not_modified_keeps_representation_headers():
+    for accept, weak in (('application/json', True),
+                         (MSGPACK_MEDIA_TYPES[0], False)):
+        response, not_modified = asyncio.run(_conditional_get(accept))
+        # only JSON is compressed, weakening the ETag
+        assert response.headers['etag'].startswith('W/') is weak
+        assert not_modified.status_code == 304
+        assert not_modified.headers['etag'] == response.headers['etag']
+        assert not_modified.headers['vary'] == 'Accept'
@@ -0,0 +1,66 @@
+import asyncio
+import json
+import httpx
+import pytest
+from fastapi import APIRouter, FastAPI, Request
+from starlette.datastructures import Headers
+from app import base
+from app.base import NDJSON_MEDIA_TYPE, CacheableRoute, accepts_ndjson, \
+    ndjson_response
+
+ROWS = [{'id': 1}, {'id': 2}]
+
+
+@pytest.mark.parametrize('accept, expected', [
+    ('', False),
+    ('*/*', False),
+    ('application/json', False),
+    (NDJSON_MEDIA_TYPE, True),
+    (f'{NDJSON_MEDIA_TYPE};q=0', False),
+    (f'{NDJSON_MEDIA_TYPE};q=0, */*', False),
+    (f'application/json, {NDJSON_MEDIA_TYPE};q=0.5', False),
+    (f'application/json;q=0.5, {NDJSON_MEDIA_TYPE}', True),
+])
+def test_accepts_ndjson(accept, expected):
+    request = Request({
+        'type': 'http',
+        'headers': Headers({'accept': accept}).raw
+    })
+    assert accepts_ndjson(request) is expected
+
+
+def _app() -> FastAPI:
+    app = FastAPI()
+    router = APIRouter(route_class=CacheableRoute)
+
+    @router.get('/rows')
+    async def rows(request: Request):
+        if accepts_ndjson(request):
+
+            async def iterate():
+                for row in ROWS:
+                    yield row
+
+            return ndjson_response(dict, iterate())
+        return ROWS
+
+    app.include_router(router)
+    return app
+
+
+async def _get(accept: str) -> httpx.Response:
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=_app()),
+                                 base_url='http://test') as client:
+        return await client.get('/rows', headers={'accept': accept})
+
+
+def test_ndjson_response_varies(monkeypatch):
+    # only the endpoint negotiates
+    monkeypatch.setattr(base, 'msgpack', None)
+    ndjson = asyncio.run(_get(NDJSON_MEDIA_TYPE))
+    assert ndjson.headers['content-type'] == NDJSON_MEDIA_TYPE
+    assert [json.loads(line) for line in ndjson.text.splitlines()] == ROWS
+    as_json = asyncio.run(_get(f'{NDJSON_MEDIA_TYPE};q=0, */*'))
+    assert as_json.headers['content-type'] == 'application/json'
+    assert as_json.json() == ROWS
+    assert ndjson.headers['vary'] == as_json.headers['vary'] == 'Accept'
@@ -0,0 +1,94 @@
+import asyncio
+import gzip
+import httpx
+from fastapi import FastAPI
+import app.pixiv as pixiv_app
+from app.pixiv import article_cache, pixiv_router, tables
+from app.pixiv.pixiv import Pixiv
+from utils.database import Base
+from utils.database.crud import update
+from utils.database.session import Session
+
+CONTENT = 'first\nsecond\n\nlast'
+ARTICLE = ('<article><p>first</p><p>second</p><p></p><p>last</p>'
+           '</article>')
+
+
+def test_article_chunks(monkeypatch):
+    assert ''.join(pixiv_app._article_chunks(CONTENT)) == ARTICLE
+    assert list(pixiv_app._article_chunks('')) == [
+        '<article>', '<p></p></article>'
+    ]
+    # lines are not split across chunks
+    monkeypatch.setattr(pixiv_app, 'ARTICLE_CHUNK_SIZE', 6)
+    assert list(pixiv_app._article_chunks(CONTENT)) == [
+        '<article>', '<p>first</p><p>second</p>',
+        '<p></p><p>last</p></article>'
+    ]
+
+
+def test_content_hash_maintained():
+    novel = tables.Novel(id=1, content=CONTENT)
+    assert novel.content_hash == tables.Novel.hash_content(CONTENT)
+    novel.content = None
+    assert novel.content_hash is None
+
+
+async def _set_content(novel_id: int, content: str, content_hash: str):
+    async with Session() as session:
+        async with session.begin():
+            await session.execute(
+                update(tables.Novel,
+                       whereclauses=[tables.Novel.id == novel_id],
+                       values={
+                           'content': content,
+                           'content_hash': content_hash
+                       }))
+
+
+async def _articles() -> list:
+    Session.init()
+    async with Session.get_engine().begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    async with Session() as session:
+        async with session.begin():
+            session.add(tables.Novel(id=1, title='novel'))
+    # stored before content hash was maintained
+    await _set_content(1, CONTENT, None)
+    app = FastAPI()
+    app.include_router(pixiv_router)
+    results = []
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app),
+                                 base_url='http://test') as client:
+        for content in (None, None, CONTENT + '\nmore'):
+            if content is not None:
+                await _set_content(1, content,
+                                   tables.Novel.hash_content(content))
+            response = await client.get('/pixiv/n/1')
+            results.append(
+                (response.text,
+                 await Pixiv.novel_content_local(1),
+                 {key: article_cache.get(key)
+                  for key in article_cache._memory}))
+    await Session.get_engine().dispose()
+    return results
+
+
+def test_article_cached_by_content():
+    article_cache.clear()
+    (streamed, (content, content_hash), cached), \
+        (from_cache, _, _), \
+        (changed, (_, changed_hash), changed_cached) = \
+        asyncio.run(_articles())
+    assert streamed.endswith(ARTICLE)
+    # hash filled for novels stored before it
+    assert content == CONTENT
+    assert content_hash == tables.Novel.hash_content(CONTENT)
+    assert list(cached) == [(1, content_hash)]
+    assert gzip.decompress(cached[1, content_hash]).decode() == ARTICLE
+    assert from_cache == streamed
+    assert changed.endswith(ARTICLE[:-len('</article>')] +
+                            '<p>more</p></article>')
+    # older content of the novel is replaced
+    assert list(changed_cached) == [(1, changed_hash)]
@@ -0,0 +1,172 @@
+import asyncio
+from datetime import datetime, timezone
+from typing import Dict, List
+import pytest
+from sqlalchemy import inspect
+from sqlalchemy.orm import selectinload
+from app.base import render, response_class
+from app.pixiv import models, tables
+from utils.database import Base
+from utils.database.crud import select
+from utils.database.session import Session
+from utils.pydantic import BaseModel, orm_encoder
+
+# models with "orm_getters" and tables their rows come from
+TABLES = {
+    models.UserMixin: tables.User,
+    models.User: tables.User,
+    models.IllustComment: tables.IllustComment,
+    models.Illust: tables.Illust,
+    models.Illust.File: tables.PixivStorage,
+    models.Novel: tables.Novel,
+    models.Showcase: tables.Showcase,
+}
+
+
+def _models_with_getters() -> List[type]:
+    found, queue = [], list(vars(models).values())
+    while queue:
+        item = queue.pop()
+        if isinstance(item, type) and issubclass(item, BaseModel) and \
+                item is not BaseModel and item not in found:
+            if 'orm_getters' in vars(item):
+                found.append(item)
+            queue.extend(vars(item).values())
+    return found
+
+
+def _seed(session):
+    tags = [
+        tables.Tag(name='猫', translated_name='cat'),
+        tables.Tag(name='R-18', translated_name=None),
+    ]
+    alice = tables.User(id=1, name='alice', account='al', comment='hi')
+    alice.profile = tables.PixivStorage(source='https://i.pximg.net/p/1.jpg')
+    bob = tables.User(id=2,
+                      name='bob',
+                      birth=datetime(2000, 1, 2, tzinfo=timezone.utc))
+    bob.background_image = tables.PixivStorage(
+        source='https://i.pximg.net/b/2.jpg',
+        useable=True,
+        url='https://s3/b/2.jpg')
+    bob.followers.append(alice)
+    illusts = []
+    for i in range(1, 5):
+        illust = tables.Illust(
+            id=i,
+            title=f't{i}',
+            type='ugoira' if i == 3 else 'illust',
+            caption='caption',
+            user=alice if i % 2 else bob,
+            page_count=2 if i == 2 else 1,
+            total_view=100 * i,
+            create_date=datetime(2021, 1, i, tzinfo=timezone.utc),
+            tags=tags[:i % 2 + 1])
+        for kind in ('square_medium', 'medium', 'large', 'original'):
+            setattr(illust, kind, [
+                tables.PixivStorage(
+                    source=f'https://i.pximg.net/{kind}/{i}_p{page}.jpg',
+                    page=page) for page in range(illust.page_count)
+            ])
+        if i == 3:
+            illust.ugoira = tables.PixivStorage(
+                source='https://i.pximg.net/u/3.zip',
+                useable=True,
+                url='https://s3/u/3.gif')
+        illusts.append(illust)
+    illusts[0].bookmarked_by.append(bob)
+    comment = tables.IllustComment(id=1,
+                                   comment='first',
+                                   illust=illusts[0],
+                                   user=bob,
+                                   _date=datetime(2021, 2, 1))
+    reply = tables.IllustComment(id=2,
+                                 comment='reply',
+                                 illust=illusts[0],
+                                 user=alice,
+                                 parent_comment=comment,
+                                 _date=datetime(2021, 2, 2))
+    novels = []
+    for n in range(1, 3):
+        novel = tables.Novel(id=100 + n,
+                             title=f'n{n}',
+                             content='line\n' * 3,
+                             user=alice,
+                             series_id=7,
+                             create_date=datetime(2021, 3, n,
+                                                  tzinfo=timezone.utc),
+                             tags=tags[:1])
+        novel.large = tables.PixivStorage(
+            source=f'https://i.pximg.net/n/{n}.jpg')
+        novels.append(novel)
+    novels[0].bookmarked_by.append(bob)
+    showcase = tables.Showcase(id=5,
+                               title='showcase',
+                               publish_date=datetime(2021, 4, 1),
+                               illusts=illusts[:2],
+                               tags=tags[:1])
+    showcase.thumbnail = tables.PixivStorage(
+        source='https://i.pximg.net/sc/5.jpg')
+    session.add_all(
+        [alice, bob, *illusts, comment, reply, *novels, showcase])
+
+
+def _eager(mapper, loader=None, depth: int = 2) -> list:
+    # every relationship loaded *depth* levels deep
+    options = []
+    for prop in mapper.relationships:
+        attr = getattr(mapper.class_, prop.key)
+        option = (loader.selectinload(attr)
+                  if loader is not None else selectinload(attr))
+        options.append(option)
+        if depth > 1:
+            options.extend(_eager(prop.mapper, option, depth - 1))
+    return options
+
+
+async def _load() -> Dict[str, Dict[type, list]]:
+    Session.init()
+    async with Session.get_engine().begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    async with Session() as session:
+        async with session.begin():
+            _seed(session)
+    rows = {'lazy': {}, 'eager': {}}
+    for table in set(TABLES.values()):
+        # rows are encoded detached, as responses are
+        async with Session() as session:
+            rows['lazy'][table] = (await session.execute(
+                select(table))).scalars().unique().all()
+        async with Session() as session:
+            rows['eager'][table] = (await session.execute(
+                select(table).options(*_eager(inspect(table))))
+                                    ).scalars().unique().all()
+    await Session.get_engine().dispose()
+    return rows
+
+
+@pytest.fixture(scope='module')
+def rows() -> Dict[str, Dict[type, list]]:
+    return asyncio.run(_load())
+
+
+def test_all_models_covered():
+    assert set(_models_with_getters()) <= set(TABLES)
+
+
+@pytest.mark.parametrize('loading', ['lazy', 'eager'])
+@pytest.mark.parametrize('model', list(TABLES), ids=lambda m: m.__name__)
+def test_orm_encoder_matches_from_orm(rows, model, loading):
+    items = rows[loading][TABLES[model]]
+    assert items
+    encode = orm_encoder(model)
+    for obj in items:
+        fast = response_class(encode(obj)).body
+        slow = render(model, obj, negotiate=False)
+        assert fast == slow, obj.id
+    # lists are encoded item by item
+    fast = response_class([encode(obj) for obj in items]).body
+    slow = render(List[model], list(items), negotiate=False)
+    assert fast == slow
+
@@ -0,0 +1,171 @@
+import asyncio
+from typing import List, Optional
+import pytest
+from app.pixiv import tables
+from utils.database import Base, _Compiled, pure_dict, pure_instance
+from utils.database.crud import select
+from utils.database.projection import traversal_plan
+from utils.database.session import Session
+from utils.pydantic import BaseModel
+
+
+class _Storage(BaseModel):
+    source: str
+
+
+class _Follower(BaseModel):
+    id: int
+    name: str
+    profile: Optional[_Storage]
+
+
+class _User(BaseModel):
+    id: int
+    name: str
+    followers: List[_Follower]
+
+
+class _Node(BaseModel):
+    id: int
+    picture: Optional[_Storage]
+    following: List['_Node'] = []
+
+    class Config:
+        orm_fields = {'picture': ('profile', 'background_image')}
+
+
+_Node.update_forward_refs()
+
+
+@pytest.fixture
+def users():
+    alice = tables.User(id=1, name='alice')
+    bob = tables.User(id=2, name='bob')
+    alice.profile = tables.PixivStorage(id=10, source='https://p/1.jpg')
+    bob.profile = tables.PixivStorage(id=20, source='https://p/2.jpg')
+    bob.followers.append(alice)
+    alice.followers.append(bob)
+    return alice, bob
+
+
+def test_compiled_once_per_class():
+    compiled = _Compiled.of(tables.PixivStorage)
+    assert _Compiled.of(tables.PixivStorage) is compiled
+    assert _Compiled.of(tables.User) is not compiled
+    assert all(not name.startswith('__') for name in compiled.names)
+    assert compiled.mapped <= set(compiled.names)
+    assert {'source', 'useable', 'priority'} <= compiled.mapped
+    # hybrid properties are read as well
+    assert 'pcat_reverse' in compiled.names
+    # computed from mapped attributes, methods are not copied
+    illust = _Compiled.of(tables.Illust)
+    assert {'create_date', 'preview', 'original'} <= set(illust.names)
+    assert 'image' not in illust.names
+    assert 'hash_content' not in _Compiled.of(tables.Novel).names
+    assert compiled.type.__str__ is tables.PixivStorage.__str__
+
+
+def test_pure_instance_copies_graph(users):
+    alice, bob = users
+    copy = pure_instance(alice)
+    assert not isinstance(copy, Base)
+    assert copy.__sa_origin__ is alice
+    assert (copy.id, copy.name) == (1, 'alice')
+    assert str(copy.profile) == str(alice.profile)
+    # cycles end at copies made before
+    follower = copy.followers[0]
+    assert follower.name == 'bob'
+    assert follower.followers[0] is copy
+    assert set(copy.__associations__) == {
+        id(alice), id(bob), id(alice.profile), id(bob.profile)}
+
+
+def test_pure_instance_plan_and_depth(users):
+    alice, bob = users
+    copy = pure_instance(alice, plan={'followers': {}})
+    assert copy.followers[0].name == 'bob'
+    # attributes out of plan holding instances are None
+    assert copy.profile is None
+    assert copy.followers[0].followers[0] is copy
+    assert set(copy.__associations__) == {id(alice), id(bob)}
+    # instances deeper than max_depth are not followed
+    copy = pure_instance(alice, max_depth=1)
+    assert copy.profile.source == 'https://p/1.jpg'
+    assert copy.followers[0].name == 'bob'
+    assert copy.followers[0].profile is None
+
+
+def test_traversal_plan():
+    assert traversal_plan(_User) == {
+        'id': {},
+        'name': {},
+        'followers': {
+            'id': {},
+            'name': {},
+            'profile': {
+                'source': {}
+            }
+        }
+    }
+    plan = traversal_plan(_Node)
+    assert set(plan) == {'id', 'profile', 'background_image', 'following'}
+    # attributes of a field share the plan of its model
+    assert plan['profile'] is plan['background_image'] is \
+        traversal_plan(_Storage)
+    # self-referencing models share their plan
+    assert plan['following'] is plan
+    assert traversal_plan(_Node) is plan
+
+
+def test_from_orm_follows_plan(users, monkeypatch):
+    alice, _ = users
+    user = _User.from_orm(alice)
+    assert user.followers[0].profile.source == 'https://p/2.jpg'
+    copy = _User.ensure_pure_instance(alice)
+    # profile of the user is not read by the model
+    assert copy.profile is None
+    assert copy.followers[0].profile.source == 'https://p/2.jpg'
+    monkeypatch.setattr(_User.__config__, 'orm_max_depth', 1)
+    copy = _User.ensure_pure_instance(alice)
+    assert copy.followers[0].name == 'bob'
+    assert copy.followers[0].profile is None
+
+
+def test_pure_dict_matches_pure_instance(users):
+    alice, _ = users
+    copy = pure_instance(alice)
+    data = pure_dict(alice)
+    compiled = _Compiled.of(tables.User)
+    for name in compiled.names:
+        value = getattr(copy, name)
+        if isinstance(value, list):
+            assert [getattr(item, 'id', item) for item in value] == \
+                [item.get('id', item) for item in data[name]]
+        elif name in compiled.mapped and not hasattr(value, 'id'):
+            assert data[name] == value, name
+
+
+async def _detached() -> tables.User:
+    Session.init()
+    async with Session.get_engine().begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    async with Session() as session:
+        async with session.begin():
+            user = tables.User(id=1, name='alice')
+            user.profile = tables.PixivStorage(source='https://p/1.jpg')
+            session.add(user)
+    async with Session() as session:
+        user = (await session.execute(select(tables.User))).scalar()
+    await Session.get_engine().dispose()
+    return user
+
+
+def test_pure_instance_of_detached():
+    user = asyncio.run(_detached())
+    assert user._sa_instance_state.detached
+    copy = pure_instance(user)
+    assert copy.name == 'alice'
+    # unloaded attributes of detached instance are None
+    assert copy.followers is None
+    assert pure_dict(user)['followers'] is None
@@ -0,0 +1,185 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+import pytest
+from botocore.exceptions import ClientError
+from utils.cache import Cache
+from utils.storage import s3
+from utils.storage.s3 import MultipartUpload
+
+
+class _Paginator(object):
+    def __init__(self, pages):
+        self.pages = pages
+
+    async def paginate(self, **kwargs):
+        for page in self.pages(**kwargs):
+            yield page
+
+
+class _Client(object):
+    """ Multipart upload calls of S3, *failures* of "upload_part" fail. """
+    def __init__(self, failures: int = 0):
+        self.failures = failures
+        # upload id -> part number -> body
+        self.uploads = {}
+        self.initiated = {}
+        self.created = 0
+        self.calls = []
+
+    async def create_multipart_upload(self, Bucket, Key, ACL):
+        upload_id = f'upload{self.created}'
+        self.created += 1
+        self.uploads[upload_id] = {}
+        self.initiated[upload_id] = Key, datetime.now(timezone.utc)
+        return {'UploadId': upload_id}
+
+    async def upload_part(self, Bucket, Key, UploadId, Body, PartNumber):
+        self.calls.append(('upload_part', PartNumber))
+        if self.failures:
+            self.failures -= 1
+            raise ClientError({'Error': {}}, 'UploadPart')
+        self.uploads[UploadId][PartNumber] = Body
+        return {'ETag': f'"{PartNumber}"'}
+
+    async def complete_multipart_upload(self, Bucket, Key, UploadId,
+                                        MultipartUpload):
+        self.calls.append(('complete', UploadId, MultipartUpload['Parts']))
+        self._end(UploadId)
+
+    async def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.calls.append(('abort', UploadId))
+        self._end(UploadId)
+
+    def _end(self, upload_id):
+        del self.uploads[upload_id]
+        del self.initiated[upload_id]
+
+    def _parts(self, Bucket, Key, UploadId):
+        if UploadId not in self.uploads:
+            raise ClientError({'Error': {}}, 'ListParts')
+        yield {
+            'Parts': [{
+                'PartNumber': number,
+                'ETag': f'"{number}"'
+            } for number in self.uploads[UploadId]]
+        }
+
+    def _uploads(self, Bucket):
+        yield {
+            'Uploads': [{
+                'Key': key,
+                'UploadId': upload_id,
+                'Initiated': initiated
+            } for upload_id, (key, initiated) in self.initiated.items()]
+        }
+
+    def get_paginator(self, name):
+        return _Paginator({
+            'list_parts': self._parts,
+            'list_multipart_uploads': self._uploads
+        }[name])
+
+
+@pytest.fixture(autouse=True)
+def upload_cache(monkeypatch):
+    upload_cache = Cache('test_s3_uploads')
+    upload_cache.clear()
+    monkeypatch.setattr(s3, '_upload_cache', upload_cache)
+    monkeypatch.setattr(s3, 'PART_RETRY_DELAY', 0)
+    return upload_cache
+
+
+async def _upload(client, parts, source=None, fail_after=None):
+    upload = MultipartUpload(client, 'bucket', 'key', 'private', source)
+    await upload.start()
+    try:
+        for number in parts:
+            if number == fail_after:
+                # interrupted once parts before are uploaded
+                await asyncio.gather(*upload._tasks)
+                raise RuntimeError(number)
+            await upload.add(number, lambda number=number: b'%d' % number)
+        await upload.complete()
+    except RuntimeError:
+        await upload.cancel()
+    return upload
+
+
+def test_part_retried():
+    client = _Client(failures=s3.PART_RETRIES - 1)
+    asyncio.run(_upload(client, [1]))
+    assert client.calls[:-1] == [('upload_part', 1)] * s3.PART_RETRIES
+    assert client.calls[-1] == ('complete', 'upload0', [{
+        'PartNumber': 1,
+        'ETag': '"1"'
+    }])
+    client = _Client(failures=s3.PART_RETRIES)
+    with pytest.raises(ClientError):
+        asyncio.run(_upload(client, [1]))
+
+
+def test_upload_resumed(upload_cache):
+    client = _Client()
+    asyncio.run(_upload(client, [1, 2], source='file', fail_after=2))
+    # resumable upload is kept for the next attempt
+    assert client.uploads == {'upload0': {1: b'1'}}
+    assert upload_cache.get(('bucket', 'key')) is not None
+    client.calls.clear()
+    upload = asyncio.run(_upload(client, [1, 2], source='file'))
+    assert upload.upload_id == 'upload0'
+    assert client.calls[0] == ('upload_part', 2)
+    assert [part['PartNumber'] for part in client.calls[-1][2]] == [1, 2]
+    assert upload_cache.get(('bucket', 'key')) is None
+    # changed content aborts the upload recorded before
+    asyncio.run(_upload(client, [1, 2], source='file', fail_after=2))
+    upload = asyncio.run(_upload(client, [1], source='changed'))
+    assert ('abort', 'upload1') in client.calls
+    assert upload.upload_id == 'upload2'
+
+
+def test_upload_cancelled():
+    client = _Client()
+    asyncio.run(_upload(client, [1, 2], fail_after=2))
+    assert client.calls[-1] == ('abort', 'upload0')
+    assert client.uploads == {}
+
+
+def test_stale_uploads_aborted(upload_cache, monkeypatch):
+    client = _Client()
+    monkeypatch.setattr(s3, '_client', client)
+    asyncio.run(_upload(client, [1, 2], source='file', fail_after=2))
+    assert asyncio.run(s3._abort_stale_uploads('bucket')) == 0
+    key, initiated = client.initiated['upload0']
+    client.initiated['upload0'] = key, initiated - timedelta(
+        seconds=s3.UPLOAD_EXPIRE + 1)
+    assert asyncio.run(s3._abort_stale_uploads('bucket')) == 1
+    assert client.uploads == {}
+    assert upload_cache.get(('bucket', 'key')) is None
+
+
+def test_expired_upload_not_resumed(monkeypatch):
+    client = _Client()
+    asyncio.run(_upload(client, [1, 2], source='file', fail_after=2))
+    monkeypatch.setattr(s3, 'UPLOAD_EXPIRE', -1)
+    upload = asyncio.run(_upload(client, [1, 2], source='file'))
+    assert ('abort', 'upload0') in client.calls
+    assert upload.upload_id == 'upload1'
+
+
+def test_stream_parts_not_copied(monkeypatch):
+    monkeypatch.setattr(s3, 'FILE_CHUNK_SIZE', 4)
+
+    async def chunks():
+        for chunk in (b'cd', b'efghi', b'j'):
+            yield chunk
+
+    async def main():
+        first = bytearray(b'ab')
+        return [(number, read()) async for number, read in s3._stream_parts(
+            chunks(), first)], first
+
+    parts, first = asyncio.run(main())
+    assert parts == [(1, b'abcd'), (2, b'efgh'), (3, b'ij')]
+    # the buffer grown from the beginning is uploaded as is
+    assert parts[0][1] is first
+    assert all(isinstance(data, bytearray) for _, data in parts)
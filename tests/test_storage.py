@@ -0,0 +1,71 @@
+import asyncio
+from hashlib import sha256
+import pytest
+from utils.storage.backend import LocalBackend
+
+
+@pytest.fixture
+def backend(tmp_path):
+    return LocalBackend(tmp_path, '/storage/')
+
+
+async def _chunks(*chunks: bytes):
+    for chunk in chunks:
+        yield chunk
+
+
+def test_same_content_stored_once(backend, tmp_path):
+    file = tmp_path / 'src.jpg'
+    file.write_bytes(b'content')
+
+    async def main():
+        puts = [
+            await backend.put(str(file), 'pixiv/1.jpg'),
+            await backend.put(b'content', 'pixiv/2.JPG'),
+            await backend.put(_chunks(b'con', b'tent'), 'other/3.jpg'),
+        ]
+        return puts, [
+            await backend.url(key)
+            for key in ('pixiv/1.jpg', 'pixiv/2.JPG', 'other/3.jpg')
+        ], await backend.get('other/3.jpg')
+
+    puts, urls, content = asyncio.run(main())
+    assert puts == [True] * 3
+    name = sha256(b'content').hexdigest() + '.jpg'
+    assert urls == [f'/storage/{name}'] * 3
+    assert content == b'content'
+    objects = [path for path in (tmp_path / 'objects').rglob('*')
+               if path.is_file()]
+    assert objects == [backend.object_path(name)]
+    # no temporary file is left
+    assert list((tmp_path / 'tmp').iterdir()) == []
+
+
+def test_missing_key(backend):
+    async def main():
+        return await backend.has('pixiv/none.jpg'), \
+            await backend.get('pixiv/none.jpg'), \
+            await backend.url('pixiv/none.jpg')
+
+    assert asyncio.run(main()) == (False, None, '')
+    with pytest.raises(FileNotFoundError):
+        asyncio.run(backend.stream('pixiv/none.jpg').__anext__())
+
+
+@pytest.mark.parametrize('key', ['../escape.jpg', 'pixiv/../../escape.jpg',
+                                 '..', 'pixiv/..'])
+def test_traversal_rejected(backend, tmp_path, key):
+    with pytest.raises(ValueError):
+        asyncio.run(backend.put(b'content', key))
+    with pytest.raises(ValueError):
+        asyncio.run(backend.has(key))
+    assert not (tmp_path.parent / 'escape.jpg').exists()
+    assert not (tmp_path / 'escape.jpg').exists()
+
+
+def test_object_path_names(backend):
+    digest = sha256(b'').hexdigest()
+    assert backend.object_path(digest + '.png') == \
+        backend.root / 'objects' / digest[:2] / digest[2:4] / digest
+    for name in ('../' + digest, digest[:-1], digest + '.p/g', 'name.png'):
+        assert backend.object_path(name) is None
@@ -0,0 +1,103 @@
+import asyncio
+from typing import List
+import pytest
+from app.pixiv import tables
+from app.pixiv.pixiv import Pixiv
+from app.pixiv.tagindex import TagIndex
+from utils.database import Base
+from utils.database.session import Session
+
+TAGS = [('猫', 'Cat'), ('cats', None), ('R-18', None), ('a_b', 'x%y'),
+        ('Ärger', None), ('', None)]
+WORDS = [
+    'cat', 'Cat', 'CAT', 'c t', 'ca  ts', '', '-', 'cat -R-18', '猫', '-猫',
+    'a_b', 'axb', '_', '%', 'x%y', 'ärger', 'Ärger', 'R-18 -cats'
+]
+
+
+async def _search(words: List[str], search_target: str) -> List[set]:
+    found = []
+    for word in words:
+        illusts = await Pixiv().search_illust_local(
+            word=word, search_target=search_target)
+        found.append({illust.id for illust in illusts})
+    return found
+
+
+async def _compare(search_target: str):
+    Session.init()
+    async with Session.get_engine().begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    async with Session() as session:
+        async with session.begin():
+            tags = [
+                tables.Tag(name=name, translated_name=translated_name)
+                for name, translated_name in TAGS
+            ]
+            session.add_all([
+                tables.Illust(id=i + 1, title=str(i), tags=tags[i:i + 2])
+                for i in range(len(tags))
+            ])
+            session.add(tables.Illust(id=100, title='untagged'))
+    TagIndex.clear()
+    fallback = await _search(WORDS, search_target)
+    await TagIndex.build()
+    indexed = await _search(WORDS, search_target)
+    TagIndex.clear()
+    await Session.get_engine().dispose()
+    return fallback, indexed
+
+
+@pytest.mark.parametrize('search_target',
+                         ['partial_match_for_tags', 'exact_match_for_tags'])
+def test_index_matches_fallback(search_target):
+    fallback, indexed = asyncio.run(_compare(search_target))
+    for word, expected, found in zip(WORDS, fallback, indexed):
+        assert found == expected, word
+
+
+def test_index_skips_like_escapes():
+    Session.init()
+    TagIndex._ready = True
+    try:
+        assert asyncio.run(TagIndex.whereclauses(['a\\b'],
+                                                 partial=True)) is None
+    finally:
+        TagIndex.clear()
+
+
+async def _ingest_elsewhere(monkeypatch) -> tuple:
+    Session.init()
+    async with Session.get_engine().begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    async with Session() as session:
+        async with session.begin():
+            session.add(tables.Illust(id=1, tags=[tables.Tag(name='a')]))
+    await TagIndex.build()
+    # written as by another worker, index is not updated
+    async with Session() as session:
+        async with session.begin():
+            tag = tables.Tag(name='b')
+            session.add(tables.Illust(id=2, tags=[tag]))
+    trusted = await TagIndex.whereclauses(['b'])
+    monkeypatch.setattr(TagIndex, 'CHECK_INTERVAL', 0)
+    stale = await TagIndex.whereclauses(['b'])
+    found = await _search(['b'], 'exact_match_for_tags')
+    await TagIndex._building
+    assert await TagIndex.whereclauses(['b']) is not None
+    rebuilt = TagIndex.exact('b')
+    TagIndex.clear()
+    await Session.get_engine().dispose()
+    return trusted, stale, found, rebuilt
+
+
+def test_stale_index_falls_back(monkeypatch):
+    trusted, stale, found, rebuilt = asyncio.run(
+        _ingest_elsewhere(monkeypatch))
+    # within "CHECK_INTERVAL" index is trusted
+    assert trusted is not None
+    assert stale is None
+    assert found == [{2}]
+    assert rebuilt == {2}
@@ -0,0 +1,220 @@
+import asyncio
+import os
+from datetime import timedelta
+from hashlib import sha256
+import pytest
+from app.pixiv import pixiv, tables
+from app.pixiv.pixiv import Pixiv
+from utils.database import Base
+from utils.database.crud import select, update
+from utils.database.session import Session
+
+FAILING = {1, 3, 5}
+
+
+class _Backend(object):
+    def __init__(self, objects: dict = None):
+        # key -> content
+        self.objects = objects or {}
+
+    async def put(self, src, key, public_read=False, resumable=True):
+        return True
+
+    async def url(self, key):
+        return f'/storage/{key}'
+
+    async def stream(self, key):
+        if key not in self.objects:
+            raise FileNotFoundError(key)
+        yield self.objects[key]
+
+
+@pytest.fixture
+def fetches(monkeypatch):
+    fetches = []
+
+    async def fetch(self, obj, directory):
+        fetches.append(obj.id)
+        await asyncio.sleep(0.01)
+        if obj.id in FAILING:
+            raise RuntimeError(obj.id)
+        file = os.path.join(directory, f'{obj.id}.jpg')
+        with open(file, 'wb') as f:
+            f.write(b'%d' % obj.id)
+        return file, sha256(b'%d' % obj.id).hexdigest(), 1
+
+    monkeypatch.setattr(Pixiv, '_fetch_storage', fetch)
+    monkeypatch.setattr(Pixiv, 'TRANSFER_BATCH', 4)
+    monkeypatch.setattr(Pixiv, 'TRANSFER_ATTEMPTS', 2)
+    monkeypatch.setattr(Pixiv, 'DERIVATIVE_WIDTHS', [])
+    monkeypatch.setattr(pixiv, 'storage_backend', _Backend())
+    return fetches
+
+
+async def _storages() -> dict:
+    async with Session() as session:
+        result = await session.execute(select(tables.PixivStorage))
+        return {obj.id: obj for obj in result.scalars()}
+
+
+async def _transfer(*workers: Pixiv):
+    await asyncio.gather(*[worker.transfer_storages() for worker in workers])
+    if Pixiv._transfers_retry is not None:
+        Pixiv._transfers_retry.cancel()
+        Pixiv._transfers_retry = None
+
+
+async def _create_all():
+    Session.init()
+    async with Session.get_engine().begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+
+
+async def _run(fetches: list) -> list:
+    await _create_all()
+    now = Pixiv._utcnow()
+    async with Session() as session:
+        async with session.begin():
+            session.add_all([
+                tables.PixivStorage(id=i, source=f'https://p/{i}.jpg')
+                for i in range(1, 11)
+            ])
+            # claimed by a worker still transferring it
+            session.add(
+                tables.PixivStorage(id=11,
+                                    source='https://p/11.jpg',
+                                    claim='other',
+                                    claimed_until=now + timedelta(hours=1)))
+    results = []
+    # two workers sharing the database
+    await _transfer(Pixiv(), Pixiv())
+    results.append((sorted(fetches), await _storages()))
+    fetches.clear()
+    # failed storages wait for "retry_at"
+    await _transfer(Pixiv())
+    results.append((sorted(fetches), await _storages()))
+    async with Session() as session:
+        async with session.begin():
+            await session.execute(
+                update(tables.PixivStorage,
+                       whereclauses=[tables.PixivStorage.id != 11],
+                       values={'retry_at': now}))
+    await _transfer(Pixiv())
+    results.append((sorted(fetches), await _storages()))
+    await Session.get_engine().dispose()
+    return results
+
+
+def test_transfer_claims_and_retries(fetches):
+    started = Pixiv._utcnow()
+    (first, storages), (second, _), (third, retried) = asyncio.run(
+        _run(fetches))
+    # each storage is fetched by one worker once
+    assert first == list(range(1, 11))
+    for i, obj in storages.items():
+        if i == 11:
+            assert obj.claim == 'other' and obj.useable is False
+        elif i in FAILING:
+            assert (obj.useable, obj.attempts, obj.priority) == (False, 1, 0)
+            delay = obj.retry_at - started
+            assert timedelta(seconds=Pixiv.TRANSFER_RETRY_DELAY) <= \
+                delay < timedelta(seconds=Pixiv.TRANSFER_RETRY_DELAY + 10)
+            assert obj.claim is None and obj.claimed_until is None
+        else:
+            assert obj.useable is True
+            assert obj.url == f'/storage/pixiv/{obj.digest}.jpg'
+            assert obj.claim is None and obj.claimed_until is None
+    assert second == []
+    assert third == sorted(FAILING)
+    for i in FAILING:
+        # no more attempts left
+        assert (retried[i].attempts, retried[i].priority) == (2, -1)
+
+
+def test_storage_image_read_from_storage(fetches, monkeypatch):
+    digest = sha256(b'stored').hexdigest()
+    monkeypatch.setattr(
+        pixiv, 'storage_backend',
+        _Backend({f'pixiv/{digest}.gif': b'stored'}))
+
+    async def main():
+        await _create_all()
+        async with Session() as session:
+            async with session.begin():
+                session.add(
+                    tables.PixivObject(digest=digest,
+                                       key=f'pixiv/{digest}.gif',
+                                       url=f'/storage/pixiv/{digest}.gif',
+                                       size=6))
+                session.add_all([
+                    tables.PixivStorage(id=i,
+                                        source=f'https://p/{i}.zip',
+                                        useable=True,
+                                        digest=digest) for i in (2, 4)
+                ])
+                session.add(
+                    tables.PixivStorage(id=6, source='https://p/6.jpg'))
+        files = []
+        for i in (2, 4, 6):
+            pixiv.image_cache.delete((f'{i % 256:02x}', i))
+            if i == 4:
+                # object lost from storage
+                pixiv.storage_backend.objects.clear()
+            files.append(await Pixiv().storage_image(i))
+        await Session.get_engine().dispose()
+        return files
+
+    stored, lost, downloaded = asyncio.run(main())
+    with open(stored, 'rb') as f:
+        assert f.read() == b'stored'
+    # downloaded from pixiv otherwise
+    assert fetches == [4, 6]
+    with open(lost, 'rb') as f:
+        assert f.read() == b'4'
+    with open(downloaded, 'rb') as f:
+        assert f.read() == b'6'
+
+
+class _Response(object):
+    def __init__(self, body: bytes):
+        self.content = self
+        self.body = body
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    def raise_for_status(self):
+        pass
+
+    async def iter_chunked(self, size):
+        yield self.body
+
+
+def test_download_shares_client(monkeypatch):
+    urls = []
+
+    async def main():
+        await Pixiv.start_client()
+        session = Pixiv.app.session
+        monkeypatch.setattr(
+            session, 'get',
+            lambda url, **kwargs: urls.append(url) or _Response(b'body'))
+        chunks = [
+            [chunk async for chunk in Pixiv._download(f'https://p/{i}.jpg')]
+            for i in range(2)
+        ]
+        # started once
+        await Pixiv.start_client()
+        assert Pixiv.app.session is session
+        await Pixiv.close_client()
+        return chunks, session
+
+    chunks, session = asyncio.run(main())
+    assert chunks == [[b'body']] * 2
+    assert urls == ['https://p/0.jpg', 'https://p/1.jpg']
+    assert session.closed
+    assert Pixiv.app.session is None and Pixiv._client is None
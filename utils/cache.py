@@ -0,0 +1,295 @@
+"""
+Bytes cache with an in-memory LRU front and files under the home directory.
+
+Keys are tuples mapped to nested paths, so that "delete" of a key prefix
+drops every entry below it. Entries without ttl are written to disk and
+shared by all workers, the modification time of the file is checked on
+every memory hit so that deletions by other workers are noticed. Entries
+with ttl are kept in memory only. If *disksize* is given, least recently
+read files are removed off the event loop once bytes written since the last
+prune take the directory beyond it.
+
+"FileCache" keeps whole files instead of bytes, to be sent from disk. Misses
+of the same key are filled once, waiting for the worker filling it, which
+refreshes its lock while fetching. Files are pruned off the event loop once
+bytes filled since the last prune take the directory beyond *disksize*.
+"""
+import asyncio
+import os
+import shutil
+from collections import OrderedDict
+from logging import getLogger
+from pathlib import Path
+from tempfile import NamedTemporaryFile, TemporaryDirectory
+from time import monotonic, time, time_ns
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+from constants import HOME_DIR
+from utils.syncutils import run_sync
+
+logger = getLogger('api_ethpch')
+
+CACHE_DIR = HOME_DIR / 'cache'
+# part of disksize directories are pruned to, so that prunes are rare
+PRUNE_RATIO = 0.9
+
+
+def _prune(directory: Path, disksize: int) -> int:
+    # least recently read files first, return bytes left
+    files, total = [], 0
+    for path in directory.rglob('*'):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        if path.is_file():
+            files.append((stat.st_atime_ns, stat.st_size, path))
+            total += stat.st_size
+    for _, size, path in sorted(files):
+        if total <= disksize:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+    return total
+
+
+class _DiskUsage(object):
+    """ Bytes of files under *directory*, counted by a scan at first and by
+    "add" since. Files are pruned once it exceeds *disksize*.
+    """
+    def __init__(self, directory: Path, disksize: int) -> None:
+        self.directory = directory
+        self.disksize = disksize
+        self.usage: Optional[int] = None
+        self._pruning = False
+        self._task: asyncio.Task = None
+
+    def add(self, size: int):
+        if self.usage is not None:
+            self.usage += size
+        if self._pruning or (self.usage is not None
+                             and self.usage <= self.disksize):
+            return
+        self._pruning = True
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            # no event loop in this thread to block
+            self._prune()
+        else:
+            self._task = asyncio.create_task(run_sync(self._prune)())
+
+    def _prune(self):
+        try:
+            self.usage = _prune(self.directory,
+                                int(self.disksize * PRUNE_RATIO))
+        except OSError as e:
+            logger.warning(f'Cannot prune cache "{self.directory}": {e}')
+        finally:
+            self._pruning = False
+
+
+class Cache(object):
+    def __init__(self,
+                 name: str,
+                 maxsize: int = 256,
+                 disksize: int = None) -> None:
+        self.directory = CACHE_DIR / name
+        self.maxsize = maxsize
+        self.disksize = disksize
+        self._usage = _DiskUsage(self.directory, disksize) \
+            if disksize is not None else None
+        # key -> (value, expire time or None, file mtime or None)
+        self._memory: 'OrderedDict[Tuple, Tuple[bytes, float, int]]' = \
+            OrderedDict()
+
+    def _path(self, key: Tuple) -> Path:
+        return self.directory.joinpath(*[str(part) for part in key])
+
+    def _remember(self, key: Tuple, value: bytes, expire: float,
+                  mtime: int):
+        self._memory[key] = value, expire, mtime
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+
+    @staticmethod
+    def _mtime(path: Path) -> Optional[int]:
+        try:
+            return path.stat().st_mtime_ns
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+
+    def _touch(self, path: Path, mtime: int):
+        # access time orders files for "_prune", mtime is kept
+        if self.disksize is not None and mtime is not None:
+            try:
+                os.utime(path, ns=(time_ns(), mtime))
+            except OSError:
+                pass
+
+    def get(self, key: Tuple) -> Optional[bytes]:
+        path = self._path(key)
+        if entry := self._memory.get(key):
+            value, expire, mtime = entry
+            if expire is not None:
+                if expire > monotonic():
+                    self._memory.move_to_end(key)
+                    return value
+            elif mtime == self._mtime(path):
+                self._memory.move_to_end(key)
+                self._touch(path, mtime)
+                return value
+            del self._memory[key]
+        try:
+            value = path.read_bytes()
+        except (FileNotFoundError, NotADirectoryError, IsADirectoryError):
+            return None
+        self._remember(key, value, None, mtime := self._mtime(path))
+        self._touch(path, mtime)
+        return value
+
+    def set(self, key: Tuple, value: bytes, ttl: float = None):
+        if ttl is not None:
+            self._remember(key, value, monotonic() + ttl, None)
+            return
+        path = self._path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with NamedTemporaryFile(dir=path.parent, delete=False) as f:
+                f.write(value)
+            os.replace(f.name, path)
+        except OSError as e:
+            logger.warning(f'Cannot write cache "{path}": {e}')
+            return
+        self._remember(key, value, None, self._mtime(path))
+        if self._usage is not None:
+            self._usage.add(len(value))
+
+    def delete(self, key: Tuple):
+        """ Delete *key* and all keys starting with it. """
+        for k in [k for k in self._memory if k[:len(key)] == key]:
+            del self._memory[k]
+        path = self._path(key)
+        if path.is_dir():
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        self._memory.clear()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class FileCache(object):
+    # seconds a lock not refreshed by the worker filling is kept, polled
+    # every "POLL" by others
+    LOCK_TIMEOUT = 300
+    POLL = 0.1
+
+    def __init__(self, name: str, disksize: int = None) -> None:
+        self.directory = CACHE_DIR / name
+        # locks and files being written, same file system as cache
+        self.partial = CACHE_DIR / f'{name}.partial'
+        self.disksize = disksize
+        self._usage = _DiskUsage(self.directory, disksize) \
+            if disksize is not None else None
+        self._filling: Dict[Tuple, asyncio.Task] = {}
+
+    def _path(self, key: Tuple) -> Path:
+        return self.directory.joinpath(*[str(part) for part in key])
+
+    def _lock(self, key: Tuple) -> Path:
+        return self.partial / ('-'.join(str(part) for part in key) + '.lock')
+
+    def get(self, key: Tuple) -> Optional[Path]:
+        path = self._path(key)
+        try:
+            # access time orders files for "_prune"
+            os.utime(path, ns=(time_ns(), path.stat().st_mtime_ns))
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        except OSError:
+            pass
+        return path
+
+    async def fill(
+        self,
+        key: Tuple,
+        fetch: Callable[[str], Awaitable[Optional[str]]],
+    ) -> Optional[Path]:
+        """ Path of *key*, filled by *fetch* on a miss. *fetch* writes a
+        file under the directory given and returns it, or None if there is
+        nothing to cache.
+        """
+        if (path := self.get(key)) is not None:
+            return path
+        if (task := self._filling.get(key)) is None:
+            task = self._filling[key] = asyncio.create_task(
+                self._fill(key, fetch))
+            task.add_done_callback(lambda _: self._filling.pop(key, None))
+        # cancelling a waiter leaves the fill to others
+        return await asyncio.shield(task)
+
+    async def _acquire(self, lock: Path) -> bool:
+        # False once other worker filled the key
+        while True:
+            try:
+                os.close(os.open(lock, os.O_CREAT | os.O_EXCL))
+                return True
+            except FileExistsError:
+                pass
+            try:
+                if time() - lock.stat().st_mtime > self.LOCK_TIMEOUT:
+                    # worker holding it is gone
+                    lock.unlink(missing_ok=True)
+                    continue
+            except FileNotFoundError:
+                continue
+            await asyncio.sleep(self.POLL)
+            if not lock.exists():
+                return False
+
+    async def _refresh(self, lock: Path):
+        # mtime of lock tells others the fill is alive
+        while True:
+            await asyncio.sleep(self.LOCK_TIMEOUT / 3)
+            try:
+                os.utime(lock)
+            except FileNotFoundError:
+                return
+
+    async def _fill(
+        self,
+        key: Tuple,
+        fetch: Callable[[str], Awaitable[Optional[str]]],
+    ) -> Optional[Path]:
+        path, lock = self._path(key), self._lock(key)
+        self.partial.mkdir(parents=True, exist_ok=True)
+        while not await self._acquire(lock):
+            if (filled := self.get(key)) is not None:
+                return filled
+        refresh = asyncio.create_task(self._refresh(lock))
+        try:
+            if (filled := self.get(key)) is not None:
+                return filled
+            with TemporaryDirectory(dir=self.partial) as directory:
+                if (file := await fetch(directory)) is None:
+                    return None
+                size = os.stat(file).st_size
+                path.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(file, path)
+        finally:
+            refresh.cancel()
+            lock.unlink(missing_ok=True)
+        if self._usage is not None:
+            self._usage.add(size)
+        return path
+
+    def delete(self, key: Tuple):
+        self._path(key).unlink(missing_ok=True)
+
+
+__all__ = ('Cache', 'FileCache')
@@ -0,0 +1,147 @@
+"""
+ASGI middleware compressing response bodies by "Accept-Encoding".
+
+gzip is always available, brotli and zstd are used if "brotli" and
+"zstandard" are installed. Only complete bodies of 200 responses of
+compressible media types are compressed, streamed responses and partial
+content are sent as they are. Compressed bodies of responses carrying an
+"ETag" and allowed in shared caches are kept in a cache, so that each of
+them is compressed once per encoding.
+"""
+import gzip
+from functools import partial
+from typing import Callable, Dict, Optional
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from utils.cache import Cache
+from utils.general import quality_values
+from utils.syncutils import run_sync
+
+# preferred first when client accepts them equally
+_compressors: Dict[str, Callable[[bytes], bytes]] = {}
+try:
+    import zstandard
+except ModuleNotFoundError:
+    pass
+else:
+    # compressor objects are not thread safe, one per call
+    _compressors['zstd'] = lambda data: zstandard.ZstdCompressor(
+        level=3).compress(data)
+try:
+    import brotli
+except ModuleNotFoundError:
+    pass
+else:
+    _compressors['br'] = partial(brotli.compress, quality=5)
+# mtime fixed so that equal bodies compress to equal bytes
+_compressors['gzip'] = partial(gzip.compress, compresslevel=6, mtime=0)
+
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/x-ndjson',
+                      'application/javascript', 'application/xml',
+                      'image/svg+xml')
+
+
+def negotiate(accept_encoding: str) -> Optional[str]:
+    """ Encoding to use for *accept_encoding*, None for identity. """
+    qualities = quality_values(accept_encoding)
+    best, best_quality = None, 0.0
+    for coding in _compressors:
+        quality = qualities.get(coding, qualities.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+class CompressionMiddleware(object):
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = 500,
+        offload_size: int = 1 << 16,
+        cache: Cache = None,
+    ) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+        self.offload_size = offload_size
+        self.cache = cache
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate(
+            Headers(scope=scope).get('accept-encoding', ''))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        start: Optional[Message] = None
+        streaming = False
+
+        async def send_compressed(message: Message):
+            nonlocal start, streaming
+            if message['type'] == 'http.response.start':
+                start = message
+                return
+            elif message['type'] != 'http.response.body' or streaming:
+                # e.g. "http.response.zerocopysend", sent as it is
+                if not streaming:
+                    streaming = True
+                    await send(start)
+                await send(message)
+                return
+            if message.get('more_body', False):
+                streaming = True
+            else:
+                message = await self.compress(start, message, encoding)
+            await send(start)
+            await send(message)
+
+        await self.app(scope, receive, send_compressed)
+
+    def _compressible(self, start: Message, headers: MutableHeaders,
+                      body: bytes) -> bool:
+        # ranges count bytes of the identity representation
+        return start['status'] == 200 and len(body) >= self.minimum_size and \
+            'content-range' not in headers and \
+            'content-encoding' not in headers and \
+            headers.get('content-type', '').startswith(COMPRESSIBLE_TYPES)
+
+    @staticmethod
+    def _cache_key(headers: MutableHeaders) -> Optional[str]:
+        etag = headers.get('etag', '').removeprefix('W/').strip('"')
+        cache_control = headers.get('cache-control', '')
+        if not etag.isalnum() or 'no-store' in cache_control or \
+                'private' in cache_control:
+            return None
+        return etag
+
+    async def compress(self, start: Message, message: Message,
+                       encoding: str) -> Message:
+        headers = MutableHeaders(raw=start['headers'])
+        body = message.get('body', b'')
+        if not self._compressible(start, headers, body):
+            return message
+        etag = self._cache_key(headers) if self.cache else None
+        if etag is None or (compressed := self.cache.get(
+                (encoding, etag))) is None:
+            compress = _compressors[encoding]
+            if len(body) >= self.offload_size:
+                compressed = await run_sync(compress)(body)
+            else:
+                compressed = compress(body)
+            if etag is not None:
+                self.cache.set((encoding, etag), compressed)
+        headers['Content-Encoding'] = encoding
+        headers['Content-Length'] = str(len(compressed))
+        headers.add_vary_header('Accept-Encoding')
+        if 'accept-ranges' in headers:
+            # ranges of the encoded body are not served
+            headers['Accept-Ranges'] = 'none'
+        if 'etag' in headers and not headers['etag'].startswith('W/'):
+            # representation differs, still matches "If-None-Match"
+            headers['ETag'] = 'W/' + headers['etag']
+        start['headers'] = headers.raw
+        return {**message, 'body': compressed}
+
+
+__all__ = ('negotiate', 'CompressionMiddleware')
@@ -3,11 +3,11 @@ from typing import List, Optional, Literal, Union, Any
 from pathlib import Path
 from yaml import safe_load
 from pydantic import BaseModel, Field, AnyUrl, HttpUrl, constr, IPvAnyAddress
-from constants import CONFIG_FILE_PATH
+from constants import CONFIG_FILE_PATH, HOME_DIR
 
 __all__ = [
-    'debug', 'server', 'asgi_framework', 'markdown_theme', 's3', 'database',
-    'apps'
+    'debug', 'server', 'asgi_framework', 'markdown_theme', 'compression',
+    's3', 'storage', 'imaging', 'database', 'apps'
 ]
 
 DomainUrl = constr(
@@ -50,15 +50,50 @@ class serverModel(BaseModel):
         super().__init__(**data)
 
 
+class compressionModel(BaseModel):
+    enable: bool = True
+    minimum_size: int = Field(500, ge=0)
+    offload_size: int = Field(65536, ge=0)
+    cache_size: int = Field(128 * 1024 * 1024, ge=0)
+
+    def __init__(__pydantic_self__, **data: Any) -> None:
+        data = {k: v for k, v in data.items() if v is not None}
+        super().__init__(**data)
+
+
 class s3Model(BaseModel):
     endpoint_url: HttpUrl = 'https://s3.amazonaws.com'
     aws_access_key_id: Optional[str] = os.getenv('AWS_ACCESS_KEY_ID')
     aws_secret_access_key: Optional[str] = os.getenv('AWS_SECRET_ACCESS_KEY')
     api_bucket: Optional[str] = None
+    max_pool_connections: int = Field(10, ge=1)
 
     def __init__(__pydantic_self__, **data: Any) -> None:
         if data.get('endpoint_url') is None:
             data['endpoint_url'] = 'https://s3.amazonaws.com'
+        if data.get('max_pool_connections') is None:
+            data.pop('max_pool_connections', None)
+        super().__init__(**data)
+
+
+class storageModel(BaseModel):
+    backend: Literal['s3', 'local'] = 's3'
+    local_root: Path = HOME_DIR / 'storage'
+    url_prefix: str = '/storage'
+
+    def __init__(__pydantic_self__, **data: Any) -> None:
+        data = {k: v for k, v in data.items() if v is not None}
+        super().__init__(**data)
+
+
+class imagingModel(BaseModel):
+    processes: int = Field(2, ge=1)
+    quality: int = Field(80, ge=1, le=100)
+    transcode_processes: int = Field(1, ge=1)
+    transcode_timeout: float = Field(120, gt=0)
+
+    def __init__(__pydantic_self__, **data: Any) -> None:
+        data = {k: v for k, v in data.items() if v is not None}
         super().__init__(**data)
 
 
@@ -117,6 +152,9 @@ class pixivModel(BaseModel):
     proxy: Union[HttpUrl, SocksUrl, None] = None
     bypass: Optional[bool] = False
     transfer: Optional[bool] = False
+    fast_response: Optional[bool] = False
+    image_cache_size: int = Field(1024 * 1024 * 1024, ge=0)
+    derivative_widths: List[int] = []
 
 
 CONFIG_TEMPLATE = """server:
@@ -142,11 +180,43 @@ allow reload: false
 # defaults to united
 markdown theme:
 
+# response compression, gzip and brotli/zstd if installed
+compression:
+  enable: true
+  # bytes, smaller bodies are sent uncompressed
+  minimum_size: 500
+  # bytes, larger bodies are compressed off the event loop
+  offload_size: 65536
+  # bytes on disk of compressed bodies of cacheable responses
+  cache_size: 134217728
+
 s3:
   endpoint_url:
   aws_access_key_id:
   aws_secret_access_key:
   api_bucket:
+  # connections kept by the client shared within a worker
+  max_pool_connections: 10
+
+# storage of files transferred by apps
+storage:
+  # options: s3, local
+  backend: s3
+  # directory of local backend, defaults to ~/.api_ethpch/storage
+  local_root:
+  # path under which the app serves files of local backend
+  url_prefix: /storage
+
+# resized and re-encoded images, encoded by Pillow in worker processes
+imaging:
+  # worker processes encoding images
+  processes: 2
+  # quality of lossy formats, 1-100
+  quality: 80
+  # worker processes transcoding animations, e.g. pixiv ugoira to GIF
+  transcode_processes: 1
+  # seconds a transcoding may take
+  transcode_timeout: 120
 
 database:
   # type options: sqlite, pgsql, mysql, oracle, mssql
@@ -189,6 +259,12 @@ pixiv:
   bypass:
   # transfer to storage
   transfer: false
+  # serialize database results without validating response models
+  fast_response: false
+  # bytes of images kept on disk by "/pixiv/img/{storage_id}"
+  image_cache_size: 1073741824
+  # widths of WebP derivatives made while transferring, e.g. [480, 1080]
+  derivative_widths: []
 """
 
 try:
@@ -207,7 +283,10 @@ else:
     asgi_framework: str = RAW_CONFIG.get('asgi framework', 'uvicorn')
     allow_reload: bool = RAW_CONFIG.get('allow reload', False)
     markdown_theme: str = RAW_CONFIG.get('markdown theme', 'united')
+    compression = compressionModel(**(RAW_CONFIG.get('compression') or {}))
     s3 = s3Model(**RAW_CONFIG['s3'])
+    storage = storageModel(**(RAW_CONFIG.get('storage') or {}))
+    imaging = imagingModel(**(RAW_CONFIG.get('imaging') or {}))
     database = databaseModel(**RAW_CONFIG['database'])
     apps = RAW_CONFIG['enable_apps']
     if 'pixiv' in apps:
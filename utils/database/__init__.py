@@ -1,4 +1,6 @@
-from collections import defaultdict
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Tuple
+from sqlalchemy import inspect
+from sqlalchemy.ext.hybrid import HYBRID_PROPERTY
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.orm.exc import DetachedInstanceError
 from sqlalchemy.sql.schema import Column
@@ -81,83 +83,155 @@ class BaseMixin(object):
     id = Column(Integer, primary_key=True, autoincrement=True)
 
 
-def _collect_sa_instances(instance):
-    sa_instances_collection = {}
+class _Compiled(object):
+    """ Attribute layout of a mapped class, compiled once per class. """
+    retains = ('__bool__', '__len__', '__eq__', '__repr__', '__str__')
+    new_type_prefix = 'TempType_'
+    _cache: Dict[type, '_Compiled'] = {}
 
-    def inner(instance):
-        collection = {id(instance): instance}
-        for name in dir(instance):
-            if name not in _sa_meta and (name.startswith('__') is False
-                                         and name.endswith('__') is False):
-                try:
-                    attr = getattr(instance, name)
-                    if isinstance(attr, list):
-                        for obj in attr:
-                            if isinstance(obj, Base):
-                                collection[id(obj)] = obj
-                    elif isinstance(attr, Base):
-                        collection[id(attr)] = attr
-                except DetachedInstanceError:
-                    pass
-        return collection
+    def __init__(self, cls: type) -> None:
+        # columns and relationships, backrefs included, and properties
+        # computed from them, methods are not copied
+        mapper = inspect(cls)
+        self.mapped = frozenset(
+            (*mapper.column_attrs.keys(), *mapper.relationships.keys()))
+        computed = {
+            name
+            for name, descriptor in mapper.all_orm_descriptors.items()
+            if descriptor.extension_type is HYBRID_PROPERTY
+        }
+        computed.update(name for klass in cls.__mro__
+                        for name, value in vars(klass).items()
+                        if isinstance(value, property))
+        self.names = tuple(
+            sorted(name for name in self.mapped.union(computed)
+                   if name not in _sa_meta))
+        self.type = type(
+            self.new_type_prefix + cls.__module__ + '.' + cls.__name__,
+            (object, ),
+            {name: getattr(cls, name)
+             for name in self.retains if hasattr(cls, name)})
 
-    need_to_search = [instance]
-    while need_to_search:
-        new_collection = inner(need_to_search.pop(0))
-        for k, v in new_collection.items():
-            if k not in sa_instances_collection.keys():
-                need_to_search.append(v)
-        sa_instances_collection.update(new_collection)
-    return sa_instances_collection
+    @classmethod
+    def of(cls, mapped_cls: type) -> '_Compiled':
+        try:
+            return cls._cache[mapped_cls]
+        except KeyError:
+            compiled = cls._cache[mapped_cls] = cls(mapped_cls)
+            return compiled
 
+    def items(
+        self,
+        instance,
+        names: Iterable[str] = None,
+    ) -> Iterator[Tuple[str, Any]]:
+        loaded = instance.__dict__
+        detached = instance._sa_instance_state.detached
+        for name in self.names if names is None else names:
+            if name in self.mapped:
+                if name in loaded:
+                    yield name, loaded[name]
+                    continue
+                elif detached:
+                    # would raise DetachedInstanceError
+                    yield name, None
+                    continue
+            try:
+                yield name, getattr(instance, name)
+            except DetachedInstanceError:
+                yield name, None
 
-def pure_instance(instance) -> object:
-    retains = ('__bool__', '__len__', '__eq__', '__repr__', '__str__')
-    instances = {}
-    new_types_collection = defaultdict(dict)
-    new_types_prefix = 'TempType_'
-
-    def type_name(obj: type):
-        return obj.__module__ + '.' + obj.__name__
-
-    # collect sa instances
-    sa_instances_collection = _collect_sa_instances(instance)
-
-    # collect new types data
-    for k, v in sa_instances_collection.items():
-        for name in dir(v):
-            if name in retains:
-                new_types_collection[type_name(type(v))][name] = getattr(
-                    type(v), name)
-    # generate new types dynamically
-    for k, v in new_types_collection.items():
-        new_types_collection[k] = type(new_types_prefix + k, (object, ), v)
-    default_type = type(new_types_prefix + 'default', (object, ), {})
-    # filter sa meta attributes
-    for k, v in sa_instances_collection.items():
-        _typename = type_name(type(v))
-        instances[k] = new_types_collection.get(_typename, default_type)()
-    for v in sa_instances_collection.values():
-        for name in dir(v):
-            if name not in _sa_meta and (name.startswith('__') is False
-                                         and name.endswith('__') is False):
-                try:
-                    attr = getattr(v, name)
-                    if isinstance(attr, list):
-                        _ = []
-                        for i in range(len(attr)):
-                            if isinstance(attr[i], _base):
-                                _.append(instances[id(attr[i])])
-                            else:
-                                _.append(attr[i])
-                        setattr(instances[id(v)], name, _)
-                    elif isinstance(attr, _base):
-                        setattr(instances[id(v)], name, instances[id(attr)])
-                    else:
-                        setattr(instances[id(v)], name, attr)
-                except DetachedInstanceError:
-                    setattr(instances[id(v)], name, None)
 
+def _copy_graph(
+    instance,
+    new: Callable[[Any], Any],
+    assign: Callable[[Any, str, Any], None],
+    plan: Optional[Dict[str, dict]] = None,
+    max_depth: Optional[int] = None,
+) -> Dict[int, Any]:
+    """ Copy sa instances reachable from *instance* by attributes.
+
+    Only lists and direct attributes are followed. *plan* maps names of
+    attributes to follow to the plan of the instances they hold, all
+    attributes are followed if *plan* is None. Instances deeper than
+    *max_depth* are not followed. Attributes holding instances out of the
+    copied ones are None.
+
+    *new* creates the copy of a sa instance, *assign* sets an attribute
+    of a copy. Return copies by id of the original instances.
+    """
+    copies = {id(instance): new(instance)}
+    origins = [instance]
+    values = {}
+    visited = set()
+    need_to_follow = [(instance, plan, 0)]
+    while need_to_follow:
+        origin, _plan, depth = need_to_follow.pop()
+        if (id(origin), id(_plan)) in visited or \
+                (max_depth is not None and depth >= max_depth):
+            continue
+        visited.add((id(origin), id(_plan)))
+        compiled = _Compiled.of(type(origin))
+        if _plan is None:
+            names = None
+        else:
+            names = [name for name in _plan if name in compiled.names]
+        _values = values.setdefault(id(origin), {})
+        for name, attr in compiled.items(origin, names):
+            _values[name] = attr
+            for obj in attr if isinstance(attr, list) else (attr, ):
+                if isinstance(obj, _base):
+                    if id(obj) not in copies:
+                        copies[id(obj)] = new(obj)
+                        origins.append(obj)
+                    need_to_follow.append(
+                        (obj, None if _plan is None else _plan[name],
+                         depth + 1))
+
+    def copy_of(value):
+        if isinstance(value, list):
+            _ = []
+            for item in value:
+                if isinstance(item, _base):
+                    if id(item) not in copies:
+                        return None
+                    item = copies[id(item)]
+                _.append(item)
+            return _
+        elif isinstance(value, _base):
+            return copies.get(id(value))
+        return value
+
+    for origin in origins:
+        copy = copies[id(origin)]
+        compiled = _Compiled.of(type(origin))
+        _values = values.setdefault(id(origin), {})
+        _values.update(
+            compiled.items(origin, [
+                name for name in compiled.names if name not in _values
+            ]))
+        for name in compiled.names:
+            assign(copy, name, copy_of(_values[name]))
+    return copies
+
+
+def _collect_sa_instances(
+    instance,
+    plan: Optional[Dict[str, dict]] = None,
+    max_depth: Optional[int] = None,
+) -> Dict[int, Any]:
+    return _copy_graph(instance, lambda origin: origin,
+                       lambda copy, name, attr: None, plan, max_depth)
+
+
+def pure_instance(
+    instance,
+    plan: Optional[Dict[str, dict]] = None,
+    max_depth: Optional[int] = None,
+) -> object:
+    instances = _copy_graph(instance,
+                            lambda origin: _Compiled.of(type(origin)).type(),
+                            setattr, plan, max_depth)
     main = instances[id(instance)]
     # accessibility to original sa instance
     main.__sa_origin__ = instance
@@ -166,29 +240,13 @@ def pure_instance(instance) -> object:
     return main
 
 
-def pure_dict(instance) -> dict:
-    sa_instances_collection = _collect_sa_instances(instance)
-    dicts = defaultdict(dict)
-    for v in sa_instances_collection.values():
-        for name in dir(v):
-            if name not in _sa_meta and (name.startswith('__') is False
-                                         and name.endswith('__') is False):
-                try:
-                    attr = getattr(v, name)
-                    if isinstance(attr, list):
-                        _ = []
-                        for i in range(len(attr)):
-                            if isinstance(attr[i], _base):
-                                _.append(dicts[id(attr[i])])
-                            else:
-                                _.append(attr[i])
-                        dicts[id(v)][name] = _
-                    elif isinstance(attr, _base):
-                        dicts[id(v)][name] = dicts[id(attr)]
-                    else:
-                        dicts[id(v)][name] = attr
-                except DetachedInstanceError:
-                    dicts[id(v)][name] = None
+def pure_dict(
+    instance,
+    plan: Optional[Dict[str, dict]] = None,
+    max_depth: Optional[int] = None,
+) -> dict:
+    dicts = _copy_graph(instance, lambda origin: {}, dict.__setitem__, plan,
+                        max_depth)
     main = dicts[id(instance)]
     main['__sa_origin__'] = instance
     main['__associations__'] = dicts
@@ -1,4 +1,4 @@
-from typing import Any, Dict, Union, Iterable, Literal
+from typing import Any, Dict, Union, Iterable, Literal, Optional
 from sqlalchemy import orm
 from sqlalchemy.sql.elements import ColumnElement
 from sqlalchemy.sql.expression import insert as _insert
@@ -9,6 +9,7 @@ from sqlalchemy.sql.dml import Insert, Update, Delete
 from sqlalchemy.sql.selectable import Select, FromClause, Selectable
 from sqlalchemy.sql.visitors import Visitable
 from sqlalchemy.sql.expression import or_
+from .projection import projection as _projection, sources as _sources
 
 
 def insert(table: Union[str, Selectable],
@@ -24,6 +25,9 @@ def select(
     eagerloads: Iterable[str] = [],
     eagerload_strategy: Literal['joinedload', 'subqueryload',
                                 'selectinload'] = None,
+    profile: str = None,
+    projection: type = None,
+    fields: Optional[Iterable[str]] = None,
     joins: Iterable[FromClause] = [],
     whereclauses: Iterable[Union[str, bool, Visitable,
                                  Iterable[Union[str, bool, Visitable]]]] = [],
@@ -33,7 +37,18 @@ def select(
     offset: Union[int, str, Visitable, None] = None,
 ) -> Select:
     statement = _select(table_or_column)
-    eagerloads = list(set(eagerloads))
+    if profile is not None:
+        # named loader profile declared on the mapped class, see
+        # "__loader_profiles__", defaults to selectinload
+        eagerloads = [
+            *eagerloads, *table_or_column[0].__loader_profiles__[profile]
+        ]
+        eagerload_strategy = eagerload_strategy or 'selectinload'
+    eagerloads = list(dict.fromkeys(eagerloads))
+    if projection is not None and fields is not None:
+        # relationships of fields not requested are not loaded
+        read = _sources(projection, fields)
+        eagerloads = [e for e in eagerloads if e.split('.')[0] in read]
     if eagerloads:
         eagerload_strategy = eagerload_strategy or 'joinedload'
         eagerload_func = getattr(orm, eagerload_strategy)
@@ -43,9 +58,13 @@ def select(
                 eager = eagerload_func(main[0])
                 for item in main[1:]:
                     eager = getattr(eager, eagerload_strategy)(item)
-                statement = statement.options(eagerload_func(eager))
+                statement = statement.options(eager)
             else:
                 statement = statement.options(eagerload_func(eagerload))
+    if projection is not None:
+        # load only what the response model reads, see "projection"
+        statement = statement.options(
+            *_projection(table_or_column[0], projection, fields))
     for join in joins:
         statement = statement.join(join)
     for i in range(len(whereclauses)):
@@ -67,14 +86,15 @@ def update(
     table: Union[str, Selectable],
     whereclauses: Iterable[Union[str, bool, Visitable,
                                  Iterable[Union[str, bool, Visitable]]]] = [],
-    values: Dict[str, Any] = ...,
+    values: Dict[str, Any] = {},
 ) -> Update:
     statement = _update(table)
     for i in range(len(whereclauses)):
         if isinstance(whereclauses[i], (list, tuple)):
             whereclauses[i] = or_(*whereclauses[i])
     statement = statement.where(*whereclauses)
-    statement.values(**values)
+    if values:
+        statement = statement.values(**values)
     return statement
 
 
@@ -0,0 +1,138 @@
+"""
+Column projection derived from pydantic response models.
+
+Each model field is mapped to the attributes it is read from, either the
+attribute of the same name or the ones listed in "Config.orm_fields" of the
+model. Only these columns (plus primary keys, foreign keys and the
+"__projection_required__" attributes of the mapped class) are loaded, for
+relationship fields the nested model is projected on the related class.
+"""
+from typing import Dict, Iterable, Iterator, Optional, Set, Tuple, Type
+from pydantic import BaseModel
+from pydantic.fields import ModelField
+from sqlalchemy import inspect
+from sqlalchemy.orm import Load, Mapper
+from sqlalchemy.orm.properties import ColumnProperty
+from sqlalchemy.orm.relationships import RelationshipProperty
+
+
+def _nested_model(field: ModelField) -> Optional[Type[BaseModel]]:
+    if isinstance(field.type_, type) and issubclass(field.type_, BaseModel):
+        return field.type_
+    for sub_field in field.sub_fields or ():
+        if model := _nested_model(sub_field):
+            return model
+    return None
+
+
+def _sources(model: Type[BaseModel], name: str) -> Tuple[str, ...]:
+    return getattr(model.__config__, 'orm_fields', {}).get(name, (name, ))
+
+
+def _split_fields(
+    fields: Optional[Iterable[str]],
+) -> Tuple[Optional[Set[str]], dict]:
+    # "user.name" selects field "name" of nested model on field "user"
+    if fields is None:
+        return None, {}
+    top, nested = set(), {}
+    for field in fields:
+        name, _, rest = field.partition('.')
+        top.add(name)
+        if rest:
+            nested.setdefault(name, set()).add(rest)
+    return top, nested
+
+
+def _required(mapper: Mapper) -> Set[str]:
+    keys = set(getattr(mapper.class_, '__projection_required__', ()))
+    for prop in mapper.column_attrs:
+        if any(column.primary_key or column.foreign_keys
+               for column in prop.columns):
+            keys.add(prop.key)
+    return keys
+
+
+def _options(
+    model: Type[BaseModel],
+    mapper: Mapper,
+    loader: Load,
+    fields: Optional[Iterable[str]] = None,
+) -> Iterator[Load]:
+    top, nested_fields = _split_fields(fields)
+    columns = _required(mapper)
+    relationships = set()
+    for name, field in model.__fields__.items():
+        if top is not None and name not in top:
+            continue
+        for source in _sources(model, name):
+            if source not in mapper.attrs:
+                continue
+            prop = mapper.attrs[source]
+            if isinstance(prop, ColumnProperty):
+                columns.add(source)
+            elif isinstance(prop, RelationshipProperty):
+                relationships.add(source)
+                nested_model = _nested_model(field)
+                if nested_model is not None:
+                    yield from _options(
+                        nested_model,
+                        prop.mapper,
+                        loader.defaultload(getattr(mapper.class_, source)),
+                        nested_fields.get(name),
+                    )
+    if len(columns) < len(mapper.column_attrs):
+        yield loader.load_only(
+            *[getattr(mapper.class_, key) for key in sorted(columns)])
+    if top is not None:
+        # eager loading configured on relationships of fields not requested
+        for prop in mapper.relationships:
+            if prop.key not in relationships:
+                yield loader.lazyload(getattr(mapper.class_, prop.key))
+
+
+def projection(
+    entity: type,
+    model: Type[BaseModel],
+    fields: Optional[Iterable[str]] = None,
+) -> Tuple[Load, ...]:
+    """ Loader options loading only what *model* reads from *entity*.
+
+    *fields* optionally restricts the model fields, dotted names select
+    fields of nested models.
+    """
+    return tuple(_options(model, inspect(entity), Load(entity), fields))
+
+
+def sources(model: Type[BaseModel], fields: Iterable[str]) -> Set[str]:
+    """ Attributes the top level of *fields* of *model* are read from. """
+    top, _ = _split_fields(fields)
+    return {
+        source
+        for name in top if name in model.__fields__
+        for source in _sources(model, name)
+    }
+
+
+_plans: Dict[Type[BaseModel], Dict[str, dict]] = {}
+
+
+def traversal_plan(model: Type[BaseModel]) -> Dict[str, dict]:
+    """ Plan of attributes *model* reads, for "pure_instance".
+
+    Map each attribute a field is read from to the plan of the nested
+    model, or to an empty plan if the field has no nested model.
+    """
+    if model in _plans:
+        return _plans[model]
+    # registered before nested plans for self-referencing models
+    plan = _plans[model] = {}
+    for name, field in model.__fields__.items():
+        nested_model = _nested_model(field)
+        nested_plan = traversal_plan(nested_model) if nested_model else {}
+        for source in _sources(model, name):
+            plan[source] = nested_plan
+    return plan
+
+
+__all__ = ('projection', 'sources', 'traversal_plan')
@@ -39,3 +39,21 @@ def markdown_html(
     return (
         f'<xmp theme="{theme}" style="display:none;">{md_text}</xmp>'
         '<script src="https://strapdownjs.com/v/0.2/strapdown.js"></script>')
+
+
+def quality_values(header: str) -> Dict[str, float]:
+    # "Accept" like header into {item: q}, items are lower cased
+    qualities = {}
+    for item in header.split(','):
+        value, _, params = item.partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, q = param.partition('=')
+            if key.strip() == 'q':
+                try:
+                    quality = float(q)
+                except ValueError:
+                    quality = 0.0
+        if value := value.strip().lower():
+            qualities[value] = quality
+    return qualities
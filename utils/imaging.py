@@ -0,0 +1,266 @@
+"""
+Depend on Pillow.
+https://github.com/python-pillow/Pillow
+
+Images are encoded in pools of worker processes, so that encoding never
+blocks the event loop. Derivatives of images, resized and encoded again,
+are made by Pillow in a pool of "imaging.processes" workers. Widths are
+rounded up to "WIDTHS", so that few derivatives of each image exist. AVIF
+is available if Pillow is built with it. Animations are transcoded by
+Pillow in a pool of "imaging.transcode_processes" workers, each of them
+taking "imaging.transcode_timeout" seconds at most.
+"""
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from logging import getLogger
+from multiprocessing import get_context
+from multiprocessing.process import BaseProcess
+from time import perf_counter, time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, \
+    Union
+from PIL import Image, features
+from utils.config import imaging
+
+logger = getLogger('api_ethpch')
+
+WIDTHS = (160, 320, 480, 720, 1080, 1440, 2048)
+# seconds between log lines of "ProcessPool.metrics"
+METRICS_INTERVAL = 600
+
+# format -> (Pillow format, media type, options of "Image.save")
+FORMATS: Dict[str, Tuple[str, str, dict]] = {
+    'webp': ('WEBP', 'image/webp', {
+        'quality': imaging.quality,
+        'method': 4
+    }),
+    'jpeg': ('JPEG', 'image/jpeg', {
+        'quality': imaging.quality,
+        'optimize': True,
+        'progressive': True
+    }),
+}
+if features.check('avif'):
+    FORMATS['avif'] = ('AVIF', 'image/avif', {'quality': imaging.quality})
+
+
+def derivative_width(width: Optional[int]) -> Optional[int]:
+    """ Width of derivative asked for *width*, None keeps the width. """
+    if width is None:
+        return None
+    for candidate in WIDTHS:
+        if candidate >= width:
+            return candidate
+    return WIDTHS[-1]
+
+
+def derivative_name(width: Optional[int], fmt: str) -> str:
+    return f'w{width or 0}.{fmt}'
+
+
+def _derive(src: str, dst: str, width: Optional[int], fmt: str):
+    # run in worker process, first frame of animations only
+    pil_format, _, options = FORMATS[fmt]
+    with Image.open(src) as image:
+        image.seek(0)
+        if width is not None and image.width > width:
+            image = image.resize(
+                (width, max(round(image.height * width / image.width), 1)),
+                Image.LANCZOS,
+                reducing_gap=3.0)
+        if pil_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        elif image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+            image = image.convert('RGBA')
+        image.save(dst, pil_format, **options)
+
+
+def _timed(func: Callable, *args) -> Tuple[Any, float, float]:
+    # run in worker process, result, start time and seconds taken
+    started, counter = time(), perf_counter()
+    return func(*args), started, perf_counter() - counter
+
+
+class _RecordingContext(object):
+    """ Spawn context keeping the processes it creates, so that workers of
+    an executor can be terminated.
+    """
+    def __init__(self) -> None:
+        # forked workers would inherit threads and the event loop
+        self._context = get_context('spawn')
+        self.processes: List[BaseProcess] = []
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._context, name)
+
+    def Process(self, *args, **kwargs) -> BaseProcess:
+        process = self._context.Process(*args, **kwargs)
+        self.processes.append(process)
+        return process
+
+
+class ProcessPool(object):
+    """ Pool of *processes* spawned workers, running as many jobs at once
+    and queueing the others. Jobs running over *timeout* seconds raise
+    TimeoutError, the workers are killed then and the other jobs running
+    in them are run again once.
+
+    Seconds jobs waited in queue and ran are recorded, see "metrics", and
+    logged every "METRICS_INTERVAL" seconds.
+    """
+    def __init__(self,
+                 name: str,
+                 processes: int,
+                 timeout: float = None) -> None:
+        self.name = name
+        self.processes = processes
+        self.timeout = timeout
+        self._executor: ProcessPoolExecutor = None
+        # executor -> context its workers are created by
+        self._contexts: Dict[ProcessPoolExecutor, _RecordingContext] = {}
+        self._slots = asyncio.Semaphore(processes)
+        self.jobs = self.timeouts = self.failures = 0
+        self.queue_time = self.run_time = 0.0
+        self.max_queue_time = self.max_run_time = 0.0
+        self._logged = time()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            context = _RecordingContext()
+            self._executor = ProcessPoolExecutor(max_workers=self.processes,
+                                                 mp_context=context)
+            self._contexts[self._executor] = context
+        return self._executor
+
+    def _kill(self, executor: ProcessPoolExecutor):
+        if executor is self._executor:
+            self._executor = None
+        # executor cannot stop running jobs, workers are terminated
+        context = self._contexts.pop(executor, None)
+        for process in context.processes if context else ():
+            if process.is_alive():
+                process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    async def run(self, func: Callable, *args) -> Any:
+        """ Result of *func* called with *args* in a worker, both of them
+        should be picklable.
+        """
+        submitted = time()
+        async with self._slots:
+            for attempt in range(2):
+                executor = self._get_executor()
+                try:
+                    result, started, run_time = await asyncio.wait_for(
+                        asyncio.get_running_loop().run_in_executor(
+                            executor, _timed, func, *args), self.timeout)
+                    break
+                except asyncio.TimeoutError:
+                    self.timeouts += 1
+                    self._kill(executor)
+                    logger.warning(f'Kill {self.name} workers, job timed '
+                                   f'out after {self.timeout} seconds.')
+                    raise
+                except BrokenProcessPool:
+                    if attempt == 0 and executor is not self._executor:
+                        # killed by timeout of other job
+                        continue
+                    self.failures += 1
+                    self._kill(executor)
+                    raise
+                except Exception:
+                    self.failures += 1
+                    raise
+        queue_time = max(started - submitted, 0.0)
+        self.jobs += 1
+        self.queue_time += queue_time
+        self.run_time += run_time
+        self.max_queue_time = max(self.max_queue_time, queue_time)
+        self.max_run_time = max(self.max_run_time, run_time)
+        logger.debug(f'{self.name.capitalize()} job queued {queue_time:.3f} '
+                     f'seconds, ran {run_time:.3f} seconds.')
+        if time() - self._logged >= METRICS_INTERVAL:
+            self._logged = time()
+            logger.info(f'{self.name.capitalize()} pool metrics: ' +
+                        ', '.join(f'{key} {value:g}'
+                                  for key, value in self.metrics().items()))
+        return result
+
+    def metrics(self) -> Dict[str, Union[int, float]]:
+        return {
+            'jobs': self.jobs,
+            'timeouts': self.timeouts,
+            'failures': self.failures,
+            'queue_time': self.queue_time,
+            'run_time': self.run_time,
+            'max_queue_time': self.max_queue_time,
+            'max_run_time': self.max_run_time,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._contexts.pop(self._executor, None)
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+derivative_pool = ProcessPool('derivative', imaging.processes)
+transcode_pool = ProcessPool('transcode', imaging.transcode_processes,
+                             imaging.transcode_timeout)
+
+
+async def derive(src: str, dst: str, width: Optional[int], fmt: str):
+    """ Write image *src* to *dst* as *fmt*, scaled down to *width* if it
+    is wider.
+    """
+    await derivative_pool.run(_derive, src, dst, width, fmt)
+
+
+def _zip_to_gif(src: Union[str, bytes], frames: List[Tuple[str, int]],
+                output: Optional[str]) -> Optional[bytes]:
+    # run in worker process, delays of GIF are in milliseconds as well
+    from zipfile import ZipFile
+    images = []
+    durations = []
+    with ZipFile(BytesIO(src) if isinstance(src, bytes) else src) as zf:
+        for name, delay in frames:
+            durations.append(delay)
+            with zf.open(name) as f:
+                with Image.open(f) as image:
+                    images.append(image.convert('RGB'))
+    buffer = BytesIO() if output is None else output
+    images[0].save(buffer,
+                   'GIF',
+                   save_all=True,
+                   append_images=images[1:],
+                   duration=durations,
+                   loop=0)
+    return buffer.getvalue() if output is None else None
+
+
+async def zip_to_gif(src: Union[str, bytes],
+                     frames: Iterable[Tuple[str, int]],
+                     output: str = None) -> Optional[bytes]:
+    """ GIF of frames in zip archive, a file or bytes, written to *output*
+    if given. *frames* are names of images in archive and their delays in
+    milliseconds.
+    """
+    return await transcode_pool.run(_zip_to_gif, src, list(frames), output)
+
+
+def metrics() -> Dict[str, Dict[str, Union[int, float]]]:
+    return {
+        pool.name: pool.metrics()
+        for pool in (derivative_pool, transcode_pool)
+    }
+
+
+def shutdown():
+    derivative_pool.shutdown()
+    transcode_pool.shutdown()
+
+
+__all__ = ('WIDTHS', 'FORMATS', 'ProcessPool', 'derivative_pool',
+           'transcode_pool', 'derivative_width', 'derivative_name', 'derive',
+           'zip_to_gif', 'metrics', 'shutdown')
@@ -1,19 +1,38 @@
+from datetime import date, datetime, time
+from functools import partial
+from typing import Any, Callable, Dict, Iterable, List, Optional, Type, \
+    Union, get_args, get_origin
 from pydantic import BaseModel
-from utils.database import Base
+from pydantic.fields import SHAPE_LIST, SHAPE_SINGLETON
+from sqlalchemy.orm.exc import DetachedInstanceError
+from utils.database import Base, pure_instance
+from utils.database.projection import _nested_model, _split_fields, \
+    traversal_plan
 
 
 class BaseModel(BaseModel):
     class Config:
         orm_mode = True
+        # depth of relationships followed while copying sa instances
+        orm_max_depth = 4
 
     @classmethod
     def modify_single_instance(cls, obj):
         pass
 
-    @staticmethod
-    def ensure_pure_instance(obj):
+    @classmethod
+    def orm_getters(cls) -> Dict[str, Callable[[Any], Any]]:
+        """ Getters of fields reading sa instance directly, they should
+        give what "modify_single_instance" gives, see "orm_encoder".
+        """
+        return {}
+
+    @classmethod
+    def ensure_pure_instance(cls, obj):
         if isinstance(obj, Base):
-            obj = obj._pure_instance
+            obj = pure_instance(obj,
+                                plan=traversal_plan(cls),
+                                max_depth=cls.__config__.orm_max_depth)
         return obj
 
     @classmethod
@@ -26,3 +45,152 @@ class BaseModel(BaseModel):
             obj = cls.ensure_pure_instance(obj)
             cls.modify_single_instance(obj)
         return super().from_orm(obj)
+
+
+def _include(model: Type[BaseModel], fields: Iterable[str]) -> dict:
+    top, nested = _split_fields(fields)
+    include = {}
+    for name in top:
+        if (field := model.__fields__.get(name)) is None:
+            continue
+        nested_model = _nested_model(field)
+        if name not in nested or nested_model is None:
+            include[name] = ...
+        elif field.shape == SHAPE_SINGLETON and field.sub_fields is None:
+            include[name] = _include(nested_model, nested[name])
+        elif field.shape == SHAPE_LIST:
+            include[name] = {'__all__': _include(nested_model, nested[name])}
+        else:
+            # unions of a model and list of it are kept whole
+            include[name] = ...
+    return include
+
+
+def include_fields(response_model: Any,
+                   fields: Iterable[str]) -> Optional[dict]:
+    """ "include" of *response_model*, a model or list of models, keeping
+    *fields* only. Dotted names select fields of nested models, return None
+    if *response_model* is not supported.
+    """
+    if get_origin(response_model) in (list, List):
+        response_model = get_args(response_model)[0]
+    if isinstance(response_model, type) and \
+            issubclass(response_model, BaseModel):
+        return _include(response_model, fields)
+    return None
+
+
+def _unknown(model: Type[BaseModel], fields: Iterable[str]) -> List[str]:
+    top, nested = _split_fields(fields)
+    unknown = []
+    for name in sorted(top):
+        if (field := model.__fields__.get(name)) is None:
+            unknown.append(name)
+        elif name in nested:
+            if (nested_model := _nested_model(field)) is None:
+                names = sorted(nested[name])
+            else:
+                names = _unknown(nested_model, nested[name])
+            unknown.extend(f'{name}.{sub}' for sub in names)
+    return unknown
+
+
+def unknown_fields(response_model: Any, fields: Iterable[str]) -> List[str]:
+    """ Names in *fields* that are not fields of *response_model*, a model
+    or list of models, see "include_fields".
+    """
+    if get_origin(response_model) in (list, List):
+        response_model = get_args(response_model)[0]
+    if isinstance(response_model, type) and \
+            issubclass(response_model, BaseModel):
+        return _unknown(response_model, fields)
+    return []
+
+
+def orm_attr(obj, name: str):
+    # unloaded attribute of detached instance is None, as "pure_instance"
+    try:
+        return getattr(obj, name)
+    except DetachedInstanceError:
+        return None
+
+
+def _jsonable(value):
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    elif isinstance(value, list):
+        return [_jsonable(item) for item in value]
+    return value
+
+
+_orm_encoders: Dict[Type[BaseModel], Callable[[Any], dict]] = {}
+
+
+def orm_encoder(model: Type[BaseModel]) -> Callable[[Any], dict]:
+    """ Compile *model* into a function from sa instance to the jsonable
+    dict FastAPI builds from "model.from_orm", without validation.
+    """
+    if model in _orm_encoders:
+        return _orm_encoders[model]
+    fields = []
+
+    def encode(obj) -> dict:
+        data = {}
+        for key, getter, nested in fields:
+            value = getter(obj)
+            if nested is None:
+                data[key] = _jsonable(value)
+            elif isinstance(value, list):
+                data[key] = [nested(item) for item in value]
+            elif value is None:
+                data[key] = None
+            else:
+                data[key] = nested(value)
+        return data
+
+    # registered before compiling fields for self-referencing models
+    _orm_encoders[model] = encode
+    getters = model.orm_getters() if issubclass(model, BaseModel) else {}
+    for name, field in model.__fields__.items():
+        nested_model = _nested_model(field)
+        fields.append((
+            field.alias,
+            getters.get(name, partial(orm_attr, name=name)),
+            orm_encoder(nested_model) if nested_model else None,
+        ))
+    return encode
+
+
+def orm_response_encoder(
+        response_model: Any) -> Optional[Callable[[Any], Any]]:
+    """ Encoder of sa instances for *response_model* of a route.
+
+    Support models, lists of models and unions of them. Return None if
+    *response_model* is not supported, the encoder returns NotImplemented
+    for content that is not sa instances.
+    """
+    single = many = None
+    if get_origin(response_model) is Union:
+        candidates = get_args(response_model)
+    else:
+        candidates = (response_model, )
+    for candidate in candidates:
+        if isinstance(candidate, type) and issubclass(candidate, BaseModel):
+            single = candidate
+        elif get_origin(candidate) in (list, List):
+            args = get_args(candidate)
+            if args and isinstance(args[0], type) and \
+                    issubclass(args[0], BaseModel):
+                many = args[0]
+    if single is None and many is None:
+        return None
+
+    def encode(content):
+        if single is not None and isinstance(content, Base):
+            return orm_encoder(single)(content)
+        elif many is not None and isinstance(content, list) and all(
+                isinstance(item, Base) for item in content):
+            return list(map(orm_encoder(many), content))
+        return NotImplemented
+
+    return encode
@@ -1 +1,11 @@
 # Local file system data helper
+from utils import config
+from .backend import StorageBackend, S3Backend, LocalBackend
+
+if config.storage.backend == 'local':
+    storage_backend: StorageBackend = LocalBackend(config.storage.local_root,
+                                                   config.storage.url_prefix)
+else:
+    storage_backend: StorageBackend = S3Backend(config.s3.api_bucket)
+
+__all__ = ('StorageBackend', 'S3Backend', 'LocalBackend', 'storage_backend')
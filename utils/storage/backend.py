@@ -0,0 +1,201 @@
+"""
+Storages of files transferred by apps, selected by "storage.backend".
+
+Files are referred by keys like "pixiv/1_p0.jpg". The S3 backend keeps them
+in "s3.api_bucket". The local backend keeps each content once, named by its
+sha256 digest in directories sharded by the leading bytes of it, and keys
+refer to contents by small files. Local files are served by the app under
+"storage.url_prefix".
+"""
+import os
+import re
+from hashlib import sha256
+from pathlib import Path
+from typing import AsyncIterable, AsyncIterator, Optional, Union
+from uuid import uuid4
+import aiofiles
+from utils.syncutils import run_sync
+from . import s3
+
+CHUNK_SIZE = 1 << 16
+
+Source = Union[str, bytes, AsyncIterable[bytes]]
+
+
+class StorageBackend(object):
+    async def init(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def put(self,
+                  src: Source,
+                  key: str,
+                  public_read: bool = False,
+                  resumable: bool = True) -> bool:
+        """ Put file path, bytes or chunks *src* as *key*. """
+        raise NotImplementedError
+
+    async def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    async def has(self, key: str) -> bool:
+        raise NotImplementedError
+
+    async def url(self, key: str) -> str:
+        """ Url of *key*, empty if it cannot be given. """
+        raise NotImplementedError
+
+    def stream(self, key: str) -> AsyncIterator[bytes]:
+        """ Chunks of *key*, raise FileNotFoundError if it is missing. """
+        raise NotImplementedError
+
+
+class S3Backend(StorageBackend):
+    def __init__(self, bucket: str) -> None:
+        self.bucket = bucket
+
+    def _path(self, key: str) -> str:
+        return f'/{self.bucket}/{key.lstrip("/")}'
+
+    async def init(self):
+        await s3.init()
+
+    async def shutdown(self):
+        await s3.shutdown()
+
+    async def put(self,
+                  src: Source,
+                  key: str,
+                  public_read: bool = False,
+                  resumable: bool = True) -> bool:
+        if isinstance(src, (str, bytes)):
+            return await s3.put(src,
+                                self._path(key),
+                                public_read=public_read,
+                                resumable=resumable)
+        return await s3.put_stream(src,
+                                   self._path(key),
+                                   public_read=public_read)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await s3.get(self._path(key)) or None
+
+    async def has(self, key: str) -> bool:
+        return await s3.has(self._path(key))
+
+    async def url(self, key: str) -> str:
+        return await s3.url(self._path(key))
+
+    def stream(self, key: str) -> AsyncIterator[bytes]:
+        return s3.stream(self._path(key), CHUNK_SIZE)
+
+
+class LocalBackend(StorageBackend):
+    """ Files under *root*, every file is public. """
+    NAME = re.compile(r'^([0-9a-f]{64})(\.[0-9A-Za-z]+)?$')
+
+    def __init__(self, root: Path, url_prefix: str) -> None:
+        self.root = root
+        self.url_prefix = url_prefix.rstrip('/')
+
+    def object_path(self, name: str) -> Optional[Path]:
+        """ Path of content named "<digest><suffix>", None if *name* is
+        not such a name.
+        """
+        if (match := self.NAME.match(name)) is None:
+            return None
+        digest = match.group(1)
+        return self.root / 'objects' / digest[:2] / digest[2:4] / digest
+
+    def _ref(self, key: str) -> Path:
+        # resolved on file system, run off the event loop
+        refs = self.root / 'refs'
+        ref = (refs / key.strip('/')).resolve()
+        if refs.resolve() not in ref.parents:
+            raise ValueError(f'Invalid storage key "{key}".')
+        return ref
+
+    @staticmethod
+    def _store(temp: Path, path: Path):
+        # each content is kept once
+        if path.exists():
+            temp.unlink()
+        else:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(temp, path)
+
+    async def _name(self, key: str) -> Optional[str]:
+        try:
+            async with aiofiles.open(await run_sync(self._ref)(key), 'r') as f:
+                return await f.read()
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+
+    @staticmethod
+    async def _chunks(src: Source) -> AsyncIterator[bytes]:
+        if isinstance(src, bytes):
+            yield src
+        elif isinstance(src, str):
+            async with aiofiles.open(src, 'rb') as f:
+                while chunk := await f.read(CHUNK_SIZE):
+                    yield chunk
+        else:
+            async for chunk in src:
+                yield chunk
+
+    async def put(self,
+                  src: Source,
+                  key: str,
+                  public_read: bool = False,
+                  resumable: bool = True) -> bool:
+        ref = await run_sync(self._ref)(key)
+        temp = self.root / 'tmp' / uuid4().hex
+        await run_sync(temp.parent.mkdir)(parents=True, exist_ok=True)
+        digest = sha256()
+        try:
+            async with aiofiles.open(temp, 'wb') as f:
+                async for chunk in self._chunks(src):
+                    digest.update(chunk)
+                    await f.write(chunk)
+            name = digest.hexdigest() + Path(key).suffix.lower()
+            await run_sync(self._store)(temp, self.object_path(name))
+            await run_sync(ref.parent.mkdir)(parents=True, exist_ok=True)
+            async with aiofiles.open(temp, 'w') as f:
+                await f.write(name)
+            await run_sync(os.replace)(temp, ref)
+        except FileNotFoundError:
+            return False
+        finally:
+            await run_sync(temp.unlink)(missing_ok=True)
+        return True
+
+    async def get(self, key: str) -> Optional[bytes]:
+        if (name := await self._name(key)) is None:
+            return None
+        try:
+            async with aiofiles.open(self.object_path(name), 'rb') as f:
+                return await f.read()
+        except FileNotFoundError:
+            return None
+
+    async def has(self, key: str) -> bool:
+        name = await self._name(key)
+        return name is not None and await run_sync(
+            self.object_path(name).exists)()
+
+    async def url(self, key: str) -> str:
+        if (name := await self._name(key)) is None:
+            return ''
+        return f'{self.url_prefix}/{name}'
+
+    async def stream(self, key: str) -> AsyncIterator[bytes]:
+        if (name := await self._name(key)) is None:
+            raise FileNotFoundError(key)
+        async with aiofiles.open(self.object_path(name), 'rb') as f:
+            while chunk := await f.read(CHUNK_SIZE):
+                yield chunk
+
+
+__all__ = ('StorageBackend', 'S3Backend', 'LocalBackend')
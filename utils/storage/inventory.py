@@ -0,0 +1,198 @@
+"""
+Local inventory of objects in S3 buckets, so that existence of objects is
+tested without asking the server.
+
+Keys are kept in a SQLite file under the home directory shared by all
+workers, and each worker keeps a Bloom filter of them in memory, so that
+most keys never recorded are told without querying the file. Rows recorded
+by other workers are added to the filter once the file changes. A bucket is
+complete after "reconcile" rebuilt it from listings, for a complete bucket
+keys not recorded are known to be missing, otherwise they are unknown.
+
+Methods of "Inventory" block on the file and are thread safe, they should
+be run off the event loop.
+"""
+import sqlite3
+import threading
+from functools import wraps
+from hashlib import blake2b
+from pathlib import Path
+from typing import Iterable, Optional
+from constants import HOME_DIR
+
+INVENTORY_FILE = HOME_DIR / 's3_inventory.db'
+# 2MB filter, about 1% false positives with 1.7 million keys
+BLOOM_BITS = 1 << 24
+BLOOM_HASHES = 7
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    bucket TEXT NOT NULL,
+    key TEXT NOT NULL,
+    generation INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (bucket, key)
+);
+CREATE TABLE IF NOT EXISTS buckets (
+    bucket TEXT PRIMARY KEY,
+    generation INTEGER NOT NULL DEFAULT 0,
+    complete INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+class BloomFilter(object):
+    def __init__(self, bits: int = BLOOM_BITS,
+                 hashes: int = BLOOM_HASHES) -> None:
+        self.bits = bits
+        self.hashes = hashes
+        self._array = bytearray(bits // 8)
+
+    def _positions(self, item: str):
+        # double hashing, positions are h1 + i * h2
+        digest = blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.bits
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self._array[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._array[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(item))
+
+
+def _locked(func):
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return func(self, *args, **kwargs)
+
+    return wrapper
+
+
+class Inventory(object):
+    def __init__(self, file: Path = INVENTORY_FILE) -> None:
+        self.file = file
+        # connection and filter are shared by threads
+        self._lock = threading.RLock()
+        self._connection: sqlite3.Connection = None
+        self._bloom: BloomFilter = None
+        # greatest row id added to filter and "PRAGMA data_version" then
+        self._last_id = 0
+        self._data_version = None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self.file.parent.mkdir(parents=True, exist_ok=True)
+            self._connection = sqlite3.connect(self.file,
+                                               timeout=30,
+                                               check_same_thread=False)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('PRAGMA synchronous=NORMAL')
+            self._connection.executescript(_SCHEMA)
+        return self._connection
+
+    @_locked
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+            self._bloom = None
+            self._last_id = 0
+            self._data_version = None
+
+    def _refresh(self):
+        # version changes once other connections commit
+        version = self.connection.execute('PRAGMA data_version').fetchone()
+        if self._bloom is not None and version == self._data_version:
+            return
+        if self._bloom is None:
+            self._bloom = BloomFilter()
+        for row_id, bucket, key in self.connection.execute(
+                'SELECT id, bucket, key FROM objects WHERE id > ?',
+                (self._last_id, )):
+            self._bloom.add(f'{bucket}/{key}')
+            self._last_id = max(self._last_id, row_id)
+        self._data_version = version
+
+    @_locked
+    def complete(self, bucket: str) -> bool:
+        row = self.connection.execute(
+            'SELECT complete FROM buckets WHERE bucket = ?',
+            (bucket, )).fetchone()
+        return bool(row and row[0])
+
+    @_locked
+    def lookup(self, bucket: str, key: str) -> Optional[bool]:
+        """ Whether object of *key* is in *bucket*, None if unknown. """
+        self._refresh()
+        if f'{bucket}/{key}' in self._bloom:
+            row = self.connection.execute(
+                'SELECT 1 FROM objects WHERE bucket = ? AND key = ?',
+                (bucket, key)).fetchone()
+            if row is not None:
+                return True
+        return False if self.complete(bucket) else None
+
+    def add(self, bucket: str, key: str):
+        self.add_many(bucket, (key, ))
+
+    @_locked
+    def add_many(self, bucket: str, keys: Iterable[str]):
+        keys = list(keys)
+        with self.connection:
+            # keys take generation of bucket, see "end_reconcile"
+            self.connection.executemany(
+                'INSERT INTO objects (bucket, key, generation) VALUES (?, ?, '
+                '(SELECT coalesce(max(generation), 0) FROM buckets '
+                'WHERE bucket = ?)) ON CONFLICT (bucket, key) '
+                'DO UPDATE SET generation = excluded.generation',
+                [(bucket, key, bucket) for key in keys])
+        if self._bloom is not None:
+            for key in keys:
+                self._bloom.add(f'{bucket}/{key}')
+
+    @_locked
+    def discard(self, bucket: str, key: str):
+        # filter keeps the key, lookups of it query the file
+        with self.connection:
+            self.connection.execute(
+                'DELETE FROM objects WHERE bucket = ? AND key = ?',
+                (bucket, key))
+
+    @_locked
+    def begin_reconcile(self, bucket: str) -> int:
+        """ Start rebuilding *bucket*, return generation of its keys. """
+        with self.connection:
+            self.connection.execute(
+                'INSERT INTO buckets (bucket) VALUES (?) '
+                'ON CONFLICT (bucket) DO NOTHING', (bucket, ))
+            self.connection.execute(
+                'UPDATE buckets SET generation = generation + 1 '
+                'WHERE bucket = ?', (bucket, ))
+            return self.connection.execute(
+                'SELECT generation FROM buckets WHERE bucket = ?',
+                (bucket, )).fetchone()[0]
+
+    @_locked
+    def end_reconcile(self, bucket: str, generation: int) -> int:
+        """ Drop keys of *bucket* neither listed nor added since
+        "begin_reconcile" and mark it complete, return number of keys
+        dropped.
+        """
+        with self.connection:
+            dropped = self.connection.execute(
+                'DELETE FROM objects WHERE bucket = ? AND generation < ?',
+                (bucket, generation)).rowcount
+            self.connection.execute(
+                'UPDATE buckets SET complete = 1 WHERE bucket = ?',
+                (bucket, ))
+        return dropped
+
+
+__all__ = ('BloomFilter', 'Inventory')
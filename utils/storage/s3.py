@@ -1,19 +1,49 @@
 """
 Depend on aiobotocore.
 https://github.com/aio-libs/aiobotocore
+
+A client with a connection pool is shared by all calls of a worker between
+"init" and "shutdown", calls outside of them use a temporary client.
+
+ACL of objects put by this module is recorded on disk, so that "url" builds
+permanent urls of public objects without asking the server. Presigned urls
+are cached until shortly before they expire.
+
+Keys of objects put by this module are recorded in the local inventory, see
+"utils.storage.inventory", so that "has" asks the server only for keys the
+inventory does not know. "reconcile" rebuilds the inventory from listings
+and aborts multipart uploads interrupted before "UPLOAD_EXPIRE".
 """
 import asyncio
+import json
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
+from datetime import datetime, timedelta, timezone
 from logging import getLogger
 from pathlib import Path
 from functools import partial
-from math import ceil
-from typing import Literal, Tuple, Union
+from inspect import isawaitable
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable, Dict, \
+    List, Literal, Optional, Tuple, Union
+from urllib.parse import quote
+from aiobotocore.client import AioBaseClient
+from aiobotocore.config import AioConfig
 from aiobotocore.session import get_session
 import aiofiles
-from botocore.exceptions import ClientError
+from botocore.exceptions import BotoCoreError, ClientError
+from utils.cache import Cache
 from utils.config import s3
+from utils.syncutils import run_sync
+from .inventory import Inventory
 
 FILE_CHUNK_SIZE = 5 * 1024 * 1024  # minimum size: 5MB
+# parts of a multipart upload being read or uploaded at once
+UPLOAD_PARTS = 3
+# attempts to upload each part, waiting twice as long before each retry
+PART_RETRIES = 3
+PART_RETRY_DELAY = 1
+# seconds an interrupted multipart upload is kept for resuming
+UPLOAD_EXPIRE = 7 * 24 * 3600
 
 ENDPOINT_URL = s3.endpoint_url
 AWS_ACCESS_KEY_ID = s3.aws_access_key_id
@@ -27,17 +57,74 @@ _create_client = partial(
     endpoint_url=ENDPOINT_URL,
     aws_access_key_id=AWS_ACCESS_KEY_ID,
     aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+    config=AioConfig(max_pool_connections=s3.max_pool_connections),
 )
+_client: AioBaseClient = None
+_exit_stack: AsyncExitStack = None
 
-_part_info = {'Parts': []}
+
+PUBLIC_ACLS = ('public-read', 'public-read-write')
+# seconds before expiration a cached presigned url is renewed at most
+PRESIGNED_URL_MARGIN = 300
+
+# (bucket, quoted key) -> ACL of object
+_acl_cache = Cache('s3_acl', maxsize=4096)
+# (bucket, quoted key, expiration) -> presigned url, in memory only
+_presigned_cache = Cache('s3_presigned', maxsize=1024)
+# (bucket, quoted key) -> state of resumable upload, see "MultipartUpload"
+_upload_cache = Cache('s3_uploads', maxsize=64)
+_inventory = Inventory()
 
 logger = getLogger('api_ethpch')
 
 
+async def init():
+    """ Create the client shared until "shutdown". """
+    global _client, _exit_stack
+    if _client is None:
+        _exit_stack = AsyncExitStack()
+        _client = await _exit_stack.enter_async_context(_create_client())
+        logger.info('S3 client startup accomplished.')
+
+
+async def shutdown():
+    global _client, _exit_stack
+    if _client is not None:
+        _client = None
+        await _exit_stack.aclose()
+        _exit_stack = None
+        _inventory.close()
+        logger.info('S3 client shutdown accomplished.')
+
+
+@asynccontextmanager
+async def _use_client() -> AsyncIterator[AioBaseClient]:
+    if _client is not None:
+        yield _client
+    else:
+        async with _create_client() as client:
+            yield client
+
+
+async def _record_object(bucket: str, key: str, acl: Optional[str]):
+    # ACL and existence of object, None forgets the object
+    if acl is None:
+        _acl_cache.delete((bucket, quote(key, safe='')))
+        await run_sync(_inventory.discard)(bucket, key)
+    else:
+        _acl_cache.set((bucket, quote(key, safe='')), acl.encode())
+        await run_sync(_inventory.add)(bucket, key)
+
+
+def _recorded_acl(bucket: str, key: str) -> Optional[str]:
+    acl = _acl_cache.get((bucket, quote(key, safe='')))
+    return acl.decode() if acl is not None else None
+
+
 # s3cmd-style apis
 async def mb(bucket: str) -> bool:
     """ Make bucket """
-    async with _create_client() as client:
+    async with _use_client() as client:
         try:
             await client.create_bucket(Bucket=bucket)
             logger.info(f'Make bucket "{bucket}".')
@@ -48,7 +135,7 @@ async def mb(bucket: str) -> bool:
 
 async def rb(bucket: str) -> bool:
     """ Remove bucket """
-    async with _create_client() as client:
+    async with _use_client() as client:
         try:
             await client.delete_bucket(Bucket=bucket)
             logger.info(f'Remove bucket "{bucket}".')
@@ -57,220 +144,394 @@ async def rb(bucket: str) -> bool:
     return True
 
 
+async def iter_objects(bucket: str, prefix: str = '') -> AsyncIterator[dict]:
+    """ Iterate over all objects in *bucket* under *prefix*, one page of
+    listing is requested at once
+    """
+    async with _use_client() as client:
+        paginator = client.get_paginator('list_objects_v2')
+        async for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            for item in page.get('Contents', ()):
+                yield item
+
+
+async def _buckets() -> List[str]:
+    async with _use_client() as client:
+        return [
+            item['Name'] for item in (await client.list_buckets())['Buckets']
+        ]
+
+
 async def ls(path: str = None) -> Tuple[str]:
     """ List objects or buckets """
-    async with _create_client() as client:
-        if path is None:
-            resp = await client.list_buckets()
-            logger.info('List all buckets.')
-            return tuple([item['Name'] for item in resp['Buckets']])
-        else:
-            _ = path.strip('/').split('/')
-            kws = {'Bucket': _[0]}
-            if len(_) > 1:
-                kws.update({'Prefix': '/'.join(_[1:])})
-            try:
-                resp = await client.list_objects(**kws)
-                logger.info(f'List objects in "{path}".')
-                return tuple([
-                    f'/{_[0]}/' + item['Key'] for item in resp['Contents']
-                ]) if 'Contents' in resp.keys() else ()
-            except ClientError:
-                return ()
+    if path is None:
+        logger.info('List all buckets.')
+        return tuple(await _buckets())
+    else:
+        _ = path.strip('/').split('/')
+        try:
+            ret = tuple([
+                f'/{_[0]}/' + item['Key']
+                async for item in iter_objects(_[0], '/'.join(_[1:]))
+            ])
+            logger.info(f'List objects in "{path}".')
+            return ret
+        except ClientError:
+            return ()
 
 
 async def la() -> Tuple[str]:
     """ List all objects in all buckets """
     li = []
-    async with _create_client() as client:
-        for bucket in (await client.list_buckets())['Buckets']:
-            _ = await client.list_objects(Bucket=bucket['Name'])
-            for item in _['Contents']:
-                if item['Key'].endswith('/') is False:
-                    li.append(bucket['Name'] + '/' + item['Key'])
+    for bucket in await _buckets():
+        async for item in iter_objects(bucket):
+            if item['Key'].endswith('/') is False:
+                li.append(bucket + '/' + item['Key'])
     logger.info('List all objects in all buckets.')
     return tuple(li)
 
 
+class MultipartUpload(object):
+    """ Multipart upload of an object, uploading "UPLOAD_PARTS" parts at
+    once and retrying each of them "PART_RETRIES" times.
+
+    If *source* identifies the content, upload id and uploaded parts are
+    recorded, an upload of the same content interrupted before resumes
+    with the parts missing.
+    """
+    def __init__(self,
+                 client: AioBaseClient,
+                 bucket: str,
+                 key: str,
+                 acl: str,
+                 source: str = None) -> None:
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.acl = acl
+        self.source = source
+        self.upload_id: Optional[str] = None
+        # time.time() the upload was created at
+        self.started: Optional[float] = None
+        # part number -> ETag
+        self.parts: Dict[int, str] = {}
+        self._slots = asyncio.Semaphore(UPLOAD_PARTS)
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def _state_key(self) -> Tuple[str, str]:
+        return self.bucket, quote(self.key, safe='')
+
+    def _save(self):
+        if self.source is not None:
+            _upload_cache.set(
+                self._state_key,
+                json.dumps({
+                    'source': self.source,
+                    'upload_id': self.upload_id,
+                    'started': self.started,
+                    'parts': self.parts,
+                }).encode())
+
+    async def _resume(self) -> bool:
+        if self.source is None or \
+                (state := _upload_cache.get(self._state_key)) is None:
+            return False
+        state = json.loads(state)
+        if state['source'] != self.source or \
+                time.time() - state.get('started', 0) > UPLOAD_EXPIRE:
+            # content changed or upload likely expired on server
+            await _abort_upload(self.client, self.bucket, self.key,
+                                state['upload_id'])
+            return False
+        try:
+            # parts listed by server are the ones surely uploaded
+            paginator = self.client.get_paginator('list_parts')
+            async for page in paginator.paginate(
+                    Bucket=self.bucket,
+                    Key=self.key,
+                    UploadId=state['upload_id']):
+                for part in page.get('Parts', ()):
+                    self.parts[part['PartNumber']] = part['ETag']
+        except ClientError:
+            # completed, aborted or expired
+            self.parts.clear()
+            return False
+        self.upload_id = state['upload_id']
+        self.started = state['started']
+        logger.info(f'Resume upload of "/{self.bucket}/{self.key}" with '
+                    f'{len(self.parts)} parts uploaded.')
+        return True
+
+    async def start(self):
+        if not await self._resume():
+            self.upload_id = (await self.client.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key,
+                ACL=self.acl))['UploadId']
+            self.started = time.time()
+            self._save()
+
+    async def _upload(self, part_number: int,
+                      read: Callable[[], Union[bytes, Awaitable[bytes]]]):
+        try:
+            data = read()
+            if isawaitable(data):
+                data = await data
+            for attempt in range(PART_RETRIES):
+                try:
+                    resp = await self.client.upload_part(
+                        Bucket=self.bucket,
+                        Key=self.key,
+                        UploadId=self.upload_id,
+                        Body=data,
+                        PartNumber=part_number,
+                    )
+                    break
+                except (ClientError, BotoCoreError) as e:
+                    if attempt + 1 == PART_RETRIES:
+                        raise
+                    logger.warning(f'Retry part {part_number} of '
+                                   f'"/{self.bucket}/{self.key}": {e}')
+                    await asyncio.sleep(PART_RETRY_DELAY * 2**attempt)
+            self.parts[part_number] = resp['ETag']
+            self._save()
+        finally:
+            self._slots.release()
+
+    async def add(self, part_number: int,
+                  read: Callable[[], Union[bytes, Awaitable[bytes]]]):
+        """ Upload part of *part_number* read by *read* once a slot is
+        free, parts uploaded before are skipped.
+        """
+        if part_number in self.parts:
+            return
+        for task in self._tasks:
+            if task.done() and task.exception() is not None:
+                raise task.exception()
+        await self._slots.acquire()
+        self._tasks.append(
+            asyncio.create_task(self._upload(part_number, read)))
+
+    async def complete(self):
+        await asyncio.gather(*self._tasks)
+        await self.client.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            MultipartUpload={
+                'Parts': [{
+                    'PartNumber': number,
+                    'ETag': self.parts[number]
+                } for number in sorted(self.parts)]
+            })
+        if self.source is not None:
+            _upload_cache.delete(self._state_key)
+
+    async def cancel(self):
+        """ Stop uploading, abort the upload unless it can resume. """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self.source is None and self.upload_id is not None:
+            await _abort_upload(self.client, self.bucket, self.key,
+                                self.upload_id)
+
+
+async def _abort_upload(client: AioBaseClient, bucket: str, key: str,
+                        upload_id: str):
+    # recorded state of the upload is dropped as well
+    try:
+        await client.abort_multipart_upload(Bucket=bucket,
+                                            Key=key,
+                                            UploadId=upload_id)
+    except ClientError:
+        pass
+    state_key = bucket, quote(key, safe='')
+    if (state := _upload_cache.get(state_key)) is not None and \
+            json.loads(state)['upload_id'] == upload_id:
+        _upload_cache.delete(state_key)
+
+
+async def _abort_stale_uploads(bucket: str) -> int:
+    # multipart uploads started before "UPLOAD_EXPIRE", return number of them
+    expire = datetime.now(timezone.utc) - timedelta(seconds=UPLOAD_EXPIRE)
+    count = 0
+    async with _use_client() as client:
+        paginator = client.get_paginator('list_multipart_uploads')
+        async for page in paginator.paginate(Bucket=bucket):
+            for upload in page.get('Uploads', ()):
+                if upload['Initiated'] < expire:
+                    await _abort_upload(client, bucket, upload['Key'],
+                                        upload['UploadId'])
+                    count += 1
+    return count
+
+
+async def _read_part(file: Path, offset: int) -> bytes:
+    async with aiofiles.open(file, 'rb') as f:
+        await f.seek(offset)
+        return await f.read(FILE_CHUNK_SIZE)
+
+
+async def _put_parts(
+    client: AioBaseClient,
+    bucket: str,
+    key: str,
+    acl: str,
+    parts: AsyncIterable[Tuple[int, Callable]],
+    source: str = None,
+) -> bool:
+    upload = MultipartUpload(client, bucket, key, acl, source=source)
+    try:
+        await upload.start()
+        async for part_number, read in parts:
+            await upload.add(part_number, read)
+        await upload.complete()
+    except Exception as e:
+        await upload.cancel()
+        if isinstance(e, (ClientError, BotoCoreError)):
+            logger.warning(f'Cannot put "/{bucket}/{key}": {e}')
+            return False
+        raise
+    return True
+
+
+async def _file_parts(file: Path,
+                      size: int) -> AsyncIterator[Tuple[int, Callable]]:
+    for offset in range(0, size, FILE_CHUNK_SIZE):
+        yield offset // FILE_CHUNK_SIZE + 1, partial(_read_part, file, offset)
+
+
+async def _bytes_parts(src: bytes) -> AsyncIterator[Tuple[int, Callable]]:
+    view = memoryview(src)
+    for offset in range(0, len(src), FILE_CHUNK_SIZE):
+        yield offset // FILE_CHUNK_SIZE + 1, \
+            view[offset:offset + FILE_CHUNK_SIZE].tobytes
+
+
 async def put(src: Union[str, bytes],
               dst: str,
               replace: bool = True,
-              public_read: bool = False) -> bool:
-    """ Put file into bucket """
+              public_read: bool = False,
+              resumable: bool = True) -> bool:
+    """ Put file into bucket, interrupted upload of large file resumes
+    unless not *resumable*
+    """
     if replace is False and await has(dst) is True:
         return True
     _ = dst.strip('/').split('/')
     bucket = _[0]
     key = '/'.join(_[1:])
-    # about multipart upload, see
-    # https://skonik.me/uploading-large-file-to-s3-using-aiobotocore/
+    acl = 'public-read' if public_read else 'private'
     if isinstance(src, str) is True:
         file = Path(src).resolve()
         if dst.endswith('/'):
             key = key + '/' + file.name
         try:
-            async with _create_client() as client, \
-                    aiofiles.open(file, 'rb') as f:
-                if file.stat().st_size <= FILE_CHUNK_SIZE:  # 5MB small file
-                    await client.put_object(
-                        Bucket=bucket,
-                        Key=key,
-                        Body=await f.read(),
-                        ACL='public-read' if public_read else 'private')
-                    logger.info(f'Put object "{src}" to "{dst}".')
-                    return True
-                else:  # large file upload, using multipart
-                    src_size = file.stat().st_size
-                    chunks_count = ceil(src_size / FILE_CHUNK_SIZE)
-                    create_mp_upload_resp = \
-                        await client.create_multipart_upload(
-                            Bucket=bucket,
-                            Key=key,
-                            ACL='public-read' if public_read else 'private')
-                    upload_id = create_mp_upload_resp['UploadId']
-                    tasks = []
-
-                    async def upload_chunk(client, file, upload_id,
-                                           chunk_number, src_size, bucket,
-                                           key):
-                        offset = chunk_number * FILE_CHUNK_SIZE
-                        remaining_bytes = src_size - offset
-                        bytes_to_read = min((FILE_CHUNK_SIZE, remaining_bytes))
-                        part_number = chunk_number + 1
-
-                        file.seek(offset)
-                        data = await file.read(bytes_to_read)
-                        resp = await client.upload_part(
-                            Bucket=bucket,
-                            Key=key,
-                            UploadId=upload_id,
-                            Body=data,
-                            PartNumber=part_number,
-                        )
-                        global _part_info
-                        _part_info['Parts'].append({
-                            'PartNumber': part_number,
-                            'ETag': resp['ETag']
-                        })
-
-                    for chunk_number in range(chunks_count):
-                        tasks.append(
-                            upload_chunk(
-                                client=client,
-                                file=f,
-                                upload_id=upload_id,
-                                chunk_number=chunk_number,
-                                src_size=src_size,
-                                bucket=bucket,
-                                key=key,
-                            ))
-                    await asyncio.gather(*tasks)
-
-                    list_parts_resp = await client.list_parts(
-                        Bucket=bucket, Key=key, UploadId=upload_id)
-
-                    part_list = sorted(_part_info['Parts'],
-                                       key=lambda k: k['PartNumber'])
-                    _part_info['Parts'] = part_list
-
-                    if len(list_parts_resp['Parts']) == chunks_count:
-                        await client.complete_multipart_upload(
-                            Bucket=bucket,
-                            Key=key,
-                            UploadId=upload_id,
-                            MultipartUpload=_part_info)
-                        logger.info(f'Put object "{src}" to "{dst}".')
-                        return True
-                    else:
-                        await client.abort_multipart_upload(
-                            Bucket=bucket,
-                            Key=key,
-                            UploadId=upload_id,
-                        )
-                        return False
+            stat = file.stat()
+            async with _use_client() as client:
+                if stat.st_size <= FILE_CHUNK_SIZE:  # 5MB small file
+                    async with aiofiles.open(file, 'rb') as f:
+                        body = await f.read()
+                    await client.put_object(Bucket=bucket,
+                                            Key=key,
+                                            Body=body,
+                                            ACL=acl)
+                elif not await _put_parts(
+                        client,
+                        bucket,
+                        key,
+                        acl,
+                        _file_parts(file, stat.st_size),
+                        source=f'{file}:{stat.st_size}:{stat.st_mtime_ns}:'
+                        f'{FILE_CHUNK_SIZE}' if resumable else None):
+                    return False
         except (ClientError, FileNotFoundError):
             return False
+        await _record_object(bucket, key, acl)
+        logger.info(f'Put object "{src}" to "{dst}".')
+        return True
     elif isinstance(src, bytes) is True:
         if dst.endswith('/'):
             key = key + '/'
         try:
-            async with _create_client() as client:
+            async with _use_client() as client:
                 if (src_size := len(src)) <= FILE_CHUNK_SIZE:
-                    await client.put_object(
-                        Bucket=bucket,
-                        Key=key,
-                        Body=src,
-                        ACL='public-read' if public_read else 'private')
-                    logger.info(f'Put {src_size} bytes to "{dst}".')
-                    return True
-                else:
-                    chunks_count = ceil(src_size / FILE_CHUNK_SIZE)
-
-                    create_mp_upload_resp = \
-                        await client.create_multipart_upload(
-                            Bucket=bucket,
-                            Key=key,
-                            ACL='public-read' if public_read else 'private')
-                    upload_id = create_mp_upload_resp['UploadId']
-                    tasks = []
-
-                    async def upload_chunk(client, file, upload_id,
-                                           chunk_number, bucket, key):
-                        offset = chunk_number * FILE_CHUNK_SIZE
-                        part_number = chunk_number + 1
-
-                        data = file[offset:offset + FILE_CHUNK_SIZE]
-                        resp = await client.upload_part(
-                            Bucket=bucket,
-                            Key=key,
-                            UploadId=upload_id,
-                            Body=data,
-                            PartNumber=part_number,
-                        )
-                        global _part_info
-                        _part_info['Parts'].append({
-                            'PartNumber': part_number,
-                            'ETag': resp['ETag']
-                        })
-
-                    for chunk_number in range(chunks_count):
-                        tasks.append(
-                            upload_chunk(
-                                client=client,
-                                file=src,
-                                upload_id=upload_id,
-                                chunk_number=chunk_number,
-                                bucket=bucket,
-                                key=key,
-                            ))
-                    await asyncio.gather(*tasks)
-
-                    list_parts_resp = await client.list_parts(
-                        Bucket=bucket, Key=key, UploadId=upload_id)
-
-                    part_list = sorted(_part_info['Parts'],
-                                       key=lambda k: k['PartNumber'])
-                    _part_info['Parts'] = part_list
-
-                    if len(list_parts_resp['Parts']) == chunks_count:
-                        await client.complete_multipart_upload(
-                            Bucket=bucket,
-                            Key=key,
-                            UploadId=upload_id,
-                            MultipartUpload=_part_info)
-                        logger.info(f'Put {src_size} bytes to "{dst}".')
-                        return True
-                    else:
-                        await client.abort_multipart_upload(
-                            Bucket=bucket,
-                            Key=key,
-                            UploadId=upload_id,
-                        )
-                        return False
+                    await client.put_object(Bucket=bucket,
+                                            Key=key,
+                                            Body=src,
+                                            ACL=acl)
+                elif not await _put_parts(client, bucket, key, acl,
+                                          _bytes_parts(src)):
+                    return False
         except ClientError:
             return False
         finally:
             del src  # release memory
+        await _record_object(bucket, key, acl)
+        logger.info(f'Put {src_size} bytes to "{dst}".')
+        return True
+
+
+def _held_part(data: bytearray) -> bytearray:
+    return data
+
+
+async def _stream_parts(
+    chunks: AsyncIterable[bytes],
+    part: bytearray,
+) -> AsyncIterator[Tuple[int, Callable]]:
+    # *part* holds the beginning of the stream
+    part_number = 1
+    while True:
+        while len(part) >= FILE_CHUNK_SIZE:
+            # hand the buffer over, only its tail is copied
+            data, part = part, part[FILE_CHUNK_SIZE:]
+            del data[FILE_CHUNK_SIZE:]
+            yield part_number, partial(_held_part, data)
+            del data
+            part_number += 1
+        try:
+            part += await chunks.__anext__()
+        except StopAsyncIteration:
+            break
+    if part:
+        yield part_number, partial(_held_part, part)
+
+
+async def put_stream(chunks: AsyncIterable[bytes],
+                     dst: str,
+                     public_read: bool = False) -> bool:
+    """ Put object from chunks as they come, holding a few parts in memory
+    at most
+    """
+    _ = dst.strip('/').split('/')
+    bucket = _[0]
+    key = '/'.join(_[1:])
+    acl = 'public-read' if public_read else 'private'
+    chunks = chunks.__aiter__()
+    # small objects are put at once
+    first = bytearray()
+    async for chunk in chunks:
+        first += chunk
+        if len(first) > FILE_CHUNK_SIZE:
+            break
+    try:
+        async with _use_client() as client:
+            if len(first) <= FILE_CHUNK_SIZE:
+                await client.put_object(Bucket=bucket,
+                                        Key=key,
+                                        Body=bytes(first),
+                                        ACL=acl)
+            else:
+                parts, first = _stream_parts(chunks, first), None
+                if not await _put_parts(client, bucket, key, acl, parts):
+                    return False
+    except ClientError:
+        return False
+    await _record_object(bucket, key, acl)
+    logger.info(f'Put stream to "{dst}".')
+    return True
 
 
 async def get(src: str, dst: str = None) -> Union[bytes, bool]:
@@ -278,7 +539,7 @@ async def get(src: str, dst: str = None) -> Union[bytes, bool]:
     _ = src.strip('/').split('/')
     bucket = _[0]
     key = '/'.join(_[1:])
-    async with _create_client() as client:
+    async with _use_client() as client:
         try:
             resp = await client.get_object(Bucket=bucket, Key=key)
         except ClientError:
@@ -295,6 +556,22 @@ async def get(src: str, dst: str = None) -> Union[bytes, bool]:
                 return await stream.read()
 
 
+async def stream(src: str,
+                 chunk_size: int = 1 << 16) -> AsyncIterator[bytes]:
+    """ Get file from bucket in chunks """
+    _ = src.strip('/').split('/')
+    bucket = _[0]
+    key = '/'.join(_[1:])
+    async with _use_client() as client:
+        try:
+            resp = await client.get_object(Bucket=bucket, Key=key)
+        except ClientError:
+            raise FileNotFoundError(src)
+        async with resp['Body'] as body:
+            async for chunk in body.iter_chunked(chunk_size):
+                yield chunk
+
+
 async def rm(path: str):
     """ Delete file from bucket """
     _ = path.strip('/').split('/')
@@ -302,9 +579,10 @@ async def rm(path: str):
     key = '/'.join(_[1:])
     if path.endswith('/'):
         key += '/'
-    async with _create_client() as client:
+    async with _use_client() as client:
         try:
             await client.delete_object(Bucket=bucket, Key=key)
+            await _record_object(bucket, key, None)
             logger.info(f'Delete file "{path}" from bucket.')
         except ClientError:
             pass
@@ -312,21 +590,15 @@ async def rm(path: str):
 
 async def du() -> Tuple[Tuple[int, int, str]]:
     """ Disk usage by buckets """
-    async with _create_client() as client:
-        buckets = [
-            item['Name'] for item in (await client.list_buckets())['Buckets']
-        ]
-        ret = []
-        for bucket in buckets:
-            try:
-                objs = (await client.list_objects(Bucket=bucket))['Contents']
-                size = sum([obj['Size'] for obj in objs])
-                count = len(objs)
-                ret.append((size, count, bucket))
-            except KeyError:
-                ret.append((0, 0, bucket))
-        logger.info('Show disk usage by buckets.')
-        return tuple(ret)
+    ret = []
+    for bucket in await _buckets():
+        size = count = 0
+        async for item in iter_objects(bucket):
+            size += item['Size']
+            count += 1
+        ret.append((size, count, bucket))
+    logger.info('Show disk usage by buckets.')
+    return tuple(ret)
 
 
 async def cp(src: str, dst: str) -> bool:
@@ -335,8 +607,10 @@ async def cp(src: str, dst: str) -> bool:
     bucket = _[0]
     key = '/'.join(_[1:])
     try:
-        async with _create_client() as client:
+        async with _use_client() as client:
             await client.copy_object(Bucket=bucket, Key=key, CopySource=src)
+            # ACL is not copied
+            await _record_object(bucket, key, 'private')
             logger.info(f'Copy object "{src}" to "{dst}".')
             return True
     except ClientError:
@@ -360,7 +634,7 @@ async def _modify_bucket_acl(
     # about ACL, see
     # https://docs.aws.amazon.com/AmazonS3/latest/userguide/acl-overview.html
     try:
-        async with _create_client() as client:
+        async with _use_client() as client:
             await client.put_bucket_acl(Bucket=bucket, ACL=acl)
             logger.info(f'Modify ACL of bucket "{bucket}" as "{acl}".')
             return True
@@ -380,8 +654,9 @@ async def _modify_object_acl(
     bucket = _[0]
     key = '/'.join(_[1:])
     try:
-        async with _create_client() as client:
+        async with _use_client() as client:
             await client.put_object_acl(Bucket=bucket, Key=key, ACL=acl)
+            await _record_object(bucket, key, acl)
             logger.info(f'Modify ACL of object "{path}" as "{acl}".')
             return True
     except ClientError:
@@ -392,7 +667,10 @@ async def _generate_temporary_url(path: str, expiration: int = 3600) -> str:
     _ = path.strip('/').split('/')
     bucket = _[0]
     key = '/'.join(_[1:])
-    async with _create_client() as client:
+    cache_key = (bucket, quote(key, safe=''), expiration)
+    if (url := _presigned_cache.get(cache_key)) is not None:
+        return url.decode()
+    async with _use_client() as client:
         try:
             url = await client.generate_presigned_url(
                 'get_object',
@@ -404,9 +682,13 @@ async def _generate_temporary_url(path: str, expiration: int = 3600) -> str:
             )
             logger.info('Generate presigned url expiring in '
                         f'{expiration} seconds for object "{path}".')
-            return url
         except ClientError:
             return ''
+    _presigned_cache.set(cache_key,
+                         url.encode(),
+                         ttl=max(expiration - PRESIGNED_URL_MARGIN,
+                                 expiration / 2))
+    return url
 
 
 async def url(path: str, expiration: int = None) -> str:
@@ -414,17 +696,25 @@ async def url(path: str, expiration: int = None) -> str:
     _ = path.strip('/').split('/')
     bucket = _[0]
     key = '/'.join(_[1:])
-    async with _create_client() as client:
-        try:
-            acl = await client.get_object_acl(Bucket=bucket, Key=key)
-        except ClientError:
-            return ''
-        if expiration or 'http://acs.amazonaws.com/groups/global/AllUsers' \
-                not in str(acl['Grants']):
-            return await _generate_temporary_url(path, expiration or 3600)
+    if expiration:
+        return await _generate_temporary_url(path, expiration)
+    if (acl := _recorded_acl(bucket, key)) is None:
+        # objects not put by this module are asked once
+        async with _use_client() as client:
+            try:
+                resp = await client.get_object_acl(Bucket=bucket, Key=key)
+            except ClientError:
+                return ''
+        if 'http://acs.amazonaws.com/groups/global/AllUsers' in str(
+                resp['Grants']):
+            acl = 'public-read'
         else:
-            logger.info(f'Get permanent url for object "{path}".')
-            return ENDPOINT_URL.rstrip('/') + '/' + path.lstrip('/')
+            acl = 'private'
+        await _record_object(bucket, key, acl)
+    if acl not in PUBLIC_ACLS:
+        return await _generate_temporary_url(path, 3600)
+    logger.info(f'Get permanent url for object "{path}".')
+    return ENDPOINT_URL.rstrip('/') + '/' + path.lstrip('/')
 
 
 async def has(path: str) -> bool:
@@ -432,13 +722,42 @@ async def has(path: str) -> bool:
     _ = path.strip('/').split('/')
     bucket = _[0]
     key = '/'.join(_[1:])
-    async with _create_client() as client:
+    known = await run_sync(_inventory.lookup)(bucket, key)
+    if known is not None:
+        return known
+    async with _use_client() as client:
         try:
             await client.head_object(Bucket=bucket, Key=key)
-            return True
         except ClientError:
             return False
+    await run_sync(_inventory.add)(bucket, key)
+    return True
 
 
-__all__ = ('mb', 'rb', 'ls', 'la', 'put', 'get', 'has', 'rm', 'du', 'cp', 'mv',
-           'url')
+async def reconcile(bucket: str = None) -> int:
+    """ Rebuild inventory of *bucket*, or of all buckets, from listings,
+    and abort stale multipart uploads. Return number of objects listed
+    """
+    count = 0
+    for bucket in (bucket, ) if bucket else await _buckets():
+        generation = await run_sync(_inventory.begin_reconcile)(bucket)
+        keys = []
+        async for item in iter_objects(bucket):
+            keys.append(item['Key'])
+            if len(keys) >= 1000:
+                await run_sync(_inventory.add_many)(bucket, keys)
+                count += len(keys)
+                keys.clear()
+        await run_sync(_inventory.add_many)(bucket, keys)
+        count += len(keys)
+        dropped = await run_sync(_inventory.end_reconcile)(bucket,
+                                                           generation)
+        aborted = await _abort_stale_uploads(bucket)
+        logger.info(f'Reconcile inventory of bucket "{bucket}", '
+                    f'{dropped} missing objects dropped, {aborted} stale '
+                    'uploads aborted.')
+    return count
+
+
+__all__ = ('mb', 'rb', 'ls', 'la', 'iter_objects', 'put', 'put_stream',
+           'get', 'stream', 'has', 'rm', 'du', 'cp', 'mv', 'url', 'reconcile')